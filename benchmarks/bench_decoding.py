@@ -0,0 +1,135 @@
+"""
+Compare inline stream decoding with decoding in a thread or process pool.
+
+Each mode pushes the same stream through a TwitterStreamService and reports
+the messages delivered per second, along with the worst delay seen by a timer
+that should fire every 10ms. The timer stands in for the other connections
+sharing the reactor: the longer it is held up, the more they are starved.
+
+Run with ``python benchmarks/bench_decoding.py [messages]``.
+"""
+
+import sys
+from timeit import default_timer
+
+from twisted.internet import reactor, task
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+
+from txtwitter.decoding import ProcessPoolDecoder, ThreadPoolDecoder
+from txtwitter.streamservice import TwitterStreamService
+
+from payloads import make_stream_lines
+
+
+CHUNK_SIZE = 16384
+TICK = 0.01
+
+
+class FeedResponse(object):
+    """
+    A streaming response that delivers canned data a chunk per reactor
+    iteration, and acts as its own transport.
+    """
+    code = 200
+    disconnecting = False
+
+    def __init__(self, data):
+        self._chunks = [
+            data[i:i + CHUNK_SIZE] for i in xrange(0, len(data), CHUNK_SIZE)]
+        self._chunks.reverse()
+        self._paused = False
+        self._protocol = None
+
+    def deliverBody(self, protocol):
+        self._protocol = protocol
+        protocol.makeConnection(self)
+        reactor.callLater(0, self._feed)
+
+    def _feed(self):
+        if self._paused or not self._chunks:
+            return
+        self._protocol.dataReceived(self._chunks.pop())
+        reactor.callLater(0, self._feed)
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        reactor.callLater(0, self._feed)
+
+    def stopProducing(self):
+        self._chunks = []
+
+
+class LatencyProbe(object):
+    """
+    Measures how late a regular timer fires.
+    """
+
+    def __init__(self):
+        self.max_delay = 0
+        self._last = None
+        self._loop = task.LoopingCall(self._tick)
+
+    def _tick(self):
+        now = default_timer()
+        if self._last is not None:
+            self.max_delay = max(self.max_delay, now - self._last - TICK)
+        self._last = now
+
+    def start(self):
+        self._loop.start(TICK)
+
+    def stop(self):
+        self._loop.stop()
+
+
+def run_stream(data, count, decoder):
+    done = Deferred()
+    received = [0]
+
+    def delegate(message):
+        received[0] += 1
+        if received[0] == count:
+            done.callback(None)
+
+    svc = TwitterStreamService(
+        lambda: succeed(FeedResponse(data)), delegate, decoder=decoder)
+    probe = LatencyProbe()
+
+    def finished(_):
+        elapsed = default_timer() - start
+        probe.stop()
+        svc.stopService()
+        return count / elapsed, probe.max_delay
+
+    probe.start()
+    start = default_timer()
+    svc.startService()
+    return done.addCallback(finished)
+
+
+@inlineCallbacks
+def main(_reactor, count=20000):
+    lines = make_stream_lines(1000)
+    lines = (lines * (count // len(lines) + 1))[:count]
+    data = ''.join(line + '\r\n' for line in lines)
+    print "%d messages, %d bytes" % (count, len(data))
+    print
+
+    process_decoder = ProcessPoolDecoder()
+    modes = [
+        ('inline', None),
+        ('threads', ThreadPoolDecoder()),
+        ('processes', process_decoder),
+    ]
+    print "%-12s %16s %18s" % ('mode', 'messages/sec', 'max timer delay')
+    for name, decoder in modes:
+        rate, delay = yield run_stream(data, count, decoder)
+        print "%-12s %16.0f %16.1fms" % (name, rate, delay * 1000)
+    process_decoder.close()
+
+
+if __name__ == '__main__':
+    task.react(main, [int(arg) for arg in sys.argv[1:]])
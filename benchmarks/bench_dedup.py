@@ -0,0 +1,93 @@
+"""
+Compare the ID stores available for stream de-duplication.
+
+Each store is fed the same sequence of tweet-like IDs, in which 10% are
+repeats of an ID from shortly before (as after a reconnect or from an
+overlapping stream). For each store we report the IDs checked per second, the
+memory used per remembered ID, the repeats it missed (false negatives) and
+the new IDs it wrongly reported as repeats (false positives). An unbounded
+set is included for comparison.
+
+Run with ``python benchmarks/bench_dedup.py [remembered IDs]``.
+"""
+
+import random
+import sys
+from timeit import default_timer
+
+from txtwitter.dedup import BloomIDs, RecentIDs
+
+
+class SetIDs(object):
+    """
+    The unbounded set that consumers would otherwise use.
+    """
+
+    def __init__(self):
+        self._ids = set()
+
+    def add(self, id):
+        if id in self._ids:
+            return False
+        self._ids.add(id)
+        return True
+
+    def memory_size(self):
+        return sys.getsizeof(self._ids) + sum(
+            sys.getsizeof(id) for id in self._ids)
+
+
+def make_ids(count, seed=0):
+    """
+    Build a list of snowflake-style IDs with some recent repeats, and the set
+    of positions that are repeats.
+    """
+    rand = random.Random(seed)
+    ids = []
+    repeats = set()
+    snowflake = 500000000000000000
+    for i in xrange(count):
+        if ids and rand.random() < 0.1:
+            ids.append(ids[-rand.randint(1, min(len(ids), 1000))])
+            repeats.add(i)
+        else:
+            snowflake += rand.randint(1, 1 << 22)
+            ids.append(snowflake)
+    return ids, repeats
+
+
+def bench(store, ids, repeats, remembered):
+    start = default_timer()
+    results = [store.add(id) for id in ids]
+    elapsed = default_timer() - start
+    # An ID that was dropped as a repeat but isn't one is a false positive,
+    # and a repeat that was let through is a false negative.
+    false_positives = sum(
+        1 for i, new in enumerate(results) if not new and i not in repeats)
+    false_negatives = sum(
+        1 for i, new in enumerate(results) if new and i in repeats)
+    return (len(ids) / elapsed, float(store.memory_size()) / remembered,
+            false_positives, false_negatives)
+
+
+def main(remembered=100000):
+    count = remembered * 3
+    ids, repeats = make_ids(count)
+    print "%d IDs, %d repeats, remembering %d" % (
+        count, len(repeats), remembered)
+    print
+    stores = [
+        ('set', SetIDs(), count - len(repeats)),
+        ('recent', RecentIDs(remembered), remembered),
+        ('bloom 0.1%', BloomIDs(remembered), remembered),
+        ('bloom 1%', BloomIDs(remembered, error_rate=0.01), remembered),
+    ]
+    print "%-12s %12s %12s %10s %10s" % (
+        'store', 'IDs/sec', 'bytes/ID', 'false +', 'false -')
+    for name, store, remembered_ids in stores:
+        rate, per_id, fp, fn = bench(store, ids, repeats, remembered_ids)
+        print "%-12s %12.0f %12.1f %10d %10d" % (name, rate, per_id, fp, fn)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,52 @@
+"""
+Compare the installed JSON codecs on realistic stream and timeline payloads.
+
+Run with ``python benchmarks/bench_json.py [iterations]``.
+"""
+
+import sys
+from timeit import default_timer
+
+from txtwitter.codec import available_codecs, get_codec
+
+from payloads import make_stream_lines, make_timeline_body
+
+
+def bench_stream(codec, lines, iterations):
+    loads = codec.loads
+    start = default_timer()
+    for _ in xrange(iterations):
+        for line in lines:
+            loads(line)
+    elapsed = default_timer() - start
+    return iterations * len(lines) / elapsed
+
+
+def bench_timeline(codec, body, iterations):
+    loads = codec.loads
+    start = default_timer()
+    for _ in xrange(iterations):
+        loads(body)
+    elapsed = default_timer() - start
+    return iterations / elapsed
+
+
+def main(iterations=20):
+    lines = make_stream_lines(1000)
+    body = make_timeline_body(200)
+    print "Stream: %d messages, %d bytes total" % (
+        len(lines), sum(len(line) for line in lines))
+    print "Timeline: 200 tweets, %d bytes" % (len(body),)
+    print
+    print "%-12s %16s %16s" % ('codec', 'messages/sec', 'timelines/sec')
+    for name in available_codecs():
+        codec = get_codec(name)
+        print "%-12s %16.0f %16.1f" % (
+            name, bench_stream(codec, lines, iterations),
+            bench_timeline(codec, body, iterations * 5))
+    print
+    print "get_codec('fastest') selects: %s" % (get_codec('fastest').name,)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,68 @@
+"""
+Compare request signing throughput of oauthlib and OAuthSigner.
+
+Run with ``python benchmarks/bench_oauth.py [iterations]``.
+"""
+
+import sys
+from timeit import default_timer
+from urllib import urlencode
+
+from oauthlib import oauth1
+
+from txtwitter.oauth import OAuthSigner
+
+
+CREDS = ('consumer-key', 'consumer-secret', 'token-key', 'token-secret')
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+REQUESTS = [
+    ('https://api.twitter.com/1.1/statuses/home_timeline.json'
+     '?count=200&since_id=123456789012345678', 'GET', None, {}),
+    ('https://api.twitter.com/1.1/statuses/update.json', 'POST',
+     urlencode({'status': 'Hello, world! #txtwitter', 'trim_user': 'true'}),
+     FORM_HEADERS),
+]
+
+
+def oauthlib_sign(uri, method, body, headers, **kw):
+    consumer_key, consumer_secret, token_key, token_secret = CREDS
+    client = oauth1.Client(
+        consumer_key, client_secret=consumer_secret,
+        resource_owner_key=token_key, resource_owner_secret=token_secret,
+        encoding='utf-8', decoding='utf-8', **kw)
+    return client.sign(uri, http_method=method, body=body, headers=headers)
+
+
+def check_identical(signer):
+    for uri, method, body, headers in REQUESTS:
+        expected = oauthlib_sign(
+            uri, method, body, headers, nonce='1234', timestamp='1400000000')
+        signed = signer.sign(
+            uri, method, body, headers, nonce='1234', timestamp='1400000000')
+        if signed != expected:
+            raise AssertionError("Mismatch:\n%r\n%r" % (expected, signed))
+
+
+def bench(name, sign, iterations):
+    start = default_timer()
+    for _ in xrange(iterations):
+        for uri, method, body, headers in REQUESTS:
+            sign(uri, method, body, headers)
+    elapsed = default_timer() - start
+    rate = iterations * len(REQUESTS) / elapsed
+    print "%-12s %10.0f signatures/sec" % (name, rate)
+    return rate
+
+
+def main(iterations=5000):
+    signer = OAuthSigner(*CREDS)
+    check_identical(signer)
+    print "Output is byte-identical for %d requests." % (len(REQUESTS),)
+    old = bench('oauthlib', oauthlib_sign, iterations)
+    new = bench('OAuthSigner', signer.sign, iterations)
+    print "Speedup: %.1fx" % (new / old,)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
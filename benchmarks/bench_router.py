@@ -0,0 +1,93 @@
+"""
+Compare routing stream messages with MessageRouter against the usual chain
+of checks in a delegate.
+
+The chain tests for each kind of message in turn, using the functions in
+txtwitter.messagetools for tweets and DMs and a key lookup for everything
+else, so rarer kinds of message go through every check before them. Both are
+measured on decoded messages and on undecoded envelopes.
+
+Run with ``python benchmarks/bench_router.py [iterations]``.
+"""
+
+import sys
+from timeit import default_timer
+
+from txtwitter.envelope import MessageEnvelope
+from txtwitter.messagetools import is_dm, is_tweet
+from txtwitter.router import MESSAGE_KINDS, MessageRouter
+
+from payloads import make_stream_lines, make_stream_messages
+
+
+def make_chain_delegate(counts):
+    def delegate(message):
+        if is_tweet(message):
+            counts['tweet'] += 1
+        elif 'delete' in message:
+            counts['delete'] += 1
+        elif 'limit' in message:
+            counts['limit'] += 1
+        elif is_dm(message) or 'direct_message' in message:
+            counts['dm'] += 1
+        elif 'event' in message:
+            counts['event'] += 1
+        elif 'warning' in message:
+            counts['warning'] += 1
+        elif 'friends' in message or 'friends_str' in message:
+            counts['friends'] += 1
+        else:
+            counts['unknown'] += 1
+    return delegate
+
+
+def make_router_delegate(counts):
+    def handler(kind):
+        def handle(message):
+            counts[kind] += 1
+        return handle
+    return MessageRouter(**dict((kind, handler(kind)) for kind in counts))
+
+
+def bench(make_delegate, make_messages, iterations):
+    counts = dict((kind, 0) for kind in MESSAGE_KINDS)
+    delegate = make_delegate(counts)
+    elapsed = 0
+    total = 0
+    for _ in xrange(iterations):
+        # Envelopes cache their decoded contents, so each iteration needs
+        # fresh ones. Building them is not part of the measurement.
+        messages = make_messages()
+        start = default_timer()
+        for message in messages:
+            delegate(message)
+        elapsed += default_timer() - start
+        total += len(messages)
+    return total / elapsed, counts
+
+
+def main(iterations=20):
+    messages = make_stream_messages(1000)
+    lines = make_stream_lines(1000)
+    inputs = [
+        ('dicts', lambda: messages),
+        ('envelopes', lambda: [MessageEnvelope(line) for line in lines]),
+    ]
+    delegates = [
+        ('chain', make_chain_delegate),
+        ('router', make_router_delegate),
+    ]
+    print "%d messages x %d iterations" % (len(messages), iterations)
+    print
+    print "%-10s %-8s %16s" % ('input', 'delegate', 'messages/sec')
+    for input_name, make_messages in inputs:
+        results = []
+        for name, make_delegate in delegates:
+            rate, counts = bench(make_delegate, make_messages, iterations)
+            results.append(counts)
+            print "%-10s %-8s %16.0f" % (input_name, name, rate)
+        assert results[0] == results[1], results
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
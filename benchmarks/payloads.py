@@ -0,0 +1,156 @@
+"""
+Realistic Twitter API payloads for benchmarks.
+"""
+
+import json
+import random
+
+
+def make_user(i):
+    return {
+        'id': 100000 + i,
+        'id_str': str(100000 + i),
+        'name': 'Benchmark User %d' % (i,),
+        'screen_name': 'bench_user_%d' % (i,),
+        'location': 'Cape Town, South Africa',
+        'description': (
+            u'Just a user generated for benchmarking purposes. Likes long '
+            u'walks on the beach and well-formed JSON. \u2603'),
+        'url': 'http://t.co/abcdefghij',
+        'protected': False,
+        'followers_count': 1234 + i,
+        'friends_count': 567,
+        'listed_count': 12,
+        'created_at': 'Wed Aug 27 13:08:45 +0000 2008',
+        'favourites_count': 89,
+        'utc_offset': 7200,
+        'time_zone': 'Pretoria',
+        'geo_enabled': True,
+        'verified': False,
+        'statuses_count': 9876,
+        'lang': 'en',
+        'profile_background_color': 'C0DEED',
+        'profile_image_url': (
+            'http://pbs.twimg.com/profile_images/1/bench_normal.png'),
+        'profile_image_url_https': (
+            'https://pbs.twimg.com/profile_images/1/bench_normal.png'),
+        'default_profile': True,
+        'following': None,
+        'notifications': None,
+    }
+
+
+def make_tweet(i):
+    text = u'@bench_user_%d this is tweet %d about #txtwitter \u2603' % (
+        i + 1, i)
+    return {
+        'created_at': 'Mon Sep 24 03:35:21 +0000 2012',
+        'id': 250000000000000000 + i,
+        'id_str': str(250000000000000000 + i),
+        'text': text,
+        'source': '<a href="http://example.com" rel="nofollow">bench</a>',
+        'truncated': False,
+        'in_reply_to_status_id': None,
+        'in_reply_to_status_id_str': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_user_id_str': None,
+        'in_reply_to_screen_name': None,
+        'user': make_user(i),
+        'geo': None,
+        'coordinates': None,
+        'place': None,
+        'contributors': None,
+        'retweet_count': i % 17,
+        'favorite_count': i % 5,
+        'entities': {
+            'hashtags': [{'text': 'txtwitter', 'indices': [45, 55]}],
+            'symbols': [],
+            'urls': [],
+            'user_mentions': [{
+                'screen_name': 'bench_user_%d' % (i + 1,),
+                'name': 'Benchmark User %d' % (i + 1,),
+                'id': 100001 + i,
+                'id_str': str(100001 + i),
+                'indices': [0, 13],
+            }],
+        },
+        'favorited': False,
+        'retweeted': False,
+        'filter_level': 'medium',
+        'lang': 'en',
+    }
+
+
+def make_delete(i):
+    return {'delete': {'status': {
+        'id': 240000000000000000 + i,
+        'id_str': str(240000000000000000 + i),
+        'user_id': 100000 + i,
+        'user_id_str': str(100000 + i),
+    }}}
+
+
+def make_limit(i):
+    return {'limit': {'track': 1000 + i}}
+
+
+def make_dm(i):
+    return {'direct_message': {
+        'id': 300000000000000000 + i,
+        'id_str': str(300000000000000000 + i),
+        'text': 'DM number %d' % (i,),
+        'created_at': 'Mon Sep 24 03:35:21 +0000 2012',
+        'sender': make_user(i),
+        'sender_id': 100000 + i,
+        'sender_id_str': str(100000 + i),
+        'sender_screen_name': 'bench_user_%d' % (i,),
+        'recipient': make_user(i + 1),
+        'recipient_id': 100001 + i,
+        'recipient_id_str': str(100001 + i),
+        'recipient_screen_name': 'bench_user_%d' % (i + 1,),
+        'entities': {'hashtags': [], 'urls': [], 'user_mentions': []},
+    }}
+
+
+def make_event(i):
+    return {
+        'event': 'follow',
+        'created_at': 'Mon Sep 24 03:35:21 +0000 2012',
+        'source': make_user(i),
+        'target': make_user(i + 1),
+    }
+
+
+def make_stream_messages(count, seed=0):
+    """
+    Build a list of stream messages with a realistic mix of message types.
+    """
+    rand = random.Random(seed)
+    messages = []
+    for i in xrange(count):
+        r = rand.random()
+        if r < 0.80:
+            messages.append(make_tweet(i))
+        elif r < 0.92:
+            messages.append(make_delete(i))
+        elif r < 0.95:
+            messages.append(make_limit(i))
+        elif r < 0.98:
+            messages.append(make_dm(i))
+        else:
+            messages.append(make_event(i))
+    return messages
+
+
+def make_stream_lines(count, seed=0):
+    """
+    Build a list of JSON-encoded stream messages.
+    """
+    return [json.dumps(msg) for msg in make_stream_messages(count, seed)]
+
+
+def make_timeline_body(count=200):
+    """
+    Build a JSON-encoded timeline response.
+    """
+    return json.dumps([make_tweet(i) for i in xrange(count)])
@@ -0,0 +1,274 @@
+"""
+Backfilling of stream gaps from the REST API.
+
+The streaming API doesn't replay messages that were sent while a stream was
+disconnected, so every reconnection leaves a gap. :class:`StreamBackfill`
+keeps track of the newest tweet and direct message a stream has delivered
+and, when the stream reconnects, pages through the matching REST timelines
+from there to fill the gap. Messages that turn up in both the stream and the
+backfill are only delivered once.
+"""
+
+from functools import partial
+
+from twisted.internet.defer import (
+    CancelledError, DeferredSemaphore, gatherResults, succeed)
+from twisted.python import log
+
+from txtwitter.router import DM, TWEET, message_id, message_kind
+
+
+class StreamBackfill(object):
+    """
+    Fills the gaps left in a stream by reconnections, using the REST API.
+
+    Give this to :class:`txtwitter.streamservice.TwitterStreamService` (or
+    :meth:`txtwitter.twitter.TwitterClient.userstream_user`) as ``backfill``.
+    Every time the stream reconnects, each configured source is fetched with
+    ``since_id`` set to the newest ID of that kind seen so far, paging back
+    with ``max_id`` until the gap is covered. The backfilled messages are
+    delivered to the stream's delegate, oldest first, with any that the
+    stream has already delivered removed. Backfilled direct messages are
+    wrapped in a ``direct_message`` key, as they are in user streams.
+
+    Only one backfill runs at a time. If another is started before the last
+    one has finished, the last one is abandoned and the new one covers its
+    gap as well.
+
+    Nothing is backfilled for a kind of message until an ID for it is known,
+    so the first connection is not backfilled unless :attr:`last_tweet_id` or
+    :attr:`last_dm_id` is set beforehand (for example, from IDs saved by a
+    previous run).
+
+    :param client: The :class:`txtwitter.twitter.TwitterClient` to use.
+
+    :param bool mentions:
+        If ``True``, backfill tweets from
+        :meth:`~txtwitter.twitter.TwitterClient.statuses_mentions_timeline`.
+
+    :param str user_id:
+        If not ``None``, backfill tweets from this user's
+        :meth:`~txtwitter.twitter.TwitterClient.statuses_user_timeline`.
+
+    :param bool direct_messages:
+        If ``True``, backfill direct messages from
+        :meth:`~txtwitter.twitter.TwitterClient.direct_messages`.
+
+    :param int count:
+        The number of messages to request per page. Defaults to
+        :attr:`COUNT`.
+
+    :param int max_pages:
+        The largest number of pages to fetch from each source per
+        reconnection. A gap too long to fill in this many pages is only
+        partly filled. Defaults to :attr:`MAX_PAGES`.
+
+    :param int max_concurrent:
+        The largest number of backfill requests to have in flight at once,
+        across all sources, so that backfilling doesn't use up the rate limits
+        all at once. Defaults to :attr:`MAX_CONCURRENT`.
+    """
+
+    COUNT = 200
+    MAX_PAGES = 5
+    MAX_CONCURRENT = 1
+
+    last_tweet_id = None
+    last_dm_id = None
+
+    def __init__(self, client, mentions=True, user_id=None,
+                 direct_messages=False, count=None, max_pages=None,
+                 max_concurrent=None):
+        if count is None:
+            count = self.COUNT
+        if max_pages is None:
+            max_pages = self.MAX_PAGES
+        if max_concurrent is None:
+            max_concurrent = self.MAX_CONCURRENT
+        self._sources = []
+        if mentions:
+            self._sources.append((TWEET, client.statuses_mentions_timeline))
+        if user_id is not None:
+            self._sources.append((TWEET, partial(
+                client.statuses_user_timeline, user_id=user_id)))
+        if direct_messages:
+            self._sources.append((DM, client.direct_messages))
+        self.count = count
+        self.max_pages = max_pages
+        self._semaphore = DeferredSemaphore(max_concurrent)
+        # IDs delivered while a backfill is running, and the IDs it delivers
+        # itself, so that each message is only delivered once.
+        self._seen = set()
+        self._running = 0
+        self._generation = 0
+        self._in_flight = set()
+        # The IDs the unfinished backfill started from, by kind.
+        self._since = {}
+        self._backfills = 0
+        self._requests = 0
+        self._backfilled = 0
+        self._duplicates = 0
+        self._truncated = 0
+
+    def _get_last_id(self, kind):
+        return self.last_tweet_id if kind == TWEET else self.last_dm_id
+
+    def _update_last_id(self, kind, id_str):
+        last_id = self._get_last_id(kind)
+        if last_id is None or int(id_str) > int(last_id):
+            if kind == TWEET:
+                self.last_tweet_id = id_str
+            else:
+                self.last_dm_id = id_str
+
+    def message_seen(self, message):
+        """
+        Record a message delivered by the stream.
+
+        :returns:
+            ``False`` if the message has already been delivered by a backfill
+            and should be dropped, otherwise ``True``.
+        """
+        kind = message_kind(message)
+        if kind not in (TWEET, DM):
+            return True
+        id_str = message_id(message, kind)
+        if id_str is None:
+            return True
+        if id_str in self._seen:
+            self._duplicates += 1
+            return False
+        if self._running:
+            self._seen.add(id_str)
+        self._update_last_id(kind, id_str)
+        return True
+
+    def start(self, deliver):
+        """
+        Start backfilling from the newest IDs seen so far, or from where the
+        last backfill started if it didn't finish.
+
+        :param deliver: A function to call with each backfilled message.
+
+        :returns: A ``Deferred`` that fires when the backfill is complete.
+        """
+        resuming = bool(self._since)
+        if resuming:
+            # The gap the unfinished backfill was filling is the start of the
+            # new one, so we stop it and start again from where it started.
+            self.stop()
+        since = {}
+        runs = []
+        for kind, fetch in self._sources:
+            since_id = self._since.get(kind, self._get_last_id(kind))
+            if since_id is not None:
+                since[kind] = since_id
+                runs.append((kind, fetch, since_id))
+        if not runs:
+            return succeed(None)
+
+        if not (self._running or resuming):
+            self._seen.clear()
+        self._since = since
+        self._running += 1
+        self._backfills += 1
+        generation = self._generation
+        remaining = [len(runs)]
+
+        def _source_done(_):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self._running -= 1
+                if generation == self._generation:
+                    self._since = {}
+
+        ds = []
+        for kind, fetch, since_id in runs:
+            pages = []
+            d = self._fetch_page(
+                kind, fetch, since_id, None, pages, deliver, generation)
+            d.addErrback(
+                self._source_failed, kind, pages, deliver, generation)
+            d.addCallback(_source_done)
+            ds.append(d)
+        return gatherResults(ds).addCallback(lambda _: None)
+
+    def stop(self):
+        """
+        Abandon any backfills in progress.
+        """
+        self._generation += 1
+        for d in list(self._in_flight):
+            d.cancel()
+
+    def _request(self, fetch, since_id, max_id, generation):
+        if generation != self._generation:
+            return succeed(None)
+        self._requests += 1
+        d = fetch(count=self.count, since_id=since_id, max_id=max_id)
+        self._in_flight.add(d)
+
+        def _done(result):
+            self._in_flight.discard(d)
+            return result
+        return d.addBoth(_done)
+
+    def _fetch_page(self, kind, fetch, since_id, max_id, pages, deliver,
+                    generation):
+        d = self._semaphore.run(
+            self._request, fetch, since_id, max_id, generation)
+        d.addCallback(
+            self._page_received, kind, fetch, since_id, pages, deliver,
+            generation)
+        return d
+
+    def _page_received(self, items, kind, fetch, since_id, pages, deliver,
+                       generation):
+        if generation != self._generation:
+            return
+        if items:
+            pages.append(items)
+            min_id = min(int(item['id_str']) for item in items)
+            if min_id - 1 > int(since_id):
+                if len(pages) < self.max_pages:
+                    return self._fetch_page(
+                        kind, fetch, since_id, str(min_id - 1), pages,
+                        deliver, generation)
+                self._truncated += 1
+        self._deliver(kind, pages, deliver)
+
+    def _deliver(self, kind, pages, deliver):
+        items = [item for page in pages for item in page]
+        items.sort(key=lambda item: int(item['id_str']))
+        for item in items:
+            id_str = item['id_str']
+            if id_str in self._seen:
+                self._duplicates += 1
+                continue
+            self._seen.add(id_str)
+            self._update_last_id(kind, id_str)
+            self._backfilled += 1
+            if kind == DM:
+                item = {'direct_message': item}
+            deliver(item)
+
+    def _source_failed(self, failure, kind, pages, deliver, generation):
+        if failure.check(CancelledError) or generation != self._generation:
+            return
+        log.err(failure, "Error backfilling stream")
+        # The pages we did get are the newest part of the gap, which is
+        # better than nothing.
+        self._deliver(kind, pages, deliver)
+
+    def get_stats(self):
+        """
+        Return a dict of backfill statistics.
+        """
+        return {
+            'backfills': self._backfills,
+            'running': self._running,
+            'requests': self._requests,
+            'backfilled': self._backfilled,
+            'duplicates': self._duplicates,
+            'truncated': self._truncated,
+        }
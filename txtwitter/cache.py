@@ -0,0 +1,189 @@
+"""
+Caching of read-only API responses.
+
+Some endpoints return data that is safe to reuse for a while, so there is no
+need to fetch it again every time it is asked for. :class:`ResponseCache`
+keeps recent responses for a configurable time per endpoint, evicting the
+least recently used entries when it is full.
+"""
+
+from collections import OrderedDict
+
+
+# Default cache lifetimes (in seconds) for responses from endpoints that are
+# safe to cache. Resources not listed here are not cached.
+DEFAULT_TTLS = {
+    'statuses/show.json': 60,
+    'direct_messages/show.json': 60 * 60,
+}
+
+
+def _param_value(value):
+    # An ID given as an int makes the same request as the same ID given as a
+    # str, so they have to make the same key.
+    if isinstance(value, (int, long)):
+        return str(value)
+    return value
+
+
+def _params_key(parameters):
+    return tuple(sorted(
+        (name, _param_value(value))
+        for name, value in (parameters or {}).items()))
+
+
+class ResponseCache(object):
+    """
+    A bounded cache of API responses with a lifetime for each resource.
+
+    Every caller that gets a cached response receives the same object, so
+    callers should not modify it.
+
+    A cache may be shared between several clients. Responses are cached per
+    access token, since what a request returns can depend on who made it, so
+    one account never gets a response cached for another.
+
+    :param dict ttls:
+        A dict mapping resource paths (for example ``'statuses/show.json'``)
+        to the number of seconds their responses may be cached for. Responses
+        from resources not in this dict are not cached. If ``None``,
+        :data:`DEFAULT_TTLS` is used.
+
+    :param int max_entries:
+        The maximum number of responses to keep. When the cache is full, the
+        least recently used response is evicted.
+
+    :param clock:
+        An ``IReactorTime`` provider. If ``None``, the global reactor will be
+        used.
+    """
+
+    MAX_ENTRIES_DEFAULT = 1000
+
+    def __init__(self, ttls=None, max_entries=MAX_ENTRIES_DEFAULT, clock=None):
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.ttls = dict(ttls)
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        # This is incremented whenever entries are invalidated, so responses
+        # to requests made before the invalidation aren't cached afterwards.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_cacheable(self, resource):
+        """
+        Return ``True`` if responses from a resource are cached.
+        """
+        return self.ttls.get(resource, 0) > 0
+
+    def get(self, resource, parameters, default=None, token=None):
+        """
+        Get a cached response.
+
+        :param str resource: The resource path.
+
+        :param dict parameters: The request parameters.
+
+        :param str token: The access token the request would be made with.
+
+        :returns:
+            The cached response, or ``default`` if there is no unexpired
+            response in the cache.
+        """
+        if not self.is_cacheable(resource):
+            return default
+        key = (token, resource, _params_key(parameters))
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= self.clock.seconds():
+            self.misses += 1
+            return default
+        # Reinsert the entry to mark it as the most recently used.
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, resource, parameters, value, generation=None, token=None):
+        """
+        Cache a response, if responses from its resource are cacheable.
+
+        :param str resource: The resource path.
+
+        :param dict parameters: The request parameters.
+
+        :param value: The response.
+
+        :param int generation:
+            The value of :attr:`generation` when the request was made. If
+            entries have been invalidated since then, the response may be
+            stale and is not cached.
+
+        :param str token: The access token the request was made with.
+        """
+        if not self.is_cacheable(resource):
+            return
+        if generation is not None and generation != self.generation:
+            return
+        key = (token, resource, _params_key(parameters))
+        self._entries.pop(key, None)
+        self._entries[key] = (
+            self.clock.seconds() + self.ttls[resource], value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, resource=None, **parameters):
+        """
+        Remove cached responses, whichever access tokens they were cached
+        for.
+
+        :param str resource:
+            If given, only responses from this resource are removed.
+
+        :param parameters:
+            If given, only responses to requests with all of these parameter
+            values are removed.
+
+        :returns: The number of responses removed.
+        """
+        self.generation += 1
+        parameters = _params_key(parameters)
+        removed = 0
+        for key in list(self._entries):
+            _token, entry_resource, entry_params = key
+            if resource is not None and entry_resource != resource:
+                continue
+            if not all(param in entry_params for param in parameters):
+                continue
+            del self._entries[key]
+            removed += 1
+        self.invalidations += removed
+        return removed
+
+    def clear(self):
+        """
+        Remove all cached responses.
+        """
+        self.generation += 1
+        self._entries.clear()
+
+    def get_stats(self):
+        """
+        Return a dict of cache statistics.
+        """
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,84 @@
+"""
+Coalescing of identical concurrent requests.
+
+When several callers ask for the same thing at once (for example, many
+handlers looking up the same tweet), only the first call needs to go to the
+network. :class:`RequestCoalescer` makes later identical calls wait for the
+result of the one already in flight instead.
+"""
+
+from twisted.internet.defer import Deferred, maybeDeferred
+
+
+class RequestCoalescer(object):
+    """
+    Share the result of a call between all identical calls made while it is
+    in flight.
+
+    Every caller receives the same result object, so callers should not modify
+    it.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def in_flight(self):
+        """
+        Return the number of distinct calls currently in flight.
+        """
+        return len(self._in_flight)
+
+    def call(self, key, func, *args, **kw):
+        """
+        Call a function, unless a call with the same key is already in flight.
+
+        :param key:
+            A hashable key that identifies the call. Calls with equal keys
+            must be interchangeable.
+
+        :param func:
+            The function to call. It may return a ``Deferred``.
+
+        :returns:
+            A ``Deferred`` that fires with the result of the call. Cancelling
+            it only cancels the underlying call if no other callers are
+            waiting for its result.
+        """
+        self.calls += 1
+        waiters = self._in_flight.get(key)
+        if waiters is None:
+            d = maybeDeferred(func, *args, **kw)
+            if d.called:
+                # There's nothing to wait for.
+                return d
+            waiters = self._in_flight[key] = _Waiters(d)
+            d.addBoth(self._finished, key, waiters)
+        else:
+            self.coalesced += 1
+
+        waiter = Deferred(lambda w: self._cancel_waiter(key, waiters, w))
+        waiters.append(waiter)
+        return waiter
+
+    def _finished(self, result, key, waiters):
+        if self._in_flight.get(key) is waiters:
+            del self._in_flight[key]
+        for waiter in list(waiters):
+            # A waiter may have been cancelled by an earlier waiter's
+            # callbacks.
+            if not waiter.called:
+                waiter.callback(result)
+
+    def _cancel_waiter(self, key, waiters, waiter):
+        waiters.remove(waiter)
+        if not waiters and self._in_flight.get(key) is waiters:
+            del self._in_flight[key]
+            waiters.deferred.cancel()
+
+
+class _Waiters(list):
+    def __init__(self, deferred):
+        list.__init__(self)
+        self.deferred = deferred
@@ -0,0 +1,97 @@
+"""
+Pluggable JSON codecs.
+
+The stdlib ``json`` module is always available, but decoding is a significant
+CPU cost for busy streams, so faster third-party decoders may be used instead
+if they are installed. :func:`get_codec` picks a codec by name, falling back to
+the stdlib if the requested one is not installed.
+"""
+
+import json
+
+from twisted.python import log
+
+
+class JSONCodec(object):
+    """
+    A named pair of JSON ``loads`` and ``dumps`` functions.
+    """
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<JSONCodec %s>' % (self.name,)
+
+
+STDLIB_CODEC = JSONCodec('json', json.loads, json.dumps)
+
+
+def _load_ujson():
+    import ujson
+    return JSONCodec('ujson', ujson.loads, ujson.dumps)
+
+
+def _load_simplejson():
+    import simplejson
+    return JSONCodec('simplejson', simplejson.loads, simplejson.dumps)
+
+
+CODEC_LOADERS = {
+    'json': lambda: STDLIB_CODEC,
+    'ujson': _load_ujson,
+    'simplejson': _load_simplejson,
+}
+
+# Codecs to try (in order) when the fastest available one is requested.
+FASTEST_CODECS = ['ujson', 'simplejson', 'json']
+
+
+def available_codecs():
+    """
+    Return a list of the names of all installed codecs.
+    """
+    names = []
+    for name in sorted(CODEC_LOADERS):
+        try:
+            CODEC_LOADERS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(codec=None):
+    """
+    Get a JSON codec.
+
+    :param codec:
+        If ``None``, the stdlib codec is returned. If ``'fastest'``, the
+        fastest installed codec is returned. If a codec name (or a list of
+        names to try in order), the first installed codec is returned, falling
+        back to the stdlib if none of them are installed. Anything else is
+        assumed to already be a codec and is returned unmodified.
+
+    :returns: A :class:`JSONCodec`.
+    """
+    if codec is None:
+        return STDLIB_CODEC
+    if codec == 'fastest':
+        codec = FASTEST_CODECS
+    if isinstance(codec, basestring):
+        codec = [codec]
+    if not isinstance(codec, (list, tuple)):
+        return codec
+
+    for name in codec:
+        if name not in CODEC_LOADERS:
+            raise ValueError("Unknown JSON codec: %r" % (name,))
+        try:
+            return CODEC_LOADERS[name]()
+        except ImportError:
+            continue
+
+    log.msg("JSON codecs %r not installed, using stdlib json." % (codec,))
+    return STDLIB_CODEC
@@ -0,0 +1,189 @@
+"""
+gzip compression of API responses.
+
+Twitter will gzip response bodies for clients that ask for it, which saves a
+lot of bandwidth for JSON payloads. :class:`CompressedAgent` wraps another
+agent to request gzip encoding and transparently inflate the responses, and
+records how many bytes were received on the wire and how many they inflated
+to in a :class:`CompressionStats`.
+"""
+
+import zlib
+
+from twisted.internet.protocol import Protocol
+from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseFailed
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IAgent, IResponse, UNKNOWN_LENGTH
+from zope.interface import implementer
+
+
+class CompressionStats(object):
+    """
+    Counters for the bytes received by a :class:`CompressedAgent`.
+
+    :ivar int responses: The number of responses received.
+
+    :ivar int compressed_responses:
+        The number of responses that were gzip encoded.
+
+    :ivar int wire_bytes:
+        The number of body bytes received, before inflation.
+
+    :ivar int decoded_bytes:
+        The number of body bytes delivered, after inflation.
+    """
+
+    def __init__(self):
+        self.responses = 0
+        self.compressed_responses = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def ratio(self):
+        """
+        Return the ratio of wire bytes to decoded bytes, or ``None`` if no
+        bytes have been decoded.
+        """
+        if not self.decoded_bytes:
+            return None
+        return float(self.wire_bytes) / self.decoded_bytes
+
+    def get_stats(self):
+        """
+        Return a dict of compression statistics.
+        """
+        return {
+            'responses': self.responses,
+            'compressed_responses': self.compressed_responses,
+            'wire_bytes': self.wire_bytes,
+            'decoded_bytes': self.decoded_bytes,
+            'ratio': self.ratio(),
+        }
+
+
+def gzip_decompressor():
+    """
+    Return a ``zlib`` decompression object for gzip data.
+    """
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class DecodingProtocol(Protocol):
+    """
+    A protocol that inflates the body it receives and delivers the result to
+    another protocol, counting the bytes received and delivered.
+
+    :param protocol: The protocol to deliver the inflated body to.
+
+    :param stats: The :class:`CompressionStats` to update.
+
+    :param decompressor:
+        A ``zlib`` decompression object, or ``None`` if the body isn't
+        compressed.
+    """
+
+    def __init__(self, protocol, stats, decompressor=None):
+        self._protocol = protocol
+        self._stats = stats
+        self._decompressor = decompressor
+        self._error = None
+
+    def makeConnection(self, transport):
+        Protocol.makeConnection(self, transport)
+        self._protocol.makeConnection(transport)
+
+    def _deliver(self, data):
+        if data:
+            self._stats.decoded_bytes += len(data)
+            self._protocol.dataReceived(data)
+
+    def dataReceived(self, data):
+        if self._error is not None:
+            return
+        self._stats.wire_bytes += len(data)
+        if self._decompressor is None:
+            self._deliver(data)
+            return
+        try:
+            data = self._decompressor.decompress(data)
+        except zlib.error:
+            self._error = Failure()
+            self.transport.stopProducing()
+            return
+        self._deliver(data)
+
+    def connectionLost(self, reason):
+        if self._error is None and self._decompressor is not None:
+            try:
+                self._deliver(self._decompressor.flush())
+            except zlib.error:
+                self._error = Failure()
+        if self._error is not None:
+            reason = Failure(ResponseFailed([self._error, reason]))
+        self._protocol.connectionLost(reason)
+
+
+class DecodedResponse(proxyForInterface(IResponse)):
+    """
+    A response whose body is delivered through a :class:`DecodingProtocol`.
+    """
+
+    def __init__(self, response, stats, decompressor=None):
+        self.original = response
+        self._stats = stats
+        self._decompressor = decompressor
+
+    @property
+    def length(self):
+        if self._decompressor is not None:
+            return UNKNOWN_LENGTH
+        return self.original.length
+
+    def deliverBody(self, protocol):
+        self.original.deliverBody(
+            DecodingProtocol(protocol, self._stats, self._decompressor))
+
+
+@implementer(IAgent)
+class CompressedAgent(object):
+    """
+    An agent that requests gzip encoded responses and inflates them.
+
+    Responses that aren't gzip encoded are delivered unchanged, but are still
+    counted.
+
+    :param agent: The agent to make requests with.
+
+    :param stats:
+        The :class:`CompressionStats` to update. If ``None``, a new one is
+        created.
+    """
+
+    def __init__(self, agent, stats=None):
+        if stats is None:
+            stats = CompressionStats()
+        self._agent = agent
+        self.stats = stats
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        if headers is None:
+            headers = Headers()
+        else:
+            headers = headers.copy()
+        headers.setRawHeaders('accept-encoding', ['gzip'])
+        d = self._agent.request(method, uri, headers, bodyProducer)
+        return d.addCallback(self._handle_response)
+
+    def _handle_response(self, response):
+        self.stats.responses += 1
+        encodings = response.headers.getRawHeaders('content-encoding', [])
+        encodings = [
+            e.strip().lower() for value in encodings for e in value.split(',')]
+        if encodings == ['gzip']:
+            self.stats.compressed_responses += 1
+            response.headers.removeHeader('content-encoding')
+            response.headers.removeHeader('content-length')
+            return DecodedResponse(response, self.stats, gzip_decompressor())
+        return DecodedResponse(response, self.stats)
@@ -0,0 +1,220 @@
+"""
+Decoding of stream messages away from the reactor thread.
+
+At high message rates, decoding JSON on the reactor thread keeps it busy and
+starves every other connection in the process. A decoder from this module can
+be given to :class:`txtwitter.streamservice.TwitterStreamService`, which will
+then send the raw messages to it in batches and deliver the decoded results
+to its delegate in their original order.
+
+:class:`ThreadPoolDecoder` decodes in a thread pool, which is cheap to set up
+and works well with decoders that release the GIL. :class:`ProcessPoolDecoder`
+decodes in worker processes, which sidesteps the GIL at the cost of pickling
+the results back.
+"""
+
+import signal
+from multiprocessing import Pool
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import TimeoutError
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+
+from txtwitter.codec import get_codec
+
+
+def decode_lines(loads, lines):
+    """
+    Decode a list of raw messages.
+    """
+    return [loads(line) for line in lines]
+
+
+def _decode_in_worker(codec_name, lines):
+    # This runs in a worker process. multiprocessing in Python 2 has no way to
+    # report an exception from apply_async(), so we return it instead.
+    try:
+        return True, decode_lines(get_codec(codec_name).loads, lines)
+    except Exception as e:
+        return False, '%s: %s' % (type(e).__name__, e)
+
+
+def _init_worker():
+    # Workers inherit Twisted's SIGTERM handler, which only asks a reactor to
+    # stop. There is no reactor running in a worker, so Pool.terminate() would
+    # wait for it forever.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+class ThreadPoolDecoder(object):
+    """
+    Decodes batches of messages in a thread pool.
+
+    :param codec: The JSON codec to decode with, as for :func:`get_codec`.
+
+    :param threadpool:
+        The thread pool to decode in. If ``None``, the reactor's thread pool
+        is used.
+
+    :param int batch_size: The largest number of messages to send at once.
+
+    :param int max_pending:
+        The largest number of batches to have decoding at once. The stream is
+        paused while this many are outstanding.
+
+    :param reactor:
+        The reactor to deliver results on. If ``None``, the global reactor is
+        used.
+    """
+
+    BATCH_SIZE = 500
+    MAX_PENDING = 4
+
+    def __init__(self, codec=None, threadpool=None, batch_size=BATCH_SIZE,
+                 max_pending=MAX_PENDING, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        if threadpool is None:
+            threadpool = reactor.getThreadPool()
+        self.codec = get_codec(codec)
+        self.threadpool = threadpool
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.reactor = reactor
+
+    def decode(self, lines):
+        """
+        Decode a list of raw messages.
+
+        :returns: A ``Deferred`` that fires with a list of decoded messages.
+        """
+        return deferToThreadPool(
+            self.reactor, self.threadpool, decode_lines, self.codec.loads,
+            lines)
+
+    def close(self):
+        """
+        Do nothing, since the thread pool isn't ours to stop.
+
+        :returns: A ``Deferred`` that has already fired.
+        """
+        return succeed(None)
+
+
+class ProcessPoolDecoder(object):
+    """
+    Decodes batches of messages in a pool of worker processes.
+
+    The workers look the codec up by name, so it must be one of the codecs
+    known to :func:`get_codec`.
+
+    :param codec: The JSON codec to decode with, as for :func:`get_codec`.
+
+    :param int processes:
+        The number of worker processes. If ``None``, one per CPU is started.
+
+    :param int batch_size: The largest number of messages to send at once.
+
+    :param int max_pending:
+        The largest number of batches to have decoding at once. The stream is
+        paused while this many are outstanding.
+
+    :param float timeout:
+        The longest to wait for a batch to be decoded before failing it with
+        ``TimeoutError``. If a worker process dies, ``multiprocessing`` never
+        reports the results of the batch it was decoding, so without this the
+        batch (and every batch after it) would never be delivered.
+
+    :param reactor:
+        The reactor to deliver results on. If ``None``, the global reactor is
+        used.
+    """
+
+    BATCH_SIZE = 500
+    MAX_PENDING = 4
+    TIMEOUT = 60
+
+    _pool = None
+
+    def __init__(self, codec=None, processes=None, batch_size=BATCH_SIZE,
+                 max_pending=MAX_PENDING, timeout=TIMEOUT, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.codec = get_codec(codec)
+        self.processes = processes
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.reactor = reactor
+        self._pending = set()
+
+    def decode(self, lines):
+        """
+        Decode a list of raw messages.
+
+        The worker processes are started the first time this is called.
+
+        :returns: A ``Deferred`` that fires with a list of decoded messages.
+        """
+        if self._pool is None:
+            self._pool = Pool(self.processes, _init_worker)
+        d = Deferred()
+        self._pending.add(d)
+
+        def _deliver(outcome):
+            if d.called:
+                # The batch timed out, or we were closed, while it was being
+                # decoded.
+                return
+            ok, result = outcome
+            if ok:
+                d.callback(result)
+            else:
+                d.errback(ValueError(result))
+
+        def _done(outcome):
+            # This is called on one of the pool's threads.
+            self.reactor.callFromThread(_deliver, outcome)
+
+        self._pool.apply_async(
+            _decode_in_worker, (self.codec.name, lines), callback=_done)
+
+        def _timed_out(result, timeout):
+            # The worker decoding this batch has probably died, so it will
+            # never be finished.
+            return Failure(TimeoutError(
+                "Decoding timed out after %s seconds." % (timeout,)))
+
+        def _forget(result):
+            self._pending.discard(d)
+            return result
+
+        if self.timeout is not None:
+            d.addTimeout(self.timeout, self.reactor, _timed_out)
+        return d.addBoth(_forget)
+
+    def close(self):
+        """
+        Stop the worker processes. Any batches that are still being decoded
+        are cancelled, and their results are dropped if they arrive.
+
+        :returns:
+            A ``Deferred`` that fires once the worker processes have exited.
+        """
+        for d in list(self._pending):
+            d.cancel()
+        if self._pool is None:
+            return succeed(None)
+        pool, self._pool = self._pool, None
+
+        def _terminate():
+            # A batch whose worker died is never finished, and Pool.join()
+            # waits for every unfinished batch after Pool.close(), so we
+            # terminate the pool instead. Both block, so this is done in a
+            # thread.
+            pool.terminate()
+            pool.join()
+
+        return deferToThreadPool(
+            self.reactor, self.reactor.getThreadPool(), _terminate)
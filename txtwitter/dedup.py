@@ -0,0 +1,311 @@
+"""
+Bounded-memory de-duplication of stream messages.
+
+Reconnections, backfilling and overlapping filter streams can all deliver the
+same tweet more than once. Remembering every ID ever seen in a set works, but
+grows without limit on a long-running stream. :class:`Deduplicator` drops
+repeated tweets and direct messages before they reach a delegate, using one
+of two bounded stores of recently seen IDs:
+
+:class:`RecentIDs`
+    Remembers exactly the most recent IDs, in a ring buffer of 64-bit
+    integers with a set as an index. It never drops a message wrongly, and
+    uses about 75 bytes per remembered ID on 64-bit CPython.
+
+:class:`BloomIDs`
+    Remembers IDs in a pair of Bloom filters. It uses a fixed and much
+    smaller amount of memory (about 3.6 bytes per remembered ID at the
+    default error rate of 0.1%), but will occasionally mistake a new ID for
+    one it has seen and drop a message that should have been delivered. It
+    is also several times slower, since the hashing is done in Python.
+
+Both can forget IDs after a number of IDs, an amount of time, or both.
+``benchmarks/bench_dedup.py`` measures their speed, memory use and error
+rates.
+"""
+
+import math
+import sys
+from array import array
+
+from txtwitter.router import DM, message_id, message_kind
+
+
+def _int64_array(size):
+    if array('l').itemsize == 8:
+        return array('l', [0]) * size
+    # 'l' is only 32 bits on some platforms, and Python 2's array module has
+    # no explicitly 64-bit type, so we fall back to a list there.
+    return [0] * size
+
+
+def _get_clock(clock):
+    if clock is None:
+        from twisted.internet import reactor
+        clock = reactor
+    return clock
+
+
+class RecentIDs(object):
+    """
+    An exact record of the most recently added IDs.
+
+    :param int max_size:
+        The largest number of IDs to remember. Once this many have been
+        added, each new ID makes the oldest one be forgotten. Defaults to
+        :attr:`MAX_SIZE`.
+
+    :param float max_age:
+        If not ``None``, IDs are forgotten this many seconds after they were
+        added.
+
+    :param clock:
+        The clock to measure ages with. If ``None``, the reactor is used.
+    """
+
+    MAX_SIZE = 100000
+
+    def __init__(self, max_size=None, max_age=None, clock=None):
+        if max_size is None:
+            max_size = self.MAX_SIZE
+        self.max_size = max_size
+        self.max_age = max_age
+        self._ids = _int64_array(max_size)
+        self._times = None
+        if max_age is not None:
+            self.clock = _get_clock(clock)
+            self._times = array('d', [0.0]) * max_size
+        self._index = set()
+        self._oldest = 0
+        self._count = 0
+
+    def __len__(self):
+        self._expire()
+        return self._count
+
+    def __contains__(self, id):
+        self._expire()
+        return id in self._index
+
+    def add(self, id):
+        """
+        Add an integer ID.
+
+        :returns: ``True`` if the ID was new, or ``False`` if it was already
+            remembered.
+        """
+        self._expire()
+        if id in self._index:
+            return False
+        if self._count == self.max_size:
+            self._forget_oldest()
+        slot = (self._oldest + self._count) % self.max_size
+        self._ids[slot] = id
+        if self._times is not None:
+            self._times[slot] = self.clock.seconds()
+        self._index.add(id)
+        self._count += 1
+        return True
+
+    def memory_size(self):
+        """
+        Return the approximate number of bytes used, including the integer
+        objects in the index.
+        """
+        size = sys.getsizeof(self._ids) + sys.getsizeof(self._index)
+        if self._times is not None:
+            size += sys.getsizeof(self._times)
+        return size + sum(sys.getsizeof(id) for id in self._index)
+
+    def _forget_oldest(self):
+        self._index.discard(self._ids[self._oldest])
+        self._oldest = (self._oldest + 1) % self.max_size
+        self._count -= 1
+
+    def _expire(self):
+        if self._times is None:
+            return
+        cutoff = self.clock.seconds() - self.max_age
+        while self._count and self._times[self._oldest] <= cutoff:
+            self._forget_oldest()
+
+
+class BloomIDs(object):
+    """
+    An approximate record of recently added IDs, in a fixed amount of memory.
+
+    IDs are added to the current of two Bloom filters. When it holds
+    ``capacity`` IDs (or is ``max_age`` seconds old), it replaces the previous
+    filter and a new, empty one becomes current. So at least the last
+    ``capacity`` IDs (or those from the last ``max_age`` seconds) are always
+    remembered, and up to twice that many may be.
+
+    Each filter is sized so that it mistakes an ID it hasn't seen for one it
+    has with probability ``error_rate`` when full. Since both filters are
+    checked, the overall false-positive rate is at most about twice
+    ``error_rate``. Each filter uses about ``-1.44 * log2(error_rate)`` bits
+    per ID of capacity, so the pair uses about 3.6 bytes per ID of capacity
+    at the default error rate of 0.1%, and 2.4 bytes at 1%.
+
+    :param int capacity:
+        The number of IDs each filter holds. Defaults to :attr:`CAPACITY`.
+
+    :param float error_rate:
+        The false-positive rate of a full filter. Defaults to
+        :attr:`ERROR_RATE`.
+
+    :param float max_age:
+        If not ``None``, the filters are also rotated when the current one is
+        this many seconds old.
+
+    :param clock:
+        The clock to measure ages with. If ``None``, the reactor is used.
+    """
+
+    CAPACITY = 100000
+    ERROR_RATE = 0.001
+
+    def __init__(self, capacity=None, error_rate=None, max_age=None,
+                 clock=None):
+        if capacity is None:
+            capacity = self.CAPACITY
+        if error_rate is None:
+            error_rate = self.ERROR_RATE
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_age = max_age
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(
+            1, int(round(float(self.num_bits) / capacity * math.log(2))))
+        self._hash_range = range(self.num_hashes)
+        if max_age is not None:
+            self.clock = _get_clock(clock)
+        self._current = self._new_filter()
+        self._start_filter()
+
+    def _new_filter(self):
+        return bytearray((self.num_bits + 7) // 8)
+
+    def _start_filter(self):
+        self._previous, self._current = self._current, self._new_filter()
+        self._current_count = 0
+        if self.max_age is not None:
+            self._current_started = self.clock.seconds()
+
+    def _rotate_if_needed(self):
+        if self._current_count >= self.capacity:
+            self._start_filter()
+        elif (self.max_age is not None and
+              self.clock.seconds() - self._current_started >= self.max_age):
+            self._start_filter()
+
+    def _positions(self, id):
+        # Double hashing: the positions are h1 + i * h2 for each i below
+        # num_hashes. An int hashes to itself, which would leave the
+        # structure of tweet IDs (timestamp, worker, sequence) in the
+        # positions, so we hash tuples instead to mix the bits up.
+        h1 = hash((id, 0x2545F491))
+        h2 = hash((0x6C8E9CF5, id)) | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in self._hash_range]
+
+    @staticmethod
+    def _check(bits, positions):
+        for pos in positions:
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __contains__(self, id):
+        self._rotate_if_needed()
+        positions = self._positions(id)
+        return (self._check(self._current, positions) or
+                self._check(self._previous, positions))
+
+    def add(self, id):
+        """
+        Add an integer ID.
+
+        :returns: ``True`` if the ID was new, or ``False`` if it was (or
+            appears to have been) added already.
+        """
+        self._rotate_if_needed()
+        positions = self._positions(id)
+        current = self._current
+        if (self._check(current, positions) or
+                self._check(self._previous, positions)):
+            return False
+        for pos in positions:
+            current[pos >> 3] |= 1 << (pos & 7)
+        self._current_count += 1
+        return True
+
+    def memory_size(self):
+        """
+        Return the number of bytes used by the filters.
+        """
+        return len(self._current) + len(self._previous)
+
+
+class Deduplicator(object):
+    """
+    A stream delegate that drops tweets and direct messages whose IDs it has
+    already seen, and passes everything else to another delegate.
+
+    Messages without IDs (events, deletion notices and so on) are always
+    passed on. If the stream delivers batches, each batch is filtered and
+    passed on if anything is left in it. Whatever the delegate returns is
+    returned, so it may return ``Deferred``\\s for flow control.
+
+    :param delegate: The delegate to pass new messages to.
+
+    :param seen:
+        The store of IDs already seen, which must have an ``add()`` method
+        like :class:`RecentIDs` or :class:`BloomIDs`. If ``None``, a
+        :class:`RecentIDs` with its default size is used.
+    """
+
+    def __init__(self, delegate, seen=None):
+        if seen is None:
+            seen = RecentIDs()
+        self.delegate = delegate
+        self.seen = seen
+        self._delivered = 0
+        self._duplicates = 0
+
+    def _is_new(self, message):
+        kind = message_kind(message)
+        id_str = message_id(message, kind)
+        if id_str is None:
+            self._delivered += 1
+            return True
+        id = int(id_str)
+        if kind == DM:
+            # Tweets and DMs are numbered separately, so DMs are stored as
+            # negative numbers to keep them apart.
+            id = -id
+        if self.seen.add(id):
+            self._delivered += 1
+            return True
+        self._duplicates += 1
+        return False
+
+    def __call__(self, message):
+        if isinstance(message, list):
+            message = [msg for msg in message if self._is_new(msg)]
+            if message:
+                return self.delegate(message)
+        elif self._is_new(message):
+            return self.delegate(message)
+
+    def get_stats(self):
+        """
+        Return a dict of the number of messages delivered and dropped.
+        """
+        return {
+            'delivered': self._delivered,
+            'duplicates': self._duplicates,
+        }
@@ -0,0 +1,186 @@
+"""
+Lazily decoded stream messages.
+
+Many stream consumers throw away most of what they receive (deletion notices,
+limit notices and so on) without looking inside it, but decoding the JSON for
+every message is the largest cost of handling a busy stream.
+:class:`MessageEnvelope` holds a raw message and works out what kind of
+message it is by scanning the raw JSON, only decoding it when the contents
+are actually needed.
+"""
+
+import re
+
+from txtwitter.codec import get_codec
+
+
+# Stream messages that consist of a single key naming the kind of message.
+WRAPPER_KINDS = frozenset([
+    'delete', 'scrub_geo', 'limit', 'status_withheld', 'user_withheld',
+    'disconnect', 'warning', 'friends', 'friends_str', 'direct_message',
+])
+
+# Wrapper kinds that are notices about the stream or about other messages,
+# rather than content.
+NOTICE_KINDS = frozenset([
+    'delete', 'scrub_geo', 'limit', 'status_withheld', 'user_withheld',
+    'disconnect', 'warning',
+])
+
+_FIRST_KEY_RE = re.compile(r'\s*\{\s*"([^"\\]*)"\s*:')
+_KEY_RE = re.compile(r'"(event|sender|recipient|id_str|text|user)"\s*:')
+
+_TWEET_KEYS = frozenset(['id_str', 'text', 'user'])
+_DM_KEYS = frozenset(['id_str', 'text', 'sender', 'recipient'])
+
+_ID_STR_RE = re.compile(r'"id_str"\s*:\s*"(\d+)"')
+# Written this way (rather than as a simple alternation) so that re doesn't
+# try an alternative for every character of a long string.
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+
+def classify(raw):
+    """
+    Work out the kind of a raw JSON stream message without decoding it.
+
+    :returns:
+        The wrapper key (``'delete'``, ``'limit'``, ``'direct_message'``,
+        etc.) for single-key wrapper messages, ``'event'`` for events,
+        ``'tweet'`` or ``'dm'`` for messages that look like a tweet or a
+        direct message, or ``'unknown'``.
+    """
+    match = _FIRST_KEY_RE.match(raw)
+    if match is not None and match.group(1) in WRAPPER_KINDS:
+        return match.group(1)
+    keys = set(_KEY_RE.findall(raw))
+    if 'event' in keys:
+        return 'event'
+    if _DM_KEYS.issubset(keys):
+        return 'dm'
+    if _TWEET_KEYS.issubset(keys):
+        return 'tweet'
+    return 'unknown'
+
+
+def _find_id_str(raw, depth):
+    """
+    Find the value of the first ``"id_str"`` key at a given depth of nesting
+    in a raw JSON object, or return ``None`` if there isn't one.
+    """
+    # Quotes inside JSON strings are always escaped, so every match is a
+    # real key. To find out how deeply it is nested, we remove the strings
+    # between it and the last match (which may contain brackets) and count
+    # the brackets left.
+    level = 0
+    pos = 0
+    for match in _ID_STR_RE.finditer(raw):
+        between = _STRING_RE.sub('', raw[pos:match.start()])
+        level += (between.count('{') + between.count('[') -
+                  between.count('}') - between.count(']'))
+        if level == depth:
+            return match.group(1)
+        pos = match.end()
+    return None
+
+
+class MessageEnvelope(object):
+    """
+    A raw stream message that is decoded the first time its contents are
+    accessed.
+
+    The envelope supports the read-only parts of the ``dict`` interface, so
+    it can mostly be used in place of a decoded message, including with the
+    functions in :mod:`txtwitter.messagetools`.
+
+    :param str raw: The raw JSON message.
+
+    :param codec: The JSON codec to decode the message with.
+    """
+
+    _kind = None
+    _message = None
+
+    def __init__(self, raw, codec=None):
+        self.raw = raw
+        self.codec = get_codec(codec)
+
+    def __repr__(self):
+        return '<MessageEnvelope %s %r>' % (self.kind, self.raw[:40])
+
+    @property
+    def kind(self):
+        """
+        The kind of message, as determined by :func:`classify`.
+        """
+        if self._kind is None:
+            self._kind = classify(self.raw)
+        return self._kind
+
+    @property
+    def is_notice(self):
+        """
+        ``True`` if this is a notice (such as a deletion or limit notice)
+        rather than content.
+        """
+        return self.kind in NOTICE_KINDS
+
+    @property
+    def id_str(self):
+        """
+        The ``id_str`` of a tweet or direct message (wrapped or not), or
+        ``None`` for other kinds of message. It is read from the raw JSON,
+        so this doesn't decode the message.
+        """
+        kind = self.kind
+        if kind == 'direct_message':
+            depth = 2
+        elif kind in ('tweet', 'dm'):
+            depth = 1
+        else:
+            return None
+        if self._message is not None:
+            message = self._message
+            if depth == 2:
+                message = message['direct_message']
+            return message.get('id_str')
+        return _find_id_str(self.raw, depth)
+
+    @property
+    def decoded(self):
+        """
+        ``True`` if the message has been decoded.
+        """
+        return self._message is not None
+
+    @property
+    def message(self):
+        """
+        The decoded message.
+        """
+        if self._message is None:
+            self._message = self.codec.loads(self.raw)
+        return self._message
+
+    def __getitem__(self, key):
+        return self.message[key]
+
+    def __contains__(self, key):
+        return key in self.message
+
+    def __iter__(self):
+        return iter(self.message)
+
+    def __len__(self):
+        return len(self.message)
+
+    def get(self, key, default=None):
+        return self.message.get(key, default)
+
+    def keys(self):
+        return self.message.keys()
+
+    def items(self):
+        return self.message.items()
+
+    def values(self):
+        return self.message.values()
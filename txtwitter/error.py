@@ -1,3 +1,4 @@
+from twisted.internet.error import TimeoutError
 from twisted.web import error
 
 
@@ -7,3 +8,29 @@ class TwitterAPIError(error.Error):
 
 class RateLimitedError(TwitterAPIError):
     pass
+
+
+class RequestTimeoutError(TimeoutError):
+    """
+    A REST API request took longer than its deadline and was cancelled.
+    """
+
+
+class StreamFramingError(Exception):
+    """
+    A streaming API connection delivered data that couldn't be split into
+    messages.
+    """
+
+
+class MessageTooLargeError(StreamFramingError):
+    """
+    A streaming API message was larger than the stream's maximum message size.
+    """
+
+
+class StreamStalledError(Exception):
+    """
+    A streaming API connection received no data, not even keep-alive
+    newlines, for longer than its stall timeout.
+    """
@@ -0,0 +1,192 @@
+"""
+Incremental decoding of JSON response bodies.
+
+The stdlib JSON decoder can only decode complete documents, so this module
+splits a top-level JSON array into its elements as the bytes arrive and
+decodes each element individually. This lets callers process the items of a
+large response before the download has finished, without ever holding the
+whole body in a single string.
+"""
+
+import json
+import re
+
+from twisted.internet.protocol import Protocol
+from twisted.web.client import ResponseDone
+from twisted.web.http import PotentialDataLoss
+
+
+_STRUCTURE_RE = re.compile(r'[\[\]{}",]')
+_STRING_RE = re.compile(r'["\\]')
+_NON_WHITESPACE_RE = re.compile(r'\S')
+
+
+class JSONArrayDecoder(object):
+    """
+    Incrementally decode the elements of a top-level JSON array.
+
+    Data is passed to :meth:`feed` as it arrives, which returns a list of the
+    array elements completed by that data. If the document turns out not to be
+    an array, it is buffered and decoded as a whole by :meth:`close`.
+
+    :param decode:
+        The function used to decode each complete JSON element.
+    """
+
+    def __init__(self, decode=json.loads):
+        self._decode = decode
+        self._buf = ''
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self.is_array = None
+        self.finished = False
+
+    def feed(self, data):
+        """
+        Add data to the decoder and return any newly completed elements.
+        """
+        if self._start > 0:
+            self._buf = self._buf[self._start:]
+            self._pos -= self._start
+            self._start = 0
+        self._buf += data
+
+        if self.is_array is None:
+            match = _NON_WHITESPACE_RE.search(self._buf)
+            if match is None:
+                return []
+            self.is_array = (match.group() == '[')
+            if self.is_array:
+                self._pos = self._start = match.end()
+                self._depth = 1
+
+        if not self.is_array or self.finished:
+            return []
+        return self._scan()
+
+    def _scan(self):
+        items = []
+        buf = self._buf
+        pos = self._pos
+        depth = self._depth
+        while True:
+            if self._in_string:
+                match = _STRING_RE.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    if match.end() >= len(buf):
+                        # We need the escaped character before continuing.
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _STRUCTURE_RE.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._in_string = True
+            elif char in '[{':
+                depth += 1
+            elif depth > 1:
+                if char in ']}':
+                    depth -= 1
+            elif char in ',]':
+                item = buf[self._start:match.start()]
+                self._start = pos
+                if item.strip() or char == ',':
+                    items.append(self._decode(item))
+                if char == ']':
+                    self.finished = True
+                    break
+            else:
+                raise ValueError("Unexpected %r at depth %s." % (char, depth))
+
+        self._pos = pos
+        self._depth = depth
+        return items
+
+    def close(self):
+        """
+        Signal the end of the data.
+
+        :returns:
+            The decoded document if it was not an array, otherwise ``None``.
+
+        :raises ValueError: if the document is incomplete.
+        """
+        if self.is_array is None:
+            raise ValueError("No JSON document received.")
+        if not self.is_array:
+            return self._decode(self._buf)
+        if not self.finished:
+            raise ValueError("Incomplete JSON array.")
+        if self._buf[self._start:].strip():
+            raise ValueError("Extra data after JSON array.")
+
+
+class JSONArrayProtocol(Protocol):
+    """
+    A protocol that delivers the elements of a JSON array response body to a
+    delegate as they are decoded.
+
+    :param finished:
+        A ``Deferred`` that will be fired with the number of elements
+        delivered once the body has been completely received, or errbacked if
+        the body could not be decoded. If the body is not an array, the decoded
+        document is passed to the delegate as the only item.
+
+    :param delegate:
+        A function that will be called with each decoded element.
+    """
+
+    def __init__(self, finished, delegate, decode=json.loads):
+        self._finished = finished
+        self._delegate = delegate
+        self._decoder = JSONArrayDecoder(decode)
+        self._count = 0
+        self._error = None
+
+    def _deliver(self, items):
+        for item in items:
+            self._count += 1
+            self._delegate(item)
+
+    def dataReceived(self, data):
+        if self._error is not None:
+            return
+        try:
+            self._deliver(self._decoder.feed(data))
+        except Exception as e:
+            self._error = e
+            self.transport.stopProducing()
+
+    def connectionLost(self, reason):
+        if self._finished.called:
+            # The Deferred was cancelled (or timed out) before the transport
+            # got around to telling us the connection was gone.
+            return
+        if self._error is not None:
+            self._finished.errback(self._error)
+            return
+        if not reason.check(ResponseDone, PotentialDataLoss):
+            self._finished.errback(reason)
+            return
+        try:
+            document = self._decoder.close()
+            if not self._decoder.is_array:
+                self._deliver([document])
+        except Exception as e:
+            self._finished.errback(e)
+            return
+        self._finished.callback(self._count)
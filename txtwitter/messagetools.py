@@ -1,9 +1,20 @@
 """
 A collection of utilities for working with Twitter API messages.
+
+Messages may be decoded dicts or :class:`txtwitter.envelope.MessageEnvelope`
+objects. Envelopes (recognised by their ``kind`` attribute, so that this
+module doesn't need to import them) that are clearly not the kind of message
+being checked for are rejected without being decoded.
 """
 
 
+def _is_other_kind(message, kind):
+    return getattr(message, 'kind', kind) != kind
+
+
 def is_tweet(message):
+    if _is_other_kind(message, 'tweet'):
+        return False
     return set(['id_str', 'text', 'user']).issubset(set(message.keys()))
 
 
@@ -42,6 +53,8 @@ def tweet_user(message):
 
 
 def is_dm(message):
+    if _is_other_kind(message, 'dm'):
+        return False
     fields = ['id_str', 'text', 'sender', 'recipient']
     return set(fields).issubset(set(message.keys()))
 
@@ -0,0 +1,129 @@
+"""
+Streaming ``multipart/form-data`` request bodies.
+"""
+
+import os
+from StringIO import StringIO
+
+from twisted.internet import defer, task
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from zope.interface import implementer
+
+
+def remaining_length(f):
+    """
+    Return the number of bytes left to read in a file, or ``UNKNOWN_LENGTH``
+    if it cannot be determined without reading it.
+    """
+    try:
+        seek = f.seek
+        tell = f.tell
+    except AttributeError:
+        return UNKNOWN_LENGTH
+    try:
+        position = tell()
+        seek(0, os.SEEK_END)
+        end = tell()
+        seek(position, os.SEEK_SET)
+    except IOError:
+        # Pipes, sockets and the like have seek() and tell() methods that
+        # fail when called.
+        return UNKNOWN_LENGTH
+    return end - position
+
+
+@implementer(IBodyProducer)
+class MultipartBodyProducer(object):
+    """
+    Produce a ``multipart/form-data`` body containing some form fields and a
+    single file.
+
+    The form fields are written first, followed by the file contents in
+    fixed-size chunks, so the file is never held in memory as a whole. If the
+    file does not support ``seek()`` and ``tell()``, its length cannot be
+    determined in advance and it is read into memory instead. The same goes
+    for a file whose ``seek()`` or ``tell()`` raises ``IOError``, such as a
+    pipe.
+
+    :param str boundary: The multipart boundary string.
+
+    :param dict params: Form fields to include before the file.
+
+    :param str file_field: The name of the file field.
+
+    :param media:
+        A file-like object with a ``name`` attribute. It is read from its
+        current position and is not closed.
+    """
+
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self, boundary, params, file_field, media,
+                 cooperator=task, chunk_size=CHUNK_SIZE):
+        self._cooperate = cooperator.cooperate
+        self._chunk_size = chunk_size
+
+        parts = []
+        for key, value in (params or {}).items():
+            parts.append('--%s\r\n' % (boundary,))
+            parts.append('Content-Disposition: form-data, name=%s\r\n' % (
+                key,))
+            parts.append('\r\n')
+            parts.append(str(value))
+            parts.append('\r\n')
+        parts.append('--%s\r\n' % (boundary,))
+        parts.append(
+            'Content-Disposition: form-data; name=%s; filename=%s\r\n' % (
+                file_field, media.name))
+        parts.append('Content-Type: application/octet-stream\r\n')
+        parts.append('\r\n')
+        self._preamble = ''.join(parts)
+        self._epilogue = '\r\n--%s--\r\n' % (boundary,)
+
+        media_length = remaining_length(media)
+        if media_length is UNKNOWN_LENGTH:
+            content = media.read()
+            media_length = len(content)
+            media = StringIO(content)
+        self._media = media
+        self.length = len(self._preamble) + media_length + len(self._epilogue)
+
+    def startProducing(self, consumer):
+        self._task = self._cooperate(self._writeloop(consumer))
+        d = self._task.whenDone()
+
+        def maybe_stopped(reason):
+            if reason.check(defer.CancelledError):
+                self.stopProducing()
+            elif not reason.check(task.TaskStopped):
+                return reason
+            # IBodyProducer.startProducing's Deferred isn't supposed to fire if
+            # stopProducing is called.
+            return defer.Deferred()
+
+        d.addCallbacks(lambda _: None, maybe_stopped)
+        return d
+
+    def _writeloop(self, consumer):
+        consumer.write(self._preamble)
+        yield None
+        while True:
+            chunk = self._media.read(self._chunk_size)
+            if not chunk:
+                break
+            consumer.write(chunk)
+            yield None
+        consumer.write(self._epilogue)
+
+    def pauseProducing(self):
+        self._task.pause()
+
+    def resumeProducing(self):
+        self._task.resume()
+
+    def stopProducing(self):
+        try:
+            self._task.stop()
+        except task.TaskDone:
+            # Already finished or stopped, as FileBodyProducer allows.
+            pass
@@ -0,0 +1,140 @@
+"""
+OAuth 1.0a request signing.
+
+:class:`OAuthSigner` produces the same ``Authorization`` header as
+:class:`oauthlib.oauth1.Client` (for HMAC-SHA1 header signatures), but is
+built once per set of credentials so that the HMAC key and the static parts
+of the header are not recomputed for every request.
+"""
+
+import hmac
+import os
+from binascii import b2a_base64, hexlify
+from hashlib import sha1
+from itertools import count
+from time import time
+from urllib import quote
+from urlparse import parse_qsl, urlparse, urlunparse
+
+
+CONTENT_TYPE_FORM_URLENCODED = 'application/x-www-form-urlencoded'
+DEFAULT_PORTS = frozenset([('http', '80'), ('https', '443')])
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def escape(value):
+    """
+    Percent-encode a string as described in section 3.6 of RFC 5849.
+    """
+    return quote(_utf8(value), safe='~')
+
+
+def base_string_uri(uri):
+    """
+    Build the base string URI as described in section 3.4.1.2 of RFC 5849.
+    """
+    scheme, netloc, path, params, _query, _fragment = urlparse(uri)
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    if ':' in netloc:
+        host, port = netloc.split(':', 1)
+        if (scheme, port) in DEFAULT_PORTS:
+            netloc = host
+    uri = urlunparse((scheme, netloc, path or '/', params, '', ''))
+    return uri.replace(' ', '%20')
+
+
+class OAuthSigner(object):
+    """
+    An HMAC-SHA1 OAuth signer for a single set of credentials.
+
+    :param str consumer_key: The OAuth consumer key.
+
+    :param str consumer_secret: The OAuth consumer secret.
+
+    :param str token_key: The OAuth access token.
+
+    :param str token_secret: The OAuth access token secret.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, token_key,
+                 token_secret):
+        key = '%s&%s' % (escape(consumer_secret), escape(token_secret))
+        self._hmac = hmac.new(key, digestmod=sha1)
+
+        static_params = [
+            ('oauth_version', '1.0'),
+            ('oauth_signature_method', 'HMAC-SHA1'),
+            ('oauth_consumer_key', escape(consumer_key)),
+        ]
+        if token_key:
+            static_params.append(('oauth_token', escape(token_key)))
+        # These are already escaped, so can be used directly in both the
+        # normalized parameters and the header.
+        self._static_params = static_params
+        self._static_header = ', '.join(
+            '%s="%s"' % param for param in static_params)
+
+        self._nonce_prefix = hexlify(os.urandom(8))
+        self._nonce_counter = count()
+
+    def make_nonce(self):
+        """
+        Return a nonce that is unique for the lifetime of this signer.
+        """
+        return '%s%x' % (self._nonce_prefix, next(self._nonce_counter))
+
+    def make_timestamp(self):
+        return str(int(time()))
+
+    def _signature(self, method, uri, params):
+        normalized = [(escape(k), escape(v)) for k, v in params]
+        normalized.extend(self._static_params)
+        normalized.sort()
+        normalized = '&'.join('%s=%s' % param for param in normalized)
+        base_string = '&'.join([
+            method.upper(), escape(base_string_uri(uri)), escape(normalized)])
+        mac = self._hmac.copy()
+        mac.update(base_string)
+        return b2a_base64(mac.digest())[:-1]
+
+    def sign(self, uri, http_method='GET', body=None, headers=None,
+             nonce=None, timestamp=None):
+        """
+        Sign a request.
+
+        The arguments and return value mirror those of
+        :meth:`oauthlib.oauth1.Client.sign`, except that ``body`` must be a
+        string (if it is not ``None``) and the nonce and timestamp may be
+        provided explicitly.
+
+        :returns:
+            A ``(uri, headers, body)`` tuple, where ``headers`` contains the
+            ``Authorization`` header in addition to those provided.
+        """
+        uri = _utf8(uri)
+        if nonce is None:
+            nonce = self.make_nonce()
+        if timestamp is None:
+            timestamp = self.make_timestamp()
+        headers = dict(headers or {})
+
+        params = parse_qsl(urlparse(uri).query, keep_blank_values=True)
+        if (body is not None and
+                headers.get('Content-Type') == CONTENT_TYPE_FORM_URLENCODED):
+            params.extend(parse_qsl(body, keep_blank_values=True))
+        params.append(('oauth_nonce', nonce))
+        params.append(('oauth_timestamp', timestamp))
+
+        signature = self._signature(http_method, uri, params)
+        nonce, timestamp = escape(nonce), escape(timestamp)
+        headers['Authorization'] = (
+            'OAuth oauth_nonce="%s", oauth_timestamp="%s", %s, '
+            'oauth_signature="%s"' % (
+                nonce, timestamp, self._static_header, escape(signature)))
+        return uri, headers, body
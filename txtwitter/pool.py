@@ -0,0 +1,83 @@
+"""
+Persistent HTTP connection pooling for Twitter API clients.
+
+A single :class:`TwitterConnectionPool` may be shared between any number of
+:class:`txtwitter.twitter.TwitterClient` instances (even ones authenticating
+as different accounts, since OAuth signing happens per request) to avoid a
+fresh TCP and TLS handshake for every API call.
+"""
+
+from twisted.web.client import HTTPConnectionPool
+
+
+class TwitterConnectionPool(HTTPConnectionPool):
+    """
+    An :class:`HTTPConnectionPool` that keeps usage statistics.
+
+    :param reactor:
+        The reactor to use for connection timeouts. If ``None``, the global
+        reactor will be used.
+
+    :param int max_persistent_per_host:
+        The maximum number of idle persistent connections to keep for each
+        ``(scheme, host, port)`` destination. This does not limit the number
+        of connections open at once: a request made while every idle
+        connection is in use opens a new one, which is closed afterwards if
+        this many are already idle. To limit the number of requests in flight
+        at once, use a :class:`txtwitter.scheduler.RequestScheduler` with
+        ``max_concurrent``.
+
+    :param float idle_timeout:
+        The number of seconds an idle connection will be kept open before it
+        is closed.
+    """
+
+    MAX_PERSISTENT_PER_HOST_DEFAULT = 4
+    IDLE_TIMEOUT_DEFAULT = 240
+
+    def __init__(self, reactor=None,
+                 max_persistent_per_host=MAX_PERSISTENT_PER_HOST_DEFAULT,
+                 idle_timeout=IDLE_TIMEOUT_DEFAULT):
+        if reactor is None:
+            from twisted.internet import reactor
+        HTTPConnectionPool.__init__(self, reactor, persistent=True)
+        self.maxPersistentPerHost = max_persistent_per_host
+        self.cachedConnectionTimeout = idle_timeout
+        self.connections_requested = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connections_expired = 0
+
+    def getConnection(self, key, endpoint):
+        self.connections_requested += 1
+        created = self.connections_created
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        if self.connections_created == created:
+            self.connections_reused += 1
+        return d
+
+    def _newConnection(self, key, endpoint):
+        self.connections_created += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def _removeConnection(self, key, connection):
+        self.connections_expired += 1
+        return HTTPConnectionPool._removeConnection(self, key, connection)
+
+    def idle_connections(self):
+        """
+        Return the number of idle connections currently held by the pool.
+        """
+        return sum(len(conns) for conns in self._connections.itervalues())
+
+    def get_stats(self):
+        """
+        Return a dict of pool usage statistics.
+        """
+        return {
+            'requested': self.connections_requested,
+            'created': self.connections_created,
+            'reused': self.connections_reused,
+            'expired': self.connections_expired,
+            'idle': self.idle_connections(),
+        }
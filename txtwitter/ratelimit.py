@@ -0,0 +1,144 @@
+"""
+Tracking of Twitter API rate limits.
+
+Twitter reports the state of the rate limit window for an endpoint in the
+``x-rate-limit-limit``, ``x-rate-limit-remaining`` and ``x-rate-limit-reset``
+headers of each REST API response. :class:`RateLimitTracker` records these for
+each endpoint and access token, so callers can tell how long to wait before
+calling an endpoint again instead of finding out from a 429 response.
+"""
+
+
+def endpoint_for_uri(uri):
+    """
+    Return the endpoint key for a request URI, which is the URI without its
+    query string.
+    """
+    return uri.split('?', 1)[0]
+
+
+def _get_int_header(headers, name):
+    values = headers.getRawHeaders(name)
+    if not values:
+        return None
+    try:
+        return int(values[-1])
+    except ValueError:
+        return None
+
+
+class RateLimit(object):
+    """
+    The state of a rate limit window.
+
+    :param int limit: The number of requests allowed in each window.
+
+    :param int remaining: The number of requests left in this window.
+
+    :param int reset: The UTC epoch time at which this window ends.
+    """
+
+    def __init__(self, limit, remaining, reset):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def __repr__(self):
+        return '<RateLimit %s/%s reset=%s>' % (
+            self.remaining, self.limit, self.reset)
+
+    @classmethod
+    def from_headers(cls, headers):
+        """
+        Build a :class:`RateLimit` from response headers.
+
+        :param headers: A :class:`twisted.web.http_headers.Headers` object.
+
+        :returns:
+            A :class:`RateLimit`, or ``None`` if the headers don't contain
+            valid rate limit information.
+        """
+        limit = _get_int_header(headers, 'x-rate-limit-limit')
+        remaining = _get_int_header(headers, 'x-rate-limit-remaining')
+        reset = _get_int_header(headers, 'x-rate-limit-reset')
+        if None in (limit, remaining, reset):
+            return None
+        return cls(limit, remaining, reset)
+
+
+class RateLimitTracker(object):
+    """
+    Track the rate limit windows of API endpoints for any number of access
+    tokens.
+
+    A single tracker may be shared between several clients. Since rate limits
+    apply to each access token separately, limits are stored per
+    ``(token, endpoint)`` pair.
+
+    :param clock:
+        An ``IReactorTime`` provider used to determine how long it is until a
+        window resets. If ``None``, the global reactor will be used.
+    """
+
+    def __init__(self, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self._limits = {}
+
+    def update(self, token, endpoint, headers):
+        """
+        Record the rate limit information in some response headers.
+
+        Headers without rate limit information (such as those of streaming API
+        responses) are ignored.
+
+        :param str token: The access token the request was made with.
+
+        :param str endpoint: The endpoint the request was made to.
+
+        :param headers: A :class:`twisted.web.http_headers.Headers` object.
+
+        :returns: The recorded :class:`RateLimit`, or ``None``.
+        """
+        rate_limit = RateLimit.from_headers(headers)
+        if rate_limit is not None:
+            self._limits[(token, endpoint)] = rate_limit
+        return rate_limit
+
+    def get(self, token, endpoint):
+        """
+        Return the most recently recorded :class:`RateLimit` for an endpoint,
+        or ``None`` if nothing has been recorded.
+        """
+        return self._limits.get((token, endpoint))
+
+    def endpoints(self, token):
+        """
+        Return a dict of the recorded rate limits for an access token, keyed by
+        endpoint.
+        """
+        return dict(
+            (endpoint, rate_limit)
+            for (t, endpoint), rate_limit in self._limits.items()
+            if t == token)
+
+    def time_until_allowed(self, token, endpoint):
+        """
+        Return the number of seconds until the next call to an endpoint will
+        be allowed.
+
+        This is ``0`` if there are requests remaining in the current window,
+        if the window has already reset, or if nothing is known about the
+        endpoint.
+        """
+        rate_limit = self.get(token, endpoint)
+        if rate_limit is None or rate_limit.remaining > 0:
+            return 0
+        return max(0, rate_limit.reset - self.clock.seconds())
+
+    def clear(self):
+        """
+        Forget all recorded rate limits.
+        """
+        self._limits.clear()
@@ -0,0 +1,200 @@
+"""
+Retrying of transient REST API failures.
+
+Server errors, rate limiting and network problems usually go away if the
+request is tried again a little later. :class:`RetryPolicy` describes which
+failures to retry, how many times, and how long to wait in between. It uses
+exponential backoff with random jitter, so that many clients recovering from
+the same outage don't all retry at the same moment.
+"""
+
+import random
+
+from twisted.internet.defer import CancelledError, Deferred, maybeDeferred
+
+from txtwitter.error import TwitterAPIError
+
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD'])
+
+
+class RetryPolicy(object):
+    """
+    A policy for retrying failed requests.
+
+    :param int max_attempts:
+        The maximum number of attempts, including the first one.
+
+    :param retry_statuses:
+        The HTTP status codes of API errors to retry.
+
+    :param bool retry_network_errors:
+        If ``True``, failures other than API errors (such as connection
+        errors) are retried.
+
+    :param float base_delay:
+        The delay before the first retry. Each subsequent delay is twice the
+        previous one.
+
+    :param float max_delay:
+        The maximum delay between attempts.
+
+    :param bool jitter:
+        If ``True``, each delay is chosen at random between zero and the
+        backoff delay.
+
+    :param float deadline:
+        If not ``None``, no retry will be attempted that would start more than
+        this many seconds after the first attempt.
+
+    :param bool retry_posts:
+        If ``True``, ``POST`` requests are retried. Since these are not
+        idempotent, a retried ``POST`` may have its effect twice (for example,
+        if the first response was lost), so this is off by default.
+
+    :param clock:
+        An ``IReactorTime`` provider. If ``None``, the global reactor will be
+        used.
+    """
+
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, max_attempts=3, retry_statuses=RETRY_STATUSES,
+                 retry_network_errors=True, base_delay=1.0, max_delay=60.0,
+                 jitter=True, deadline=None, retry_posts=False, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.max_attempts = max_attempts
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_network_errors = retry_network_errors
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_posts = retry_posts
+        self.clock = clock
+        self.random = random.random
+        self.retries = 0
+
+    def is_retryable(self, failure):
+        """
+        Return ``True`` if a failure is of a kind that should be retried.
+        """
+        if failure.check(CancelledError):
+            return False
+        if failure.check(TwitterAPIError):
+            return int(failure.value.status) in self.retry_statuses
+        return self.retry_network_errors
+
+    def backoff(self, attempts):
+        """
+        Return the delay before the next attempt, after ``attempts`` attempts
+        have failed.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        if self.jitter:
+            delay *= self.random()
+        return delay
+
+    def retry_delay(self, method, failure, attempts, rate_limit_delay=0):
+        """
+        Decide whether to retry a failed request.
+
+        :param str method: The HTTP method of the request.
+
+        :param failure: The failure of the last attempt.
+
+        :param int attempts: The number of attempts made so far.
+
+        :param float rate_limit_delay:
+            The number of seconds until the endpoint's rate limit allows
+            another request. The retry will wait at least this long.
+
+        :returns:
+            The number of seconds to wait before retrying, or ``None`` if the
+            request should not be retried.
+        """
+        if attempts >= self.max_attempts:
+            return None
+        if method not in IDEMPOTENT_METHODS and not (
+                method == 'POST' and self.retry_posts):
+            return None
+        if not self.is_retryable(failure):
+            return None
+        return max(self.backoff(attempts), rate_limit_delay)
+
+    def run(self, func, method='GET', rate_limit_delay=None):
+        """
+        Call a function that makes a request, retrying it if it fails.
+
+        :param func:
+            A function that makes the request and returns a ``Deferred``.
+
+        :param str method: The HTTP method of the request.
+
+        :param rate_limit_delay:
+            If not ``None``, a function that returns the number of seconds
+            until the endpoint's rate limit allows another request.
+
+        :returns:
+            A ``Deferred`` that fires with the result of the first successful
+            attempt, or fails with the failure of the last attempt. Cancelling
+            it cancels the attempt in progress or the wait for the next one.
+        """
+        return _RetryingCall(self, func, method, rate_limit_delay).start()
+
+
+class _RetryingCall(object):
+    def __init__(self, policy, func, method, rate_limit_delay):
+        self._policy = policy
+        self._func = func
+        self._method = method
+        self._rate_limit_delay = rate_limit_delay
+        self._clock = policy.clock
+        self._attempts = 0
+        self._current = None
+        self._delayed_call = None
+        self._d = Deferred(self._cancel)
+
+    def start(self):
+        self._started = self._clock.seconds()
+        self._attempt()
+        return self._d
+
+    def _attempt(self):
+        self._delayed_call = None
+        self._attempts += 1
+        self._current = maybeDeferred(self._func)
+        self._current.addCallbacks(self._succeeded, self._failed)
+
+    def _succeeded(self, result):
+        self._current = None
+        if not self._d.called:
+            self._d.callback(result)
+
+    def _failed(self, failure):
+        self._current = None
+        if self._d.called:
+            return
+        rate_limit_delay = 0
+        if self._rate_limit_delay is not None:
+            rate_limit_delay = self._rate_limit_delay()
+        delay = self._policy.retry_delay(
+            self._method, failure, self._attempts, rate_limit_delay)
+        deadline = self._policy.deadline
+        if delay is not None and deadline is not None:
+            elapsed = self._clock.seconds() - self._started
+            if elapsed + delay > deadline:
+                delay = None
+        if delay is None:
+            self._d.errback(failure)
+            return
+        self._policy.retries += 1
+        self._delayed_call = self._clock.callLater(delay, self._attempt)
+
+    def _cancel(self, d):
+        if self._delayed_call is not None:
+            self._delayed_call.cancel()
+            self._delayed_call = None
+        elif self._current is not None:
+            self._current.cancel()
@@ -0,0 +1,159 @@
+"""
+Routing of stream messages to handlers by kind.
+
+Stream delegates usually start with a chain of checks to work out what kind of
+message they have been given. :class:`MessageRouter` does this once per
+message, with a few lookups of its top-level keys (or without decoding at all
+for a :class:`txtwitter.envelope.MessageEnvelope`), and calls the handler
+registered for that kind.
+"""
+
+from twisted.internet.defer import Deferred, gatherResults
+
+from txtwitter.envelope import MessageEnvelope
+
+
+TWEET = 'tweet'
+DM = 'dm'
+EVENT = 'event'
+DELETE = 'delete'
+LIMIT = 'limit'
+WARNING = 'warning'
+FRIENDS = 'friends'
+UNKNOWN = 'unknown'
+
+MESSAGE_KINDS = (
+    TWEET, DM, EVENT, DELETE, LIMIT, WARNING, FRIENDS, UNKNOWN)
+
+# Top-level keys that identify a message kind on their own, with the most
+# common first.
+_KEY_KINDS = (
+    ('delete', DELETE),
+    ('limit', LIMIT),
+    ('event', EVENT),
+    ('direct_message', DM),
+    ('warning', WARNING),
+    ('friends', FRIENDS),
+    ('friends_str', FRIENDS),
+)
+
+
+# Envelope kinds, as determined by txtwitter.envelope.classify().
+_ENVELOPE_KINDS = dict(_KEY_KINDS, tweet=TWEET, dm=DM)
+
+
+def message_kind(message):
+    """
+    Return the kind of a stream message, which is one of
+    :data:`MESSAGE_KINDS`.
+
+    :param message:
+        A decoded message dict, or a
+        :class:`txtwitter.envelope.MessageEnvelope`. Envelopes are classified
+        without being decoded.
+    """
+    if isinstance(message, MessageEnvelope):
+        return _ENVELOPE_KINDS.get(message.kind, UNKNOWN)
+
+    # Each check is a single dict lookup, so this doesn't build anything for
+    # each message. Tweets are by far the most common, so they come first;
+    # they have none of the keys in _KEY_KINDS.
+    if 'id_str' in message and 'text' in message:
+        if 'sender' in message and 'recipient' in message:
+            return DM
+        if 'user' in message:
+            return TWEET
+    for key, kind in _KEY_KINDS:
+        if key in message:
+            return kind
+    return UNKNOWN
+
+
+def message_id(message, kind=None):
+    """
+    Return the ``id_str`` of a tweet or direct message (wrapped or not), or
+    ``None`` for other kinds of message.
+
+    :param message:
+        A decoded message dict or a message envelope. An envelope's ID is
+        read without decoding it.
+
+    :param str kind:
+        The kind of the message, if it is already known. If ``None``, it is
+        worked out with :func:`message_kind`.
+    """
+    if isinstance(message, MessageEnvelope):
+        return message.id_str
+    if kind is None:
+        kind = message_kind(message)
+    if kind == DM and 'direct_message' in message:
+        message = message['direct_message']
+    elif kind not in (TWEET, DM):
+        return None
+    return message.get('id_str')
+
+
+class MessageRouter(object):
+    """
+    A stream delegate that calls a different handler for each kind of message.
+
+    Handlers are called with the message exactly as the router received it,
+    so a direct message from a user stream is still wrapped in its
+    ``direct_message`` key. Whatever the handler returns is returned to the
+    stream service, so handlers may return ``Deferred``s for flow control.
+    Messages of a kind with no handler are dropped.
+
+    If the stream delivers batches, each message in a batch is routed on its
+    own. If any of their handlers return ``Deferred``\\s, a ``Deferred`` that
+    fires once they all have is returned for the batch.
+
+    :param handlers:
+        Handlers to register, keyed by message kind.
+    """
+
+    def __init__(self, **handlers):
+        self._handlers = {}
+        self._counts = dict((kind, 0) for kind in MESSAGE_KINDS)
+        for kind, handler in handlers.iteritems():
+            self.add_handler(kind, handler)
+
+    def add_handler(self, kind, handler):
+        """
+        Register the handler for a kind of message, replacing any existing
+        handler for that kind.
+
+        :param str kind: One of :data:`MESSAGE_KINDS`.
+
+        :param handler: A function that will be called with each message.
+        """
+        if kind not in MESSAGE_KINDS:
+            raise ValueError("Unknown message kind: %r" % (kind,))
+        self._handlers[kind] = handler
+
+    def remove_handler(self, kind):
+        """
+        Remove the handler for a kind of message, if there is one.
+        """
+        self._handlers.pop(kind, None)
+
+    def __call__(self, message):
+        if isinstance(message, list):
+            results = [self._route(msg) for msg in message]
+            ds = [result for result in results if isinstance(result, Deferred)]
+            if ds:
+                return gatherResults(ds, consumeErrors=True)
+            return None
+        return self._route(message)
+
+    def _route(self, message):
+        kind = message_kind(message)
+        self._counts[kind] += 1
+        handler = self._handlers.get(kind)
+        if handler is not None:
+            return handler(message)
+
+    def get_stats(self):
+        """
+        Return a dict of the number of messages routed, by kind.
+        """
+        return dict(self._counts)
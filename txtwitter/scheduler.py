@@ -0,0 +1,247 @@
+"""
+Rate-limit-aware scheduling of API requests.
+
+Without a scheduler, a burst of calls to one endpoint is sent immediately and
+runs into 429 responses once its rate limit window is used up. A
+:class:`RequestScheduler` queues requests for each endpoint and only releases
+as many as the endpoint's remaining rate limit allows, holding the rest until
+the window resets. Until an endpoint's rate limit is known, its requests are
+sent one at a time, so that a burst to a fresh endpoint can't overrun a
+window it knows nothing about. Queued requests are released in priority
+order, so that (for example) interactive requests are not stuck behind a
+background crawl.
+"""
+
+import heapq
+from itertools import count
+
+from twisted.internet.defer import Deferred, maybeDeferred
+
+from txtwitter.ratelimit import RateLimitTracker
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class _EndpointQueue(object):
+    def __init__(self):
+        self.queue = []
+        self.in_flight = 0
+        self.submitted = 0
+        self.dispatched = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self.delayed_call = None
+        self.processing = False
+        # Requests in flight, keyed by their sequence numbers.
+        self.requests = {}
+
+    def get_stats(self):
+        mean_wait = 0
+        if self.dispatched:
+            mean_wait = float(self.total_wait) / self.dispatched
+        return {
+            'queued': len(self.queue),
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'dispatched': self.dispatched,
+            'total_wait': self.total_wait,
+            'mean_wait': mean_wait,
+            'max_wait': self.max_wait,
+        }
+
+
+class RequestScheduler(object):
+    """
+    Queue requests per endpoint and release them as their rate limits allow.
+
+    A scheduler may be shared between several clients. Requests are queued
+    per ``(token, endpoint)`` pair, because that is how Twitter applies rate
+    limits.
+
+    :param rate_limits:
+        The :class:`txtwitter.ratelimit.RateLimitTracker` that records the
+        rate limits of the requests made. If ``None``, a new one is created.
+
+    :param clock:
+        An ``IReactorTime`` provider. If ``None``, the global reactor will be
+        used.
+
+    :param int max_concurrent:
+        The maximum number of requests to each endpoint that may be in flight
+        at once, regardless of its rate limit. If ``None``, there is no limit.
+    """
+
+    # The number of requests to an endpoint that may be in flight before any
+    # of its responses have told us its rate limit.
+    PROBE_CONCURRENT = 1
+
+    def __init__(self, rate_limits=None, clock=None, max_concurrent=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if rate_limits is None:
+            rate_limits = RateLimitTracker(clock)
+        self.clock = clock
+        self.rate_limits = rate_limits
+        self.max_concurrent = max_concurrent
+        self._queues = {}
+        self._counter = count()
+
+    def _get_queue(self, key):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _EndpointQueue()
+        return queue
+
+    def submit(self, token, endpoint, request_func, priority=PRIORITY_NORMAL):
+        """
+        Queue a request.
+
+        :param str token: The access token the request will be made with.
+
+        :param str endpoint: The endpoint the request will be made to.
+
+        :param request_func:
+            A function that makes the request and returns a ``Deferred`` that
+            fires once the response (and its rate limit headers) have been
+            received and recorded.
+
+        :param int priority:
+            Requests with lower priority values are released first. Requests
+            with the same priority are released in the order they were
+            submitted.
+
+        :returns:
+            A ``Deferred`` that fires with the result of ``request_func``.
+            Cancelling it removes the request from the queue, or cancels it if
+            it has already been released.
+        """
+        key = (token, endpoint)
+        queue = self._get_queue(key)
+        d = Deferred(lambda d: self._cancel(queue, entry))
+        entry = (priority, next(self._counter), self.clock.seconds(),
+                 request_func, d)
+        heapq.heappush(queue.queue, entry)
+        queue.submitted += 1
+        self._process(key)
+        return d
+
+    def _available(self, key, queue):
+        available = None
+        if self.max_concurrent is not None:
+            available = self.max_concurrent - queue.in_flight
+
+        rate_limit = self.rate_limits.get(*key)
+        if rate_limit is None:
+            probes = self.PROBE_CONCURRENT - queue.in_flight
+            if available is None or probes < available:
+                available = probes
+            # The next completed request will process the queue again.
+            return available, 0
+        if rate_limit.reset <= self.clock.seconds():
+            # The window has reset since we last heard about it.
+            remaining = rate_limit.limit
+        else:
+            remaining = rate_limit.remaining
+        remaining -= queue.in_flight
+        if available is None or remaining < available:
+            available = remaining
+        if remaining <= 0:
+            return available, self.rate_limits.time_until_allowed(*key)
+        return available, 0
+
+    def _process(self, key):
+        queue = self._queues[key]
+        if queue.processing:
+            # Requests that complete synchronously would otherwise recurse.
+            return
+        if queue.delayed_call is not None:
+            if queue.delayed_call.active():
+                queue.delayed_call.cancel()
+            queue.delayed_call = None
+
+        queue.processing = True
+        try:
+            while queue.queue:
+                available, delay = self._available(key, queue)
+                if available is not None and available <= 0:
+                    if delay > 0:
+                        queue.delayed_call = self.clock.callLater(
+                            delay, self._process, key)
+                    # Otherwise, the next completed request will process the
+                    # queue again.
+                    return
+                self._dispatch(key, queue, heapq.heappop(queue.queue))
+        finally:
+            queue.processing = False
+
+    def _cancel(self, queue, entry):
+        if entry in queue.queue:
+            queue.queue.remove(entry)
+            heapq.heapify(queue.queue)
+            return
+        request_d = queue.requests.get(entry[1])
+        if request_d is not None:
+            request_d.cancel()
+
+    def _dispatch(self, key, queue, entry):
+        _priority, seq, submitted, request_func, d = entry
+        wait = self.clock.seconds() - submitted
+        queue.dispatched += 1
+        queue.total_wait += wait
+        queue.max_wait = max(queue.max_wait, wait)
+        queue.in_flight += 1
+
+        def _finished(result):
+            queue.in_flight -= 1
+            queue.requests.pop(seq, None)
+            d.callback(result)
+            self._process(key)
+
+        request_d = maybeDeferred(request_func)
+        if not request_d.called:
+            queue.requests[seq] = request_d
+        request_d.addBoth(_finished)
+
+    def queue_depth(self, token=None, endpoint=None):
+        """
+        Return the number of queued requests, optionally only those for a
+        single token and/or endpoint.
+        """
+        return sum(
+            len(queue.queue) for (t, e), queue in self._queues.items()
+            if token in (None, t) and endpoint in (None, e))
+
+    def get_stats(self):
+        """
+        Return a dict of scheduler statistics.
+
+        The totals across all endpoints are included at the top level, and
+        the statistics for each ``(token, endpoint)`` pair are included under
+        ``'endpoints'``. Wait times are the number of seconds requests spent
+        in the queue before they were released.
+        """
+        endpoints = dict(
+            (key, queue.get_stats()) for key, queue in self._queues.items())
+        stats = {
+            'queued': 0,
+            'in_flight': 0,
+            'submitted': 0,
+            'dispatched': 0,
+            'total_wait': 0,
+            'max_wait': 0,
+        }
+        for endpoint_stats in endpoints.values():
+            for name in stats:
+                if name == 'max_wait':
+                    stats[name] = max(stats[name], endpoint_stats[name])
+                else:
+                    stats[name] += endpoint_stats[name]
+        stats['mean_wait'] = 0
+        if stats['dispatched']:
+            stats['mean_wait'] = (
+                float(stats['total_wait']) / stats['dispatched'])
+        stats['endpoints'] = endpoints
+        return stats
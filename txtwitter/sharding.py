@@ -0,0 +1,181 @@
+"""
+Sharding of large filter streams across several connections.
+
+Twitter limits a single filter stream to 5000 followed users and 400 tracked
+terms, and each account to one filter stream at a time. To filter on more
+than that, :class:`ShardedFilterStream` splits the follow and track sets
+across several streams, each using a different account's credentials, and
+merges what they deliver into one de-duplicated delegate.
+"""
+
+from twisted.application.service import MultiService
+
+from txtwitter.dedup import Deduplicator
+
+
+def _shards_needed(count, limit):
+    return (count + limit - 1) // limit
+
+
+class _Shard(object):
+    def __init__(self, client):
+        self.client = client
+        self.follow = frozenset()
+        self.track = frozenset()
+        self.service = None
+
+
+class ShardedFilterStream(MultiService):
+    """
+    A filter stream that is split across as many connections as its follow
+    and track sets need.
+
+    Each shard is a :class:`txtwitter.streamservice.TwitterStreamService`
+    created by :meth:`txtwitter.twitter.TwitterClient.stream_filter` and run
+    as a child of this service. Every message from every shard is passed
+    through a :class:`txtwitter.dedup.Deduplicator`, since a tweet that
+    matches the filters of more than one shard is delivered by each of them.
+
+    When the sets change with :meth:`set_filter`, followed users and tracked
+    terms that are still wanted stay on the shard they were on, and new ones
+    are added to the shards that already have room, so as few shards as
+    possible have to reconnect.
+
+    :param clients:
+        A list of :class:`txtwitter.twitter.TwitterClient`\\s, each for a
+        different account. Each shard uses one of them, so there must be at
+        least as many as the largest number of shards needed.
+
+    :param delegate:
+        The delegate to deliver messages from all shards to, as for
+        :meth:`~txtwitter.twitter.TwitterClient.stream_filter`.
+
+    :param follow: The user IDs to follow.
+
+    :param track: The keywords to track.
+
+    :param seen:
+        The store of IDs seen, as for
+        :class:`txtwitter.dedup.Deduplicator`. If ``None``, the default is
+        used.
+
+    :param bool stall_warnings:
+        Passed to each shard's
+        :meth:`~txtwitter.twitter.TwitterClient.stream_filter`.
+
+    :param str delimited:
+        Passed to each shard's
+        :meth:`~txtwitter.twitter.TwitterClient.stream_filter`.
+
+    :param int max_follow:
+        The largest number of user IDs to follow per shard. Defaults to
+        :attr:`MAX_FOLLOW`.
+
+    :param int max_track:
+        The largest number of keywords to track per shard. Defaults to
+        :attr:`MAX_TRACK`.
+    """
+
+    MAX_FOLLOW = 5000
+    MAX_TRACK = 400
+
+    def __init__(self, clients, delegate, follow=(), track=(), seen=None,
+                 stall_warnings=None, delimited=None, max_follow=None,
+                 max_track=None):
+        MultiService.__init__(self)
+        if max_follow is None:
+            max_follow = self.MAX_FOLLOW
+        if max_track is None:
+            max_track = self.MAX_TRACK
+        self.max_follow = max_follow
+        self.max_track = max_track
+        self.stall_warnings = stall_warnings
+        self.delimited = delimited
+        self.deduplicator = Deduplicator(delegate, seen)
+        self._shards = [_Shard(client) for client in clients]
+        self._restarts = 0
+        self.set_filter(follow, track)
+
+    def set_filter(self, follow=(), track=()):
+        """
+        Change the follow and track sets, reconnecting only the shards whose
+        share of them has changed.
+
+        :raises ValueError:
+            If there aren't enough clients for the number of shards needed.
+        """
+        follow = frozenset(follow)
+        track = frozenset(track)
+        needed = max(
+            _shards_needed(len(follow), self.max_follow),
+            _shards_needed(len(track), self.max_track))
+        if needed > len(self._shards):
+            raise ValueError(
+                "%d shards are needed, but there are only %d clients" % (
+                    needed, len(self._shards)))
+
+        # Keep everything that's still wanted where it is.
+        new_follow = [shard.follow & follow for shard in self._shards]
+        new_track = [shard.track & track for shard in self._shards]
+        self._assign(follow - frozenset().union(*new_follow), new_follow,
+                     self.max_follow)
+        self._assign(track - frozenset().union(*new_track), new_track,
+                     self.max_track)
+
+        for shard, shard_follow, shard_track in zip(
+                self._shards, new_follow, new_track):
+            if shard_follow != shard.follow or shard_track != shard.track:
+                shard.follow = shard_follow
+                shard.track = shard_track
+                self._restart(shard)
+
+    def _assign(self, items, shard_sets, limit):
+        # Fill the shards that are already connected first, in order, so the
+        # new items land on as few shards as possible.
+        items = sorted(items)
+        order = sorted(
+            range(len(self._shards)),
+            key=lambda i: self._shards[i].service is None)
+        for i in order:
+            if not items:
+                break
+            room = limit - len(shard_sets[i])
+            if room > 0:
+                shard_sets[i] = shard_sets[i].union(items[:room])
+                items = items[room:]
+
+    def _restart(self, shard):
+        if shard.service is not None:
+            # Twitter only allows one filter stream per account, so the old
+            # connection has to go before the new one is made.
+            shard.service.disownServiceParent()
+            shard.service = None
+            self._restarts += 1
+        if shard.follow or shard.track:
+            shard.service = shard.client.stream_filter(
+                self.deduplicator,
+                follow=sorted(shard.follow) or None,
+                track=sorted(shard.track) or None,
+                stall_warnings=self.stall_warnings, delimited=self.delimited)
+            shard.service.setServiceParent(self)
+
+    def get_shards(self):
+        """
+        Return a list of ``(follow, track)`` pairs of frozensets, one for each
+        client, giving each shard's share of the filter. Clients without a
+        share have empty sets.
+        """
+        return [(shard.follow, shard.track) for shard in self._shards]
+
+    def get_stats(self):
+        """
+        Return a dict of statistics about the shards and the messages they
+        have delivered.
+        """
+        stats = {
+            'shards': sum(
+                1 for shard in self._shards if shard.service is not None),
+            'restarts': self._restarts,
+        }
+        stats.update(self.deduplicator.get_stats())
+        return stats
@@ -1,33 +1,202 @@
-import json
+from collections import deque
+from random import random
 
 from twisted.application.service import Service
-from twisted.internet.defer import CancelledError
+from twisted.internet.defer import CancelledError, Deferred, maybeDeferred
+from twisted.internet.protocol import Protocol
 from twisted.protocols.basic import LineOnlyReceiver
 from twisted.protocols.policies import TimeoutMixin
+from twisted.python import log
 from twisted.python.failure import Failure
 from twisted.web.client import ResponseDone
 from twisted.web.http import PotentialDataLoss
 
-from txtwitter.error import RateLimitedError, TwitterAPIError
+from txtwitter.codec import get_codec
+from txtwitter.envelope import MessageEnvelope
+from txtwitter.error import (
+    MessageTooLargeError, RateLimitedError, StreamFramingError,
+    StreamStalledError, TwitterAPIError)
 
 
-class TwitterStreamProtocol(LineOnlyReceiver, TimeoutMixin):
-    def __init__(self, service):
+# Length lines are a handful of digits, so anything much longer than this
+# can't be one.
+MAX_LENGTH_LINE = 32
+
+
+class _StreamProtocolMixin(TimeoutMixin):
+    """
+    Behaviour shared by the stream protocols.
+
+    The stream is considered stalled if no data at all (not even a keep-alive
+    newline) arrives for the service's ``stall_timeout``, in which case it is
+    disconnected with :class:`StreamStalledError`.
+    """
+
+    _error = None
+    _paused = False
+
+    def connectionMade(self):
+        self.callLater = self.service.clock.callLater
+        self.setTimeout(self.service.stall_timeout)
+
+    def pauseProducing(self):
+        """
+        Stop reading from the stream until :meth:`resumeProducing` is called.
+
+        The stall timer is suspended while the stream is paused, since no data
+        is expected.
+        """
+        if not self._paused:
+            self._paused = True
+            self.setTimeout(None)
+            self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        """
+        Start reading from the stream again after :meth:`pauseProducing`.
+        """
+        if self._paused:
+            self._paused = False
+            self.setTimeout(self.service.stall_timeout)
+            self.transport.resumeProducing()
+
+    def timeoutConnection(self):
+        self._fail(StreamStalledError(
+            "No data received for %s seconds." % (self.timeOut,)))
+
+    def _fail(self, error):
+        self._error = Failure(error)
+        self.transport.stopProducing()
+
+    def connectionLost(self, reason):
+        self.setTimeout(None)
+        if self._error is not None:
+            reason = self._error
+        self.service.connection_lost(reason)
+
+
+class TwitterStreamProtocol(_StreamProtocolMixin, LineOnlyReceiver):
+    """
+    Parses a stream of newline separated messages.
+
+    :param service: The :class:`TwitterStreamService` to deliver messages to.
+
+    :param int max_message_size:
+        The largest message to accept. A longer message disconnects the stream
+        with :class:`MessageTooLargeError`.
+    """
+
+    def __init__(self, service, max_message_size=None):
         self.service = service
+        if max_message_size is not None:
+            self.MAX_LENGTH = max_message_size
+
+    def dataReceived(self, data):
+        self.resetTimeout()
+        LineOnlyReceiver.dataReceived(self, data)
 
     def lineReceived(self, line):
         if line:
-            self.service.delegate(json.loads(line))
+            self.service.line_received(line)
+
+    def lineLengthExceeded(self, line):
+        self._fail(MessageTooLargeError(
+            "Message exceeds %s bytes." % (self.MAX_LENGTH,)))
+
+
+class TwitterLengthDelimitedStreamProtocol(_StreamProtocolMixin, Protocol):
+    """
+    Parses a stream requested with ``delimited=length``, in which each message
+    is preceded by a line holding its length in bytes.
+
+    Each message is sliced out of the incoming data once its length is known,
+    so the buffered data is never rescanned for delimiters.
+
+    :param service: The :class:`TwitterStreamService` to deliver messages to.
+
+    :param int max_message_size:
+        The largest message to accept. A longer message disconnects the stream
+        with :class:`MessageTooLargeError`.
+    """
+
+    _disconnected = False
+
+    def __init__(self, service, max_message_size):
+        self.service = service
+        self.max_message_size = max_message_size
+        self._length_line = ''
+        self._length = None
+        self._chunks = []
+        self._received = 0
+
+    def dataReceived(self, data):
+        self.resetTimeout()
+        offset = 0
+        while offset < len(data) and not self._stopped():
+            if self._length is None:
+                offset = self._read_length(data, offset)
+            else:
+                offset = self._read_message(data, offset)
+
+    def _stopped(self):
+        return self._disconnected or self._error is not None
+
+    def _read_length(self, data, offset):
+        end = data.find('\n', offset)
+        if end < 0:
+            self._length_line += data[offset:]
+            if len(self._length_line) > MAX_LENGTH_LINE:
+                self._fail(StreamFramingError("Invalid length line."))
+            return len(data)
+
+        line = (self._length_line + data[offset:end]).strip()
+        self._length_line = ''
+        if not line:
+            # A keep-alive newline.
+            return end + 1
+        if not line.isdigit():
+            self._fail(StreamFramingError(
+                "Invalid length line: %r" % (line[:MAX_LENGTH_LINE],)))
+        elif int(line) > self.max_message_size:
+            self._fail(MessageTooLargeError(
+                "Message of %s bytes exceeds %s bytes." % (
+                    line, self.max_message_size)))
+        else:
+            self._length = int(line)
+        return end + 1
+
+    def _read_message(self, data, offset):
+        end = offset + self._length - self._received
+        if not self._chunks and end <= len(data):
+            # The whole message is in this chunk of data.
+            self._message_received(data[offset:end])
+            return end
+
+        self._chunks.append(data[offset:end])
+        self._received += len(self._chunks[-1])
+        if self._received == self._length:
+            message = ''.join(self._chunks)
+            self._chunks = []
+            self._received = 0
+            self._message_received(message)
+        return min(end, len(data))
+
+    def _message_received(self, message):
+        self._length = None
+        if message.strip():
+            self.service.line_received(message)
 
     def connectionLost(self, reason):
-        self.service.connection_lost(reason)
+        self._disconnected = True
+        _StreamProtocolMixin.connectionLost(self, reason)
 
 
 class TwitterStreamService(Service):
     """
     Streaming API service.
 
-    This service handles reconnection, but does not backfill.
+    This service handles reconnection. It can also backfill the messages
+    missed while reconnecting, if it is given a ``backfill``.
 
     From Twitter's API docs, regarding reconnections:
         <https://dev.twitter.com/docs/streaming-apis/connecting>
@@ -49,30 +218,166 @@ class TwitterStreamService(Service):
            increases the time you must wait until rate limiting will no longer
            will be in effect for your account.
 
-    For now, we just do an exponential backoff starting at one second and
-    doubling every time we reconnect to a maximum of ten minutes. For explicit
-    rate limiting, we start at 30 seconds instead of one second.
+    We follow these rules, using the error that ended the previous attempt to
+    choose the schedule. Switching to a different kind of error starts that
+    kind's schedule from the beginning. Rate limiting backoff stops growing at
+    ten minutes.
+
+    A connection only counts as established once it has delivered a message
+    or stayed up for :attr:`RECONNECT_RESET_UPTIME` seconds, and only then is
+    the backoff reset. A connection that drops before that counts as another
+    failure of the same kind as the one before it (or as a network error, if
+    there wasn't one), so a stream that accepts connections and then drops
+    them straight away isn't reconnected to in a tight loop.
+
+    :param connect_func:
+        A function that returns a ``Deferred`` that fires with the stream's
+        response.
+
+    :param delegate:
+        A function that is called with each message. If it returns a
+        ``Deferred``, the message is considered to be in flight until the
+        ``Deferred`` fires. Failures are logged.
+
+    :param codec: The JSON codec to decode messages with.
+
+    :param str delimited:
+        If ``'length'``, the stream is expected to have been requested with
+        ``delimited=length`` and messages are framed by their length. If
+        ``None``, messages are separated by newlines.
+
+    :param int max_message_size:
+        The largest message to accept. Larger messages disconnect the stream
+        with :class:`txtwitter.error.MessageTooLargeError`, after which it is
+        reconnected as usual. Defaults to :attr:`MAX_MESSAGE_SIZE`.
+
+    :param float stall_timeout:
+        If no data (including keep-alive newlines, which Twitter sends every
+        30 seconds) arrives for this many seconds, the stream is disconnected
+        with :class:`txtwitter.error.StreamStalledError` and reconnected.
+        Defaults to :attr:`STALL_TIMEOUT`.
+
+    :param int max_in_flight:
+        The largest number of messages the delegate may have in flight at
+        once. Further messages are queued and the stream is paused until the
+        delegate catches up, so that a slow delegate pushes back on Twitter
+        rather than piling up work. Defaults to :attr:`MAX_IN_FLIGHT`.
+
+    :param int batch_size:
+        If not ``None``, messages are collected into lists and the delegate is
+        called with a list of up to this many messages instead of with each
+        message. Each list counts as one message for ``max_in_flight``.
+
+    :param float batch_latency:
+        When batching, the longest a message may wait for its batch to fill
+        before the batch is delivered anyway. Defaults to
+        :attr:`BATCH_LATENCY`.
+
+    :param decoder:
+        If not ``None``, a decoder from :mod:`txtwitter.decoding` to decode
+        messages with instead of decoding them on the reactor thread. Raw
+        messages are collected until the decoder's ``batch_size`` is reached
+        or the reactor has nothing else to do, then sent for decoding. Decoded
+        messages are delivered in the order they were received. When the
+        service stops, messages that haven't been decoded yet are dropped and
+        the decoder is closed.
+
+    :param bool envelopes:
+        If ``True``, the delegate is given a
+        :class:`txtwitter.envelope.MessageEnvelope` for each message instead
+        of a decoded dict. The envelope can report what kind of message it
+        holds without decoding it, and is only decoded when its contents are
+        accessed. The ``decoder`` is not used in this mode.
+
+    :param float reconnect_jitter:
+        If not zero, each reconnect delay is increased by a random amount of
+        up to this fraction of itself, so that many services that lose their
+        connections at the same time don't all reconnect at the same time.
+        Delays are never shortened, so the rules above are still followed.
+        Immediate reconnects are not delayed.
+
+    :param backfill:
+        If not ``None``, a :class:`txtwitter.backfill.StreamBackfill` that
+        records the messages delivered and fetches the ones missed while
+        reconnecting from the REST API. Backfilled messages are delivered to
+        the delegate (as decoded dicts, even if ``envelopes`` is ``True``)
+        along with the live stream, and messages delivered by both are only
+        delivered once. The backfill starts once the new connection is
+        established, so a connection that keeps dropping straight away
+        doesn't start a backfill each time.
     """
 
-    RECONNECT_DELAY_INITIAL = 1
-    RECONNECT_DELAY_RATE_LIMIT = 30  # This gets doubled the first time.
-    RECONNECT_DELAY_MULTIPLIER = 2
-    RECONNECT_DELAY_MAX = 60 * 10
+    RECONNECT_DELAY_NETWORK_STEP = 0.25
+    RECONNECT_DELAY_NETWORK_MAX = 16
+    RECONNECT_DELAY_HTTP_INITIAL = 5
+    RECONNECT_DELAY_HTTP_MAX = 320
+    RECONNECT_DELAY_RATE_LIMIT_INITIAL = 60
+    RECONNECT_DELAY_RATE_LIMIT_MAX = 60 * 10
+    RECONNECT_RESET_UPTIME = 60
+
+    MAX_MESSAGE_SIZE = 1024 * 1024
+    STALL_TIMEOUT = 90
+    MAX_IN_FLIGHT = 100
+    BATCH_LATENCY = 1
 
     clock = None
+    _random = staticmethod(random)
 
     _connect_d = None
     _stream_response = None
     _stream_protocol = None
+    _stream_connected_at = None
+    _stream_received = False
     _reconnect_delayedcall = None
+    _paused_at = None
+    _draining = False
+    _batch_delayedcall = None
+    _decode_delayedcall = None
+    _backfill_delayedcall = None
+    _delivering_decoded = False
 
     connect_callback = None
     disconnect_callback = None
     reconnect_delay = 0
-
-    def __init__(self, connect_func, delegate):
+    _reconnect_reason = None
+
+    def __init__(self, connect_func, delegate, codec=None, delimited=None,
+                 max_message_size=None, stall_timeout=None,
+                 max_in_flight=None, batch_size=None, batch_latency=None,
+                 decoder=None, envelopes=False, reconnect_jitter=0,
+                 backfill=None):
+        if delimited not in (None, 'length'):
+            raise ValueError("Unsupported delimited value: %r" % (delimited,))
+        if max_message_size is None:
+            max_message_size = self.MAX_MESSAGE_SIZE
+        if stall_timeout is None:
+            stall_timeout = self.STALL_TIMEOUT
+        if max_in_flight is None:
+            max_in_flight = self.MAX_IN_FLIGHT
+        if batch_latency is None:
+            batch_latency = self.BATCH_LATENCY
         self.connect_func = connect_func
         self.delegate = delegate
+        self.codec = get_codec(codec)
+        self.delimited = delimited
+        self.max_message_size = max_message_size
+        self.stall_timeout = stall_timeout
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.decoder = decoder
+        self.envelopes = envelopes
+        self.reconnect_jitter = reconnect_jitter
+        self.backfill = backfill
+        self._batch = []
+        self._undecoded = []
+        self._decoding = deque()
+        self._decode_ds = set()
+        self._queue = deque()
+        self._in_flight = 0
+        self._max_queued = 0
+        self._pauses = 0
+        self._paused_time = 0
 
     def startService(self):
         Service.startService(self)
@@ -95,16 +400,235 @@ class TwitterStreamService(Service):
             self._connect_d.cancel()
             self._connect_d = None
         self.reconnect_delay = 0
+        self._reconnect_reason = None
+        self._cancel_backfill_start()
+        if self.backfill is not None:
+            self.backfill.stop()
+        self.flush()
+        if self.decoder is not None:
+            # Nothing is delivered once we've stopped, so messages that
+            # haven't been decoded yet are dropped.
+            self._undecoded = []
+            self._decoding.clear()
+            for d in list(self._decode_ds):
+                d.cancel()
+            return self.decoder.close()
+
+    def _stream_established(self):
+        if self._stream_received:
+            return True
+        if self._stream_connected_at is None:
+            return False
+        uptime = self.clock.seconds() - self._stream_connected_at
+        return uptime >= self.RECONNECT_RESET_UPTIME
 
     def connection_lost(self, reason):
+        if self._stream_established():
+            # An established connection dropped, so we reconnect immediately.
+            self._reconnect_reason = None
+            self.reconnect_delay = 0
+        else:
+            self._back_off(self._failure_kind(reason))
         self._stream_response = None
         self._stream_protocol = None
+        self._stream_connected_at = None
+        self._stream_received = False
+        self._cancel_backfill_start()
+        self._decode()
+        self.flush()
         if reason.check(PotentialDataLoss):
             reason = Failure(ResponseDone())
         if self.disconnect_callback is not None:
             self.disconnect_callback(self, reason)
         self._reconnect()
 
+    def line_received(self, line):
+        """
+        Decode a raw message and deliver it, or collect it to be sent to the
+        decoder.
+        """
+        if not self._stream_received:
+            self._stream_received = True
+            self._start_backfill()
+        if self.envelopes:
+            self.message_received(MessageEnvelope(line, self.codec))
+            return
+        if self.decoder is None:
+            self.message_received(self.codec.loads(line))
+            return
+        self._undecoded.append(line)
+        if len(self._undecoded) >= self.decoder.batch_size:
+            self._decode()
+        elif self._decode_delayedcall is None:
+            self._decode_delayedcall = self.clock.callLater(0, self._decode)
+
+    def _decode(self):
+        if self._decode_delayedcall is not None:
+            if self._decode_delayedcall.active():
+                self._decode_delayedcall.cancel()
+            self._decode_delayedcall = None
+        if not self._undecoded or not self.running:
+            return
+        lines, self._undecoded = self._undecoded, []
+        # Batches may finish decoding in any order, so each one gets a slot
+        # in the queue that its results are put into when they arrive.
+        slot = []
+        self._decoding.append(slot)
+        if len(self._decoding) >= self.decoder.max_pending:
+            self._pause()
+        d = maybeDeferred(self.decoder.decode, lines)
+        self._decode_ds.add(d)
+        d.addBoth(self._decode_finished, d)
+        d.addErrback(self._decode_failed)
+        d.addCallback(slot.append)
+        d.addCallback(self._deliver_decoded)
+        d.addErrback(log.err, "Error in stream delegate")
+
+    def _decode_finished(self, result, d):
+        self._decode_ds.discard(d)
+        return result
+
+    def _decode_failed(self, failure):
+        if failure.check(CancelledError):
+            return []
+        log.err(failure, "Error decoding stream messages")
+        return []
+
+    def _deliver_decoded(self, _=None):
+        if self._delivering_decoded:
+            return
+        self._delivering_decoded = True
+        try:
+            while self._decoding and self._decoding[0]:
+                for message in self._decoding.popleft()[0]:
+                    self.message_received(message)
+        finally:
+            self._delivering_decoded = False
+        self._update_flow()
+
+    def message_received(self, message):
+        """
+        Deliver a decoded message to the delegate, or add it to the current
+        batch if batching.
+        """
+        if self.backfill is not None and not self.backfill.message_seen(
+                message):
+            return
+        self._enqueue(message)
+
+    def _enqueue(self, message):
+        if self.batch_size is None:
+            self._deliver(message)
+            return
+        self._batch.append(message)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        elif self._batch_delayedcall is None:
+            self._batch_delayedcall = self.clock.callLater(
+                self.batch_latency, self.flush)
+
+    def flush(self):
+        """
+        Deliver the current batch of messages, if there is one, without
+        waiting for it to fill.
+        """
+        if self._batch_delayedcall is not None:
+            if self._batch_delayedcall.active():
+                self._batch_delayedcall.cancel()
+            self._batch_delayedcall = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._deliver(batch)
+
+    def _deliver(self, message):
+        # Hand a message (or batch) to the delegate, or queue it if the
+        # delegate already has max_in_flight messages in flight.
+        if self._queue or self._in_flight >= self.max_in_flight:
+            self._queue.append(message)
+            self._max_queued = max(self._max_queued, len(self._queue))
+            self._pause()
+        else:
+            self._call_delegate(message)
+
+    def _call_delegate(self, message):
+        result = self.delegate(message)
+        if isinstance(result, Deferred):
+            self._in_flight += 1
+            result.addErrback(log.err, "Error in stream delegate")
+            result.addBoth(self._delegate_done)
+            if self._in_flight >= self.max_in_flight:
+                self._pause()
+
+    def _delegate_done(self, result):
+        self._in_flight -= 1
+        self._drain()
+
+    def _drain(self):
+        # Delegates whose Deferreds have already fired call back into here,
+        # so the outermost call does the draining.
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self._queue and self._in_flight < self.max_in_flight:
+                try:
+                    self._call_delegate(self._queue.popleft())
+                except Exception:
+                    log.err(None, "Error in stream delegate")
+        finally:
+            self._draining = False
+        self._update_flow()
+
+    def _update_flow(self):
+        # Pause the stream if there is a backlog anywhere, and resume it once
+        # everything has caught up.
+        if self._queue or self._in_flight >= self.max_in_flight:
+            self._pause()
+        elif (self.decoder is not None and
+              len(self._decoding) >= self.decoder.max_pending):
+            self._pause()
+        else:
+            self._resume()
+
+    def _pause(self):
+        if self._paused_at is not None:
+            return
+        self._paused_at = self.clock.seconds()
+        self._pauses += 1
+        if self._stream_protocol is not None:
+            self._stream_protocol.pauseProducing()
+
+    def _resume(self):
+        if self._paused_at is None:
+            return
+        self._paused_time += self.clock.seconds() - self._paused_at
+        self._paused_at = None
+        if self._stream_protocol is not None:
+            self._stream_protocol.resumeProducing()
+
+    def get_stats(self):
+        """
+        Return a dict of flow control statistics.
+
+        ``in_flight`` and ``queued`` are the number of messages currently
+        being handled by the delegate and waiting for it, and ``decoding`` is
+        the number of batches waiting for the decoder. ``pauses`` counts the
+        times the stream has been paused, and ``paused_time`` is the total
+        number of seconds spent paused.
+        """
+        paused_time = self._paused_time
+        if self._paused_at is not None:
+            paused_time += self.clock.seconds() - self._paused_at
+        return {
+            'in_flight': self._in_flight,
+            'queued': len(self._queue),
+            'max_queued': self._max_queued,
+            'decoding': len(self._decoding),
+            'paused': self._paused_at is not None,
+            'pauses': self._pauses,
+            'paused_time': paused_time,
+        }
+
     def set_connect_callback(self, callback):
         self.connect_callback = callback
 
@@ -117,18 +641,47 @@ class TwitterStreamService(Service):
             self._handle_HTTP_error(response)
             return
 
-        self.reconnect_delay = self.RECONNECT_DELAY_INITIAL
         self._stream_response = response
-        self._stream_protocol = TwitterStreamProtocol(self)
+        self._stream_connected_at = self.clock.seconds()
+        self._stream_received = False
+        if self.backfill is not None:
+            # The backfill starts once the connection is established, which
+            # is when the first message arrives or after it has been up for
+            # long enough, whichever comes first.
+            self._backfill_delayedcall = self.clock.callLater(
+                self.RECONNECT_RESET_UPTIME, self._start_backfill)
+        self._stream_protocol = self._make_protocol()
         response.deliverBody(self._stream_protocol)
+        if self._paused_at is not None and self._stream_protocol is not None:
+            # We reconnected while the delegate was still catching up.
+            self._stream_protocol.pauseProducing()
         if self.connect_callback is not None:
             self.connect_callback(self)
 
+    def _start_backfill(self):
+        if self._backfill_delayedcall is None:
+            return
+        self._cancel_backfill_start()
+        # This has to start before any messages from the new connection are
+        # seen, or it would start from the newest of those rather than from
+        # where the old connection left off.
+        self.backfill.start(self._enqueue)
+
+    def _cancel_backfill_start(self):
+        if self._backfill_delayedcall is not None:
+            if self._backfill_delayedcall.active():
+                self._backfill_delayedcall.cancel()
+            self._backfill_delayedcall = None
+
+    def _make_protocol(self):
+        if self.delimited == 'length':
+            return TwitterLengthDelimitedStreamProtocol(
+                self, self.max_message_size)
+        return TwitterStreamProtocol(self, self.max_message_size)
+
     def _handle_HTTP_error(self, response):
         if response.code == 420:
             # We've been rate-limited.
-            if self.reconnect_delay < self.RECONNECT_DELAY_RATE_LIMIT:
-                self.reconnect_delay = self.RECONNECT_DELAY_RATE_LIMIT
             self.connection_lost(Failure(RateLimitedError(response.code)))
         else:
             # General HTTP error.
@@ -137,20 +690,54 @@ class TwitterStreamService(Service):
     def _connect(self):
         self._reconnect_delayedcall = None
         self._connect_d = self.connect_func()
-        self._connect_d.addCallback(self._setup_stream)
+        self._connect_d.addCallbacks(self._setup_stream, self._connect_failed)
+
+    def _connect_failed(self, failure):
+        self._connect_d = None
+        if not self.running:
+            # We were cancelled by stopService().
+            return
+        self.connection_lost(failure)
 
     def _reconnect(self):
         if not self.running:
             return
 
-        self._update_reconnect_delay()
+        delay = self.reconnect_delay
+        if self.reconnect_jitter:
+            delay += delay * self.reconnect_jitter * self._random()
         self._reconnect_delayedcall = self.clock.callLater(
-            self.reconnect_delay, self._connect)
-
-    def _update_reconnect_delay(self):
-        if self.reconnect_delay < self.RECONNECT_DELAY_INITIAL:
-            self.reconnect_delay = self.RECONNECT_DELAY_INITIAL
+            delay, self._connect)
+
+    def _failure_kind(self, reason):
+        if self._stream_response is not None:
+            # We connected, but the connection dropped before it was
+            # established, so this counts as another failure like the last.
+            return self._reconnect_reason or 'network'
+        if reason.check(RateLimitedError):
+            return 'rate_limit'
+        if reason.check(TwitterAPIError):
+            return 'http'
+        return 'network'
+
+    def _back_off(self, kind):
+        if kind == 'rate_limit':
+            self._update_reconnect_delay(
+                'rate_limit', self.RECONNECT_DELAY_RATE_LIMIT_INITIAL,
+                lambda delay: delay * 2, self.RECONNECT_DELAY_RATE_LIMIT_MAX)
+        elif kind == 'http':
+            self._update_reconnect_delay(
+                'http', self.RECONNECT_DELAY_HTTP_INITIAL,
+                lambda delay: delay * 2, self.RECONNECT_DELAY_HTTP_MAX)
+        else:
+            step = self.RECONNECT_DELAY_NETWORK_STEP
+            self._update_reconnect_delay(
+                'network', step, lambda delay: delay + step,
+                self.RECONNECT_DELAY_NETWORK_MAX)
+
+    def _update_reconnect_delay(self, reason, initial, increase, maximum):
+        if self._reconnect_reason != reason:
+            self._reconnect_reason = reason
+            self.reconnect_delay = initial
         else:
-            self.reconnect_delay *= self.RECONNECT_DELAY_MULTIPLIER
-        if self.reconnect_delay > self.RECONNECT_DELAY_MAX:
-            self.reconnect_delay = self.RECONNECT_DELAY_MAX
+            self.reconnect_delay = min(increase(self.reconnect_delay), maximum)
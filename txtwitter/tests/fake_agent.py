@@ -2,9 +2,11 @@ from StringIO import StringIO
 from urlparse import parse_qsl, urlsplit, urlunsplit
 
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.error import ConnectionAborted
 from twisted.python.failure import Failure
 from twisted.web.client import ResponseDone
 from twisted.web.http import PotentialDataLoss, RESPONSES
+from twisted.web.http_headers import Headers
 
 
 class FakeTransport(object):
@@ -16,15 +18,33 @@ class FakeTransport(object):
     def stopProducing(self):
         self._fake_response.finished(Failure(PotentialDataLoss()))
 
+    def pauseProducing(self):
+        self._fake_response.paused = True
+
+    def resumeProducing(self):
+        self._fake_response.paused = False
+        self._fake_response.deliver_data('')
+
+    def abortConnection(self):
+        self._fake_response.finished(Failure(ConnectionAborted()))
+
 
 class FakeResponse(object):
     finished_callback = None
+    paused = False
     _protocol = None
+    _done = False
 
-    def __init__(self, body, code=200):
+    def __init__(self, body, code=200, headers=None):
         self.code = code
+        if headers is None:
+            headers = Headers()
+        self.headers = headers
+        self._connection_callbacks = []
         if code == 420:
             self.phrase = 'Rate Limited'
+        elif code == 429:
+            self.phrase = 'Too Many Requests'
         else:
             self.phrase = RESPONSES[code]
 
@@ -36,30 +56,57 @@ class FakeResponse(object):
             self._finished = True
 
     def deliver_data(self, data):
-        if self._protocol is None:
-            self._body += data
-        else:
-            self._protocol.dataReceived(data)
+        self._body += data
+        if self._protocol is None or self.paused or not self._body:
+            return
+        data, self._body = self._body, ''
+        self._protocol.dataReceived(data)
 
     def finished(self, reason=None):
+        if self._done:
+            # The body can only be finished once, even if the transport is
+            # stopped while it is being delivered.
+            return
+        self._done = True
         if reason is None:
             reason = Failure(ResponseDone("Response body fully received"))
         if self.finished_callback is not None:
             self.finished_callback(reason)
         self._protocol.connectionLost(reason)
+        callbacks, self._connection_callbacks = self._connection_callbacks, []
+        for callback in callbacks:
+            callback(reason)
+
+    def add_connection_callback(self, callback):
+        """
+        Add a callback to be called with the finish reason once the body has
+        been delivered.
+        """
+        self._connection_callbacks.append(callback)
 
     def deliverBody(self, protocol):
         self._protocol = protocol
         protocol.makeConnection(FakeTransport(self))
-        self._protocol.dataReceived(self._body)
-        self._body = None
+        self.deliver_data('')
         if self._finished:
             self.finished()
 
 
 class FakeAgent(object):
-    def __init__(self):
+    """
+    A fake agent that returns canned responses for expected requests.
+
+    If ``persistent`` is ``True``, the agent also simulates a connection pool:
+    a connection to a host is held by each request until its response body has
+    been completely delivered, at which point it becomes available for reuse.
+    """
+
+    def __init__(self, persistent=False):
         self.expected_requests = {}
+        self.persistent = persistent
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self._idle_connections = {}
 
     def add_expected_request(self, method, uri, params, response):
         key = (method, urlsplit(uri).geturl(), tuple(sorted(params.items())))
@@ -75,8 +122,46 @@ class FakeAgent(object):
         yield bodyProducer.startProducing(consumer)
         returnValue(consumer.getvalue())
 
-    @inlineCallbacks
+    def _get_connection(self, host_key):
+        if self._idle_connections.get(host_key, 0) > 0:
+            self._idle_connections[host_key] -= 1
+            self.connections_reused += 1
+        else:
+            self.connections_opened += 1
+
+    def _release_connection(self, host_key, response):
+        def release(reason):
+            if reason.check(ResponseDone):
+                self._idle_connections.setdefault(host_key, 0)
+                self._idle_connections[host_key] += 1
+
+        if isinstance(response, FakeResponse):
+            response.add_connection_callback(release)
+
+    def idle_connections(self, host_key=None):
+        """
+        Return the number of idle connections, optionally for a single
+        ``(scheme, netloc)`` host key.
+        """
+        if host_key is None:
+            return sum(self._idle_connections.values())
+        return self._idle_connections.get(host_key, 0)
+
     def request(self, method, uri, headers=None, bodyProducer=None):
+        if not self.persistent:
+            return self._request(method, uri, headers, bodyProducer)
+
+        host_key = tuple(urlsplit(uri)[:2])
+        self._get_connection(host_key)
+        d = self._request(method, uri, headers, bodyProducer)
+
+        def _cb(response):
+            self._release_connection(host_key, response)
+            return response
+        return d.addCallback(_cb)
+
+    @inlineCallbacks
+    def _request(self, method, uri, headers=None, bodyProducer=None):
         scheme, netloc, path, query, fragment = urlsplit(uri)
         uri = urlunsplit([scheme, netloc, path, '', ''])
         params = parse_qsl(query)
@@ -90,10 +175,14 @@ class FakeAgent(object):
                 key = ('POST', uri, body)
                 assert key in self.expected_requests, (
                     'Request key not found: %s' % (key,))
-                returnValue(self.expected_requests[key])
+                response = yield self.expected_requests[key]
+                returnValue(response)
 
         key = (method, uri, tuple(sorted(params)))
         assert key in self.expected_requests, (
             "Request key not found: %s" % (key,))
 
-        returnValue(self.expected_requests[key])
+        # The response may be a Deferred, so the test can control when it
+        # arrives.
+        response = yield self.expected_requests[key]
+        returnValue(response)
@@ -0,0 +1,16 @@
+"""
+Minimal stream messages for tests that only care about IDs.
+"""
+
+
+def tweet(id_str):
+    return {'id_str': id_str, 'text': 'Tweet %s' % (id_str,), 'user': {}}
+
+
+def dm(id_str):
+    return {
+        'id_str': id_str,
+        'text': 'DM %s' % (id_str,),
+        'sender': {},
+        'recipient': {},
+    }
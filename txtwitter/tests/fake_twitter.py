@@ -2,11 +2,15 @@ from datetime import datetime
 from inspect import getmembers
 import json
 import re
+from StringIO import StringIO
 from urlparse import urlparse, parse_qsl
 
-from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import fail, maybeDeferred
+from twisted.web.http_headers import Headers
 
-from txtwitter.error import TwitterAPIError
+from txtwitter.codec import get_codec
+from txtwitter.error import RateLimitedError, TwitterAPIError
+from txtwitter.ratelimit import RateLimitTracker, endpoint_for_uri
 from txtwitter.tests.fake_agent import FakeResponse
 from txtwitter.twitter import (
     TWITTER_API_URL, TWITTER_STREAM_URL, TWITTER_USERSTREAM_URL,
@@ -60,9 +64,20 @@ class FakeImage(object):
         return self.file_content
 
 
+class FakeMediaFile(StringIO):
+    """
+    A seekable in-memory media file.
+    """
+
+    def __init__(self, name, file_content):
+        StringIO.__init__(self, file_content)
+        self.name = name
+
+
 class FakeStream(object):
-    def __init__(self):
+    def __init__(self, delimited=None):
         self.resp = FakeResponse(None)
+        self.delimited = delimited
         self._message_types = {}
 
     def add_message_type(self, message_type, predicate):
@@ -73,8 +88,10 @@ class FakeStream(object):
         return predicate is not None and predicate(data)
 
     def deliver(self, data):
-        self.resp.deliver_data(json.dumps(data))
-        self.resp.deliver_data('\r\n')
+        data = json.dumps(data) + '\r\n'
+        if self.delimited == 'length':
+            self.resp.deliver_data('%d\r\n' % (len(data),))
+        self.resp.deliver_data(data)
 
 
 class FakeTweet(object):
@@ -260,6 +277,7 @@ class FakeUser(object):
 class FakeMedia(object):
     def __init__(self, media_id_str, fake_image, **kw):
         self.media_id_str = media_id_str
+        self.file_content = fake_image.file_content
         self.size = fake_image.size
         self.expires_after_secs = 60
         self.image = {
@@ -288,6 +306,28 @@ class FakeMedia(object):
         return media_dict
 
 
+class FakeChunkedUpload(object):
+    def __init__(self, media_id_str, total_bytes, media_type, **kw):
+        self.media_id_str = media_id_str
+        self.total_bytes = total_bytes
+        self.media_type = media_type
+        self.segments = {}
+        self.kw = kw
+
+    def append(self, segment_index, data):
+        self.segments[segment_index] = data
+
+    def content(self):
+        return ''.join(data for _, data in sorted(self.segments.items()))
+
+    def to_dict(self, twitter_data):
+        return {
+            'media_id': int(self.media_id_str),
+            'media_id_string': self.media_id_str,
+            'expires_after_secs': 86400,
+        }
+
+
 class FakeFollow(object):
     def __init__(self, source_id, target_id, notify=False, **kw):
         self.source_id = source_id
@@ -320,13 +360,23 @@ class FakeFollow(object):
 
 
 class FakeTwitterData(object):
-    def __init__(self):
+    RATE_LIMIT_WINDOW = 15 * 60
+
+    def __init__(self, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        # Maps API paths to the number of calls allowed in each window.
+        self.rate_limits = {}
+        self._rate_limit_windows = {}
         self.users = {}
         self.dms = {}
         self.tweets = {}
         self.follows = {}
         self.streams = {}
         self.media = {}
+        self.chunked_uploads = {}
+        self.append_failures = {}
         self._next_dm_id = 1000
         self._next_tweet_id = 1000
         self._next_user_id = 1000
@@ -348,6 +398,39 @@ class FakeTwitterData(object):
     def next_media_id(self):
         return str(self._next_media_id)
 
+    def use_rate_limit(self, user_id_str, api_path):
+        """
+        Count a call to an API path against a user's rate limit.
+
+        :returns:
+            An ``(allowed, headers)`` tuple, where ``headers`` contains the
+            ``x-rate-limit-*`` headers for the response. If the path has no
+            rate limit, the call is allowed and the headers are empty.
+        """
+        headers = Headers()
+        limit = self.rate_limits.get(api_path)
+        if limit is None:
+            return True, headers
+
+        now = int(self.clock.seconds())
+        key = (user_id_str, api_path)
+        window = self._rate_limit_windows.get(key)
+        if window is None or window['reset'] <= now:
+            window = {
+                'remaining': limit,
+                'reset': now + self.RATE_LIMIT_WINDOW,
+            }
+            self._rate_limit_windows[key] = window
+        allowed = window['remaining'] > 0
+        if allowed:
+            window['remaining'] -= 1
+
+        headers.setRawHeaders('x-rate-limit-limit', [str(limit)])
+        headers.setRawHeaders(
+            'x-rate-limit-remaining', [str(window['remaining'])])
+        headers.setRawHeaders('x-rate-limit-reset', [str(window['reset'])])
+        return allowed, headers
+
     def streams_accepting(self, message_type, data):
         return (stream for stream in self.streams.itervalues()
                 if stream.accepts(message_type, data))
@@ -368,8 +451,8 @@ class FakeTwitterData(object):
         for stream in self.streams_accepting('unfollow', follow):
             stream.deliver(follow.to_dict(self, event='unfollow'))
 
-    def new_stream(self):
-        stream = FakeStream()
+    def new_stream(self, delimited=None):
+        stream = FakeStream(delimited)
 
         def finished_callback(r):
             self.remove_stream(stream.resp)
@@ -418,6 +501,21 @@ class FakeTwitterData(object):
         self.media[media.media_id_str] = media
         return media
 
+    def init_chunked_upload(self, total_bytes, media_type, **kw):
+        media_id_str = self.next_media_id
+        self._next_media_id += 10
+        self.chunked_uploads[media_id_str] = FakeChunkedUpload(
+            media_id_str, total_bytes, media_type, **kw)
+        return self.chunked_uploads[media_id_str]
+
+    def get_chunked_upload(self, media_id_str):
+        return self.chunked_uploads.get(media_id_str)
+
+    def finalize_chunked_upload(self, media_id_str):
+        upload = self.chunked_uploads.pop(media_id_str)
+        image = FakeImage('chunked', upload.content(), size=upload.total_bytes)
+        return self.add_media(media_id_str, image, **upload.kw)
+
     def add_follow(self, source_id, target_id):
         key = (source_id, target_id)
 
@@ -501,35 +599,56 @@ class FakeTwitterClient(TwitterClient):
                  upload_url=TWITTER_UPLOAD_URL):
         self._fake_twitter = fake_twitter
         self._fake_twitter_user_id_str = user_id_str
+        self._token_key = user_id_str
+        self.rate_limits = RateLimitTracker(fake_twitter.clock)
+        self.coalescer = None
+        self.cache = None
+        self.timeout = None
+        self.retry_policy = None
+        self.reactor = fake_twitter.clock
+        self._pending = set()
+        self.compression_stats = None
+        self.stream_compression_stats = None
         self._api_url_base = api_url
         self._stream_url_base = stream_url
         self._userstream_url_base = userstream_url
-        self._upload_url = upload_url
-
-    def _make_request(self, method, uri, body_parameters=None):
-        return self._fake_twitter.dispatch(
-            self._fake_twitter_user_id_str, method, uri, body_parameters)
-
-    def _upload_media(self, uri, media, params):
+        self._upload_url_base = upload_url
+        self._codec = get_codec()
+
+    def _make_request(self, method, uri, body_parameters=None, stream=False):
+        headers = Headers()
+        d = self._fake_twitter.dispatch(
+            self._fake_twitter_user_id_str, method, uri, body_parameters,
+            headers)
+        self.rate_limits.update(
+            self._token_key, endpoint_for_uri(uri), headers)
+        return d
+
+    def _upload_media(self, uri, media, params, parse=True):
         return self._fake_twitter.dispatch_multipart(
             self._fake_twitter_user_id_str,
-            self._make_uri(self._upload_url, uri), media, params)
+            self._make_uri(self._upload_url_base, uri), media, params)
 
     def _parse_response(self, response):
         return response
 
+    def _parse_response_items(self, response, delegate):
+        for item in response:
+            delegate(item)
+        return len(response)
+
 
 class FakeTwitter(object):
     def __init__(self, api_url=TWITTER_API_URL, stream_url=TWITTER_STREAM_URL,
                  userstream_url=TWITTER_USERSTREAM_URL,
-                 upload_url=TWITTER_UPLOAD_URL):
+                 upload_url=TWITTER_UPLOAD_URL, clock=None):
         self.urls = {
             'api': api_url,
             'stream': stream_url,
             'userstream': userstream_url,
             'upload': upload_url,
         }
-        self.twitter_data = FakeTwitterData()
+        self.twitter_data = FakeTwitterData(clock)
 
     def __getattr__(self, name):
         return getattr(self.twitter_data, name)
@@ -554,7 +673,8 @@ class FakeTwitter(object):
 
         raise ValueError("Unexpected URI: %r" % (uri,))
 
-    def dispatch(self, user, method, uri, body_parameters):
+    def dispatch(self, user, method, uri, body_parameters,
+                 response_headers=None):
         """
         Dispatch a fake request to the appropriate place.
 
@@ -562,6 +682,9 @@ class FakeTwitter(object):
         elsewhere and Twitter's API doesn't have different behaviour for the
         same URI depending on the method.
 
+        If ``response_headers`` is provided, the rate limit headers for the
+        request are added to it.
+
         """
         params = {}
         if body_parameters is not None:
@@ -570,10 +693,20 @@ class FakeTwitter(object):
             params.update(dict(parse_qsl(urlparse(uri).query)))
 
         method = self.get_api_method(user, uri)
+        allowed, headers = self.twitter_data.use_rate_limit(
+            user, method.api_path)
+        if response_headers is not None:
+            for name, values in headers.getAllRawHeaders():
+                response_headers.setRawHeaders(name, values)
+        if not allowed:
+            return fail(RateLimitedError(429, "Too Many Requests", json.dumps({
+                "errors": [{"message": "Rate limit exceeded", "code": 88}]})))
         return maybeDeferred(method, **params)
 
     def dispatch_multipart(self, user, uri, body, params):
         method = self.get_api_method(user, uri)
+        if isinstance(params, dict):
+            return maybeDeferred(method, body, **params)
         return maybeDeferred(method, body, params)
 
 
@@ -722,9 +855,50 @@ class FakeTwitterAPI(object):
         raise NotImplementedError()
 
     @fake_api('media/upload.json', host_prefix='upload')
-    def media_upload(self, media, additional_owners=None):
-        media = self._twitter_data.new_media(
-            media, additional_owners=additional_owners)
+    def media_upload(self, media=None, additional_owners=None, command=None,
+                     **kw):
+        if command is None:
+            media = self._twitter_data.new_media(
+                media, additional_owners=additional_owners)
+            return media.to_dict(self._twitter_data)
+        if command == 'INIT':
+            return self._media_upload_init(additional_owners, **kw)
+        if command == 'APPEND':
+            return self._media_upload_append(media, **kw)
+        if command == 'FINALIZE':
+            return self._media_upload_finalize(**kw)
+        raise NotImplementedError("command=%s" % (command,))
+
+    def _400(self, message):
+        raise TwitterAPIError(400, "Bad Request", json.dumps({
+            "errors": [{"message": message, "code": 324}]}))
+
+    def _chunked_upload_or_400(self, media_id):
+        upload = self._twitter_data.get_chunked_upload(media_id)
+        if upload is None:
+            self._400("Invalid mediaId.")
+        return upload
+
+    def _media_upload_init(self, additional_owners, total_bytes, media_type,
+                           media_category=None):
+        upload = self._twitter_data.init_chunked_upload(
+            int(total_bytes), media_type, additional_owners=additional_owners)
+        return upload.to_dict(self._twitter_data)
+
+    def _media_upload_append(self, media, media_id, segment_index):
+        upload = self._chunked_upload_or_400(media_id)
+        segment_index = int(segment_index)
+        failures = self._twitter_data.append_failures
+        if failures.get(segment_index, 0) > 0:
+            failures[segment_index] -= 1
+            raise TwitterAPIError(503, "Service Unavailable")
+        upload.append(segment_index, media.read())
+
+    def _media_upload_finalize(self, media_id):
+        upload = self._chunked_upload_or_400(media_id)
+        if len(upload.content()) != upload.total_bytes:
+            self._400("File size does not match total_bytes.")
+        media = self._twitter_data.finalize_chunked_upload(media_id)
         return media.to_dict(self._twitter_data)
 
     # TODO: Implement statuses_oembed()
@@ -738,7 +912,7 @@ class FakeTwitterAPI(object):
 
     @fake_api('statuses/filter.json', 'stream')
     def stream_filter(self, follow=None, track=None, locations=None,
-                      stall_warnings=None):
+                      stall_warnings=None, delimited=None):
         track_res = []
         if track:
             for term in track.split(','):
@@ -755,7 +929,7 @@ class FakeTwitterAPI(object):
                     return True
             return False
 
-        stream = self._twitter_data.new_stream()
+        stream = self._twitter_data.new_stream(delimited)
         stream.add_message_type('tweet', stream_filter_predicate)
         return stream.resp
 
@@ -764,7 +938,8 @@ class FakeTwitterAPI(object):
 
     @fake_api('user.json', 'userstream')
     def userstream_user(self, stringify_friend_ids, stall_warnings=None,
-                        with_='followings', replies=None, **kw):
+                        with_='followings', replies=None, delimited=None,
+                        **kw):
         with_ = kw.pop('with', with_)
         assert kw == {}
         user = self._twitter_data.get_user(self._user_id_str)
@@ -797,7 +972,7 @@ class FakeTwitterAPI(object):
                 return True
             return False
 
-        stream = self._twitter_data.new_stream()
+        stream = self._twitter_data.new_stream(delimited)
         stream.add_message_type('tweet', userstream_tweet_predicate)
         stream.add_message_type('dm', userstream_dm_predicate)
         stream.add_message_type('follow', userstream_follow_predicate)
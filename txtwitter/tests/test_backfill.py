@@ -0,0 +1,230 @@
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import TestCase
+
+from txtwitter.tests.fake_messages import dm, tweet
+
+
+def from_backfill(name):
+    @property
+    def prop(self):
+        from txtwitter import backfill
+        return getattr(backfill, name)
+    return prop
+
+
+class FakeClient(object):
+    """
+    Records timeline requests and lets the tests answer them.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.cancelled = []
+
+    def _request(self, method, **kw):
+        d = Deferred(lambda _: self.cancelled.append(method))
+        self.requests.append((method, kw, d))
+        return d
+
+    def statuses_mentions_timeline(self, **kw):
+        return self._request('mentions', **kw)
+
+    def statuses_user_timeline(self, **kw):
+        return self._request('user_timeline', **kw)
+
+    def direct_messages(self, **kw):
+        return self._request('direct_messages', **kw)
+
+    def respond(self, items):
+        method, kw, d = self.requests.pop(0)
+        d.callback(items)
+        return method, kw
+
+
+class TestStreamBackfill(TestCase):
+    _StreamBackfill = from_backfill('StreamBackfill')
+
+    def _backfill(self, **kw):
+        client = FakeClient()
+        return client, self._StreamBackfill(client, **kw)
+
+    def test_records_last_ids(self):
+        """
+        The newest tweet and DM IDs delivered by the stream are recorded,
+        whether or not the DMs are wrapped.
+        """
+        client, backfill = self._backfill()
+        self.assertEqual(backfill.last_tweet_id, None)
+        self.assertEqual(backfill.last_dm_id, None)
+        for message in [tweet('10'), tweet('9'), {'friends_str': []},
+                        {'direct_message': dm('5')}, dm('4')]:
+            self.assertEqual(backfill.message_seen(message), True)
+        self.assertEqual(backfill.last_tweet_id, '10')
+        self.assertEqual(backfill.last_dm_id, '5')
+
+    def test_nothing_to_backfill(self):
+        """
+        Nothing is requested if no IDs have been seen yet.
+        """
+        client, backfill = self._backfill(direct_messages=True)
+        d = backfill.start(lambda message: None)
+        self.assertEqual(client.requests, [])
+        self.assertEqual(self.successResultOf(d), None)
+
+    def test_backfill(self):
+        """
+        Each source is requested from the newest ID seen, and the results are
+        delivered oldest first once the source's gap has been covered.
+        """
+        client, backfill = self._backfill(user_id='7', direct_messages=True)
+        backfill.message_seen(tweet('10'))
+        backfill.message_seen({'direct_message': dm('3')})
+        delivered = []
+        d = backfill.start(delivered.append)
+
+        method, kw = client.respond([tweet('12'), tweet('11')])
+        self.assertEqual((method, kw), ('mentions', {
+            'count': 200, 'since_id': '10', 'max_id': None}))
+        method, kw = client.respond([tweet('11')])
+        self.assertEqual((method, kw), ('user_timeline', {
+            'user_id': '7', 'count': 200, 'since_id': '10', 'max_id': None}))
+        method, kw = client.respond([dm('4')])
+        self.assertEqual((method, kw), ('direct_messages', {
+            'count': 200, 'since_id': '3', 'max_id': None}))
+        # Each page reached the message after the since_id, so there is
+        # nothing more to fetch.
+        self.assertEqual(client.requests, [])
+
+        self.assertEqual(delivered, [
+            tweet('11'), tweet('12'), {'direct_message': dm('4')}])
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(backfill.last_tweet_id, '12')
+        self.assertEqual(backfill.last_dm_id, '4')
+
+    def test_paging(self):
+        """
+        Pages are requested with decreasing ``max_id`` until one reaches the
+        ``since_id``.
+        """
+        client, backfill = self._backfill(count=2)
+        backfill.message_seen(tweet('10'))
+        delivered = []
+        backfill.start(delivered.append)
+        _, kw = client.respond([tweet('20'), tweet('18')])
+        self.assertEqual(kw['max_id'], None)
+        _, kw = client.respond([tweet('15'), tweet('14')])
+        self.assertEqual(kw['max_id'], '17')
+        _, kw = client.respond([tweet('13'), tweet('12')])
+        self.assertEqual(kw['max_id'], '13')
+        _, kw = client.respond([])
+        self.assertEqual(kw['max_id'], '11')
+        self.assertEqual(client.requests, [])
+        self.assertEqual(
+            [message['id_str'] for message in delivered],
+            ['12', '13', '14', '15', '18', '20'])
+
+    def test_max_pages(self):
+        """
+        No more than ``max_pages`` pages are requested per source.
+        """
+        client, backfill = self._backfill(count=1, max_pages=2)
+        backfill.message_seen(tweet('10'))
+        delivered = []
+        backfill.start(delivered.append)
+        client.respond([tweet('20')])
+        client.respond([tweet('19')])
+        self.assertEqual(client.requests, [])
+        self.assertEqual(delivered, [tweet('19'), tweet('20')])
+        self.assertEqual(backfill.get_stats()['truncated'], 1)
+
+    def test_max_concurrent(self):
+        """
+        No more than ``max_concurrent`` requests are in flight at once.
+        """
+        client, backfill = self._backfill(
+            user_id='7', direct_messages=True, max_concurrent=2)
+        backfill.message_seen(tweet('10'))
+        backfill.message_seen(dm('3'))
+        backfill.start(lambda message: None)
+        self.assertEqual(len(client.requests), 2)
+        client.respond([])
+        self.assertEqual(len(client.requests), 2)
+        client.respond([])
+        client.respond([])
+        self.assertEqual(client.requests, [])
+        self.assertEqual(backfill.get_stats()['requests'], 3)
+
+    def test_duplicates(self):
+        """
+        Messages delivered by the stream during a backfill are not backfilled,
+        and backfilled messages are not delivered again by the stream.
+        """
+        client, backfill = self._backfill()
+        backfill.message_seen(tweet('10'))
+        delivered = []
+        backfill.start(delivered.append)
+        self.assertEqual(backfill.message_seen(tweet('13')), True)
+        client.respond([tweet('13'), tweet('12'), tweet('11')])
+        self.assertEqual(delivered, [tweet('11'), tweet('12')])
+        self.assertEqual(backfill.message_seen(tweet('12')), False)
+        self.assertEqual(backfill.message_seen(tweet('14')), True)
+        self.assertEqual(backfill.get_stats()['duplicates'], 2)
+
+    def test_failure(self):
+        """
+        A failed request is logged, and the pages already fetched are
+        delivered.
+        """
+        client, backfill = self._backfill()
+        backfill.message_seen(tweet('10'))
+        delivered = []
+        d = backfill.start(delivered.append)
+        client.respond([tweet('13'), tweet('12')])
+        client.requests.pop(0)[2].errback(ValueError("Oops"))
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(delivered, [tweet('12'), tweet('13')])
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(backfill.get_stats()['running'], 0)
+
+    def test_stop(self):
+        """
+        Stopping cancels requests in flight, drops queued ones and delivers
+        nothing more.
+        """
+        client, backfill = self._backfill(direct_messages=True)
+        backfill.message_seen(tweet('10'))
+        backfill.message_seen(dm('3'))
+        delivered = []
+        d = backfill.start(delivered.append)
+        self.assertEqual(len(client.requests), 1)
+        backfill.stop()
+        self.assertEqual(client.cancelled, ['mentions'])
+        self.assertEqual(backfill.get_stats()['requests'], 1)
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(delivered, [])
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+    def test_restart(self):
+        """
+        Starting a backfill while one is still running abandons the old one,
+        and the new one starts where the old one did, even if the stream has
+        delivered newer messages since.
+        """
+        client, backfill = self._backfill()
+        backfill.message_seen(tweet('10'))
+        delivered = []
+        backfill.start(delivered.append)
+        self.assertEqual(backfill.message_seen(tweet('13')), True)
+        backfill.start(delivered.append)
+        self.assertEqual(client.cancelled, ['mentions'])
+        client.requests.pop(0)
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '10')
+        client.respond([tweet('13'), tweet('12'), tweet('11')])
+        self.assertEqual(delivered, [tweet('11'), tweet('12')])
+        self.assertEqual(backfill.get_stats()['running'], 0)
+
+        # The next backfill starts from the newest ID again.
+        backfill.start(delivered.append)
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '13')
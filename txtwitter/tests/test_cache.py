@@ -0,0 +1,172 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+
+def from_cache(name):
+    @property
+    def prop(self):
+        from txtwitter import cache
+        return getattr(cache, name)
+    return prop
+
+
+class TestResponseCache(TestCase):
+    _ResponseCache = from_cache('ResponseCache')
+    _DEFAULT_TTLS = from_cache('DEFAULT_TTLS')
+
+    def _cache(self, **kw):
+        clock = Clock()
+        kw.setdefault('ttls', {'show': 60, 'other': 10})
+        return clock, self._ResponseCache(clock=clock, **kw)
+
+    def test_default_ttls(self):
+        """
+        The default TTLs are used if none are given.
+        """
+        cache = self._ResponseCache(clock=Clock())
+        self.assertEqual(cache.ttls, self._DEFAULT_TTLS)
+        self.assertTrue(cache.is_cacheable('statuses/show.json'))
+        self.assertFalse(cache.is_cacheable('statuses/home_timeline.json'))
+
+    def test_get_miss(self):
+        """
+        Missing responses give the default.
+        """
+        clock, cache = self._cache()
+        self.assertEqual(cache.get('show', {'id': '1'}), None)
+        self.assertEqual(cache.get('show', {'id': '1'}, 'default'), 'default')
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 0)
+
+    def test_set_and_get(self):
+        """
+        Cached responses are returned for requests with the same parameters.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': '1', 'trim_user': 'true'}, 'tweet 1')
+        self.assertEqual(
+            cache.get('show', {'trim_user': 'true', 'id': '1'}), 'tweet 1')
+        self.assertEqual(cache.get('show', {'id': '1'}), None)
+        self.assertEqual(cache.get('other', {'id': '1'}), None)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_uncacheable(self):
+        """
+        Responses from resources without a TTL are not cached or counted.
+        """
+        clock, cache = self._cache()
+        cache.set('timeline', {}, 'tweets')
+        self.assertEqual(cache.get('timeline', {}), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.misses, 0)
+
+    def test_expiry(self):
+        """
+        Responses expire after their resource's TTL.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': '1'}, 'tweet 1')
+        cache.set('other', {'id': '1'}, 'other 1')
+        clock.advance(10)
+        self.assertEqual(cache.get('show', {'id': '1'}), 'tweet 1')
+        self.assertEqual(cache.get('other', {'id': '1'}), None)
+        clock.advance(50)
+        self.assertEqual(cache.get('show', {'id': '1'}), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        """
+        The least recently used response is evicted when the cache is full.
+        """
+        clock, cache = self._cache(max_entries=2)
+        cache.set('show', {'id': '1'}, 'tweet 1')
+        cache.set('show', {'id': '2'}, 'tweet 2')
+        cache.get('show', {'id': '1'})
+        cache.set('show', {'id': '3'}, 'tweet 3')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get('show', {'id': '1'}), 'tweet 1')
+        self.assertEqual(cache.get('show', {'id': '2'}), None)
+        self.assertEqual(cache.get('show', {'id': '3'}), 'tweet 3')
+
+    def test_invalidate(self):
+        """
+        Responses can be invalidated by resource and parameters.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': '1'}, 'tweet 1')
+        cache.set('show', {'id': '1', 'trim_user': 'true'}, 'tweet 1 trim')
+        cache.set('show', {'id': '2'}, 'tweet 2')
+        cache.set('other', {'id': '1'}, 'other 1')
+
+        self.assertEqual(cache.invalidate('show', id='1'), 2)
+        self.assertEqual(cache.get('show', {'id': '1'}), None)
+        self.assertEqual(cache.get('show', {'id': '2'}), 'tweet 2')
+        self.assertEqual(cache.get('other', {'id': '1'}), 'other 1')
+
+        self.assertEqual(cache.invalidate(id='1'), 1)
+        self.assertEqual(cache.get('other', {'id': '1'}), None)
+        self.assertEqual(cache.invalidations, 3)
+
+    def test_tokens(self):
+        """
+        Responses are cached separately for each access token, and are
+        invalidated for all of them.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': '1'}, 'dm for a', token='a')
+        self.assertEqual(cache.get('show', {'id': '1'}, token='a'), 'dm for a')
+        self.assertEqual(cache.get('show', {'id': '1'}, token='b'), None)
+        cache.set('show', {'id': '1'}, 'dm for b', token='b')
+        self.assertEqual(cache.invalidate('show', id='1'), 2)
+
+    def test_int_params(self):
+        """
+        An int parameter value matches the same value as a str.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': 1}, 'tweet 1')
+        self.assertEqual(cache.get('show', {'id': '1'}), 'tweet 1')
+        self.assertEqual(cache.invalidate('show', id=1), 1)
+        cache.set('show', {'id': '2'}, 'tweet 2')
+        self.assertEqual(cache.invalidate('show', id=2), 1)
+
+    def test_invalidate_blocks_stale_set(self):
+        """
+        A response to a request made before an invalidation isn't cached.
+        """
+        clock, cache = self._cache()
+        generation = cache.generation
+        cache.invalidate('show', id='1')
+        cache.set('show', {'id': '1'}, 'stale', generation)
+        self.assertEqual(len(cache), 0)
+        cache.set('show', {'id': '1'}, 'fresh', cache.generation)
+        self.assertEqual(cache.get('show', {'id': '1'}), 'fresh')
+
+    def test_clear(self):
+        """
+        clear() removes all responses.
+        """
+        clock, cache = self._cache()
+        cache.set('show', {'id': '1'}, 'tweet 1')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        """
+        get_stats() reports the cache counters.
+        """
+        clock, cache = self._cache(max_entries=1)
+        cache.set('show', {'id': '1'}, 'tweet 1')
+        cache.set('show', {'id': '2'}, 'tweet 2')
+        cache.get('show', {'id': '2'})
+        cache.get('show', {'id': '1'})
+        cache.invalidate('show')
+        self.assertEqual(cache.get_stats(), {
+            'entries': 0,
+            'hits': 1,
+            'misses': 1,
+            'evictions': 1,
+            'invalidations': 1,
+        })
@@ -0,0 +1,125 @@
+from twisted.internet.defer import CancelledError, Deferred, succeed
+from twisted.trial.unittest import TestCase
+
+
+def from_coalesce(name):
+    @property
+    def prop(self):
+        from txtwitter import coalesce
+        return getattr(coalesce, name)
+    return prop
+
+
+class TestRequestCoalescer(TestCase):
+    _RequestCoalescer = from_coalesce('RequestCoalescer')
+
+    def _deferred_func(self):
+        calls = []
+
+        def func(*args):
+            d = Deferred()
+            calls.append((args, d))
+            return d
+        return calls, func
+
+    def test_identical_calls_coalesced(self):
+        """
+        Calls with the same key made while one is in flight share its result.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        d1 = coalescer.call('key', func, 'a')
+        d2 = coalescer.call('key', func, 'a')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(coalescer.in_flight(), 1)
+        self.assertNoResult(d1)
+        self.assertNoResult(d2)
+
+        result = {'id': 1}
+        calls[0][1].callback(result)
+        self.assertIs(self.successResultOf(d1), result)
+        self.assertIs(self.successResultOf(d2), result)
+        self.assertEqual(coalescer.in_flight(), 0)
+        self.assertEqual(coalescer.calls, 2)
+        self.assertEqual(coalescer.coalesced, 1)
+
+    def test_different_keys(self):
+        """
+        Calls with different keys are not coalesced.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        coalescer.call('key1', func, 'a')
+        coalescer.call('key2', func, 'b')
+        self.assertEqual([args for args, _ in calls], [('a',), ('b',)])
+        self.assertEqual(coalescer.coalesced, 0)
+
+    def test_sequential_calls_not_coalesced(self):
+        """
+        A call made after the previous identical call has finished is made
+        again.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        d1 = coalescer.call('key', func)
+        calls[0][1].callback('one')
+        self.assertEqual(self.successResultOf(d1), 'one')
+        d2 = coalescer.call('key', func)
+        self.assertEqual(len(calls), 2)
+        calls[1][1].callback('two')
+        self.assertEqual(self.successResultOf(d2), 'two')
+
+    def test_synchronous_result(self):
+        """
+        Calls that complete synchronously are not remembered.
+        """
+        coalescer = self._RequestCoalescer()
+        self.assertEqual(
+            self.successResultOf(coalescer.call('key', succeed, 'a')), 'a')
+        self.assertEqual(coalescer.in_flight(), 0)
+
+    def test_failure_shared(self):
+        """
+        A failure is delivered to every waiting caller.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        d1 = coalescer.call('key', func)
+        d2 = coalescer.call('key', func)
+        calls[0][1].errback(ValueError('boom'))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+        self.assertEqual(coalescer.in_flight(), 0)
+
+    def test_cancel_one_waiter(self):
+        """
+        Cancelling one caller's Deferred doesn't affect the others.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        d1 = coalescer.call('key', func)
+        d2 = coalescer.call('key', func)
+        d1.cancel()
+        self.failureResultOf(d1, CancelledError)
+        self.assertNoResult(d2)
+        calls[0][1].callback('result')
+        self.assertEqual(self.successResultOf(d2), 'result')
+
+    def test_cancel_all_waiters(self):
+        """
+        Cancelling every caller's Deferred cancels the underlying call.
+        """
+        coalescer = self._RequestCoalescer()
+        calls, func = self._deferred_func()
+        d1 = coalescer.call('key', func)
+        d2 = coalescer.call('key', func)
+        d1.cancel()
+        self.assertFalse(calls[0][1].called)
+        d2.cancel()
+        self.failureResultOf(d1, CancelledError)
+        self.failureResultOf(d2, CancelledError)
+        self.assertTrue(calls[0][1].called)
+        self.assertEqual(coalescer.in_flight(), 0)
+
+        coalescer.call('key', func)
+        self.assertEqual(len(calls), 2)
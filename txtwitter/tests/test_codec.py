@@ -0,0 +1,105 @@
+import json
+
+from twisted.trial.unittest import TestCase
+
+
+def from_codec(name):
+    @property
+    def prop(self):
+        from txtwitter import codec
+        return getattr(codec, name)
+    return prop
+
+
+def _missing_codec():
+    raise ImportError("No module named missing")
+
+
+class TestCodec(TestCase):
+    _codec = from_codec('codec')
+    _get_codec = from_codec('get_codec')
+    _JSONCodec = from_codec('JSONCodec')
+    _STDLIB_CODEC = from_codec('STDLIB_CODEC')
+
+    def patch_loaders(self, **loaders):
+        from txtwitter import codec
+        patched = dict(codec.CODEC_LOADERS)
+        patched.update(loaders)
+        self.patch(codec, 'CODEC_LOADERS', patched)
+
+    def test_default_stdlib(self):
+        """
+        get_codec() should return the stdlib codec by default.
+        """
+        codec = self._get_codec()
+        self.assertIs(codec, self._STDLIB_CODEC)
+        self.assertEqual(codec.loads, json.loads)
+
+    def test_named(self):
+        """
+        get_codec() should return the named codec if it is installed.
+        """
+        fake = self._JSONCodec('fake', None, None)
+        self.patch_loaders(fake=lambda: fake)
+        self.assertIs(self._get_codec('fake'), fake)
+
+    def test_named_missing(self):
+        """
+        get_codec() should fall back to the stdlib if the named codec is not
+        installed.
+        """
+        self.patch_loaders(missing=_missing_codec)
+        self.assertIs(self._get_codec('missing'), self._STDLIB_CODEC)
+
+    def test_named_list(self):
+        """
+        get_codec() should return the first installed codec from a list.
+        """
+        fake = self._JSONCodec('fake', None, None)
+        self.patch_loaders(fake=lambda: fake, missing=_missing_codec)
+        self.assertIs(self._get_codec(['missing', 'fake', 'json']), fake)
+
+    def test_named_unknown(self):
+        """
+        get_codec() should raise ValueError for an unknown codec name.
+        """
+        self.assertRaises(ValueError, self._get_codec, 'unknown')
+
+    def test_fastest(self):
+        """
+        get_codec('fastest') should return the first installed codec from
+        the preference list.
+        """
+        from txtwitter import codec
+        fake = self._JSONCodec('fake', None, None)
+        self.patch_loaders(fake=lambda: fake, missing=_missing_codec)
+        self.patch(codec, 'FASTEST_CODECS', ['missing', 'fake', 'json'])
+        self.assertIs(self._get_codec('fastest'), fake)
+
+    def test_codec_object(self):
+        """
+        get_codec() should return codec objects unmodified.
+        """
+        fake = self._JSONCodec('fake', None, None)
+        self.assertIs(self._get_codec(fake), fake)
+
+    def test_available_codecs(self):
+        """
+        available_codecs() should list the installed codecs.
+        """
+        from txtwitter.codec import available_codecs
+        self.patch_loaders(missing=_missing_codec)
+        codecs = available_codecs()
+        self.assertIn('json', codecs)
+        self.assertNotIn('missing', codecs)
+
+    def test_installed_codecs_roundtrip(self):
+        """
+        All installed codecs should decode the same data.
+        """
+        from txtwitter.codec import available_codecs
+        data = {"id_str": "1", "text": u"\u2603", "user": {"id": 1}}
+        for name in available_codecs():
+            codec = self._get_codec(name)
+            self.assertEqual(codec.name, name)
+            self.assertEqual(codec.loads(codec.dumps(data)), data)
@@ -0,0 +1,153 @@
+import zlib
+
+from twisted.internet.defer import succeed
+from twisted.trial.unittest import TestCase
+from twisted.web.client import ResponseFailed, readBody
+from twisted.web.http_headers import Headers
+
+from txtwitter.tests.fake_agent import FakeResponse
+
+
+def from_compression(name):
+    @property
+    def prop(self):
+        from txtwitter import compression
+        return getattr(compression, name)
+    return prop
+
+
+def gzip_data(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class RecordingAgent(object):
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        self.requests.append((method, uri, headers))
+        return succeed(self.response)
+
+
+def gzip_response(body):
+    return FakeResponse(gzip_data(body), headers=Headers({
+        'content-encoding': ['gzip'],
+        'content-length': [str(len(body))],
+    }))
+
+
+class TestCompressionStats(TestCase):
+    _CompressionStats = from_compression('CompressionStats')
+
+    def test_stats(self):
+        """
+        get_stats() reports the counters and the compression ratio.
+        """
+        stats = self._CompressionStats()
+        self.assertEqual(stats.get_stats(), {
+            'responses': 0,
+            'compressed_responses': 0,
+            'wire_bytes': 0,
+            'decoded_bytes': 0,
+            'ratio': None,
+        })
+        stats.wire_bytes = 25
+        stats.decoded_bytes = 100
+        self.assertEqual(stats.ratio(), 0.25)
+
+
+class TestCompressedAgent(TestCase):
+    _CompressedAgent = from_compression('CompressedAgent')
+    _CompressionStats = from_compression('CompressionStats')
+
+    def test_accept_encoding(self):
+        """
+        Requests ask for gzip encoding without modifying the caller's
+        headers.
+        """
+        agent = RecordingAgent(FakeResponse(''))
+        headers = Headers({'x-foo': ['bar']})
+        self._CompressedAgent(agent).request('GET', 'http://a/', headers)
+        [(_, _, sent_headers)] = agent.requests
+        self.assertEqual(
+            sent_headers.getRawHeaders('accept-encoding'), ['gzip'])
+        self.assertEqual(sent_headers.getRawHeaders('x-foo'), ['bar'])
+        self.assertEqual(headers.getRawHeaders('accept-encoding'), None)
+
+    def test_gzip_response(self):
+        """
+        gzip encoded responses are inflated and counted.
+        """
+        body = '{"text": "%s"}' % ('hello ' * 100,)
+        agent = self._CompressedAgent(RecordingAgent(gzip_response(body)))
+        response = self.successResultOf(agent.request('GET', 'http://a/'))
+        self.assertEqual(
+            response.headers.getRawHeaders('content-encoding'), None)
+        self.assertEqual(
+            response.headers.getRawHeaders('content-length'), None)
+        self.assertEqual(self.successResultOf(readBody(response)), body)
+
+        stats = agent.stats
+        self.assertEqual(stats.responses, 1)
+        self.assertEqual(stats.compressed_responses, 1)
+        self.assertEqual(stats.wire_bytes, len(gzip_data(body)))
+        self.assertEqual(stats.decoded_bytes, len(body))
+        self.assertTrue(stats.ratio() < 0.1)
+
+    def test_gzip_response_in_pieces(self):
+        """
+        A gzip encoded body is inflated incrementally as it arrives.
+        """
+        body = '[%s]' % (', '.join(['{"id": %s}' % i for i in range(500)]),)
+        compressed = gzip_data(body)
+        response = FakeResponse(None, headers=Headers({
+            'content-encoding': ['gzip']}))
+        agent = self._CompressedAgent(RecordingAgent(response))
+        decoded = self.successResultOf(agent.request('GET', 'http://a/'))
+        d = readBody(decoded)
+        for i in range(0, len(compressed), 7):
+            response.deliver_data(compressed[i:i + 7])
+        response.finished()
+        self.assertEqual(self.successResultOf(d), body)
+        self.assertEqual(agent.stats.wire_bytes, len(compressed))
+
+    def test_identity_response(self):
+        """
+        Responses that aren't compressed are delivered unchanged, and
+        counted.
+        """
+        agent = self._CompressedAgent(RecordingAgent(FakeResponse('hello')))
+        response = self.successResultOf(agent.request('GET', 'http://a/'))
+        self.assertEqual(self.successResultOf(readBody(response)), 'hello')
+        self.assertEqual(agent.stats.get_stats(), {
+            'responses': 1,
+            'compressed_responses': 0,
+            'wire_bytes': 5,
+            'decoded_bytes': 5,
+            'ratio': 1.0,
+        })
+
+    def test_corrupt_response(self):
+        """
+        A corrupt gzip body fails the response.
+        """
+        response = FakeResponse('not gzip', headers=Headers({
+            'content-encoding': ['gzip']}))
+        agent = self._CompressedAgent(RecordingAgent(response))
+        decoded = self.successResultOf(agent.request('GET', 'http://a/'))
+        self.failureResultOf(readBody(decoded), ResponseFailed)
+
+    def test_shared_stats(self):
+        """
+        Several agents can share one set of counters.
+        """
+        stats = self._CompressionStats()
+        for _ in range(2):
+            agent = self._CompressedAgent(
+                RecordingAgent(FakeResponse('hi')), stats)
+            response = self.successResultOf(agent.request('GET', 'http://a/'))
+            self.successResultOf(readBody(response))
+        self.assertEqual(stats.responses, 2)
+        self.assertEqual(stats.decoded_bytes, 4)
@@ -0,0 +1,171 @@
+from twisted.internet.defer import CancelledError, inlineCallbacks
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import Clock
+from twisted.python.threadpool import ThreadPool
+from twisted.trial.unittest import TestCase
+
+
+def from_decoding(name):
+    @property
+    def prop(self):
+        from txtwitter import decoding
+        return getattr(decoding, name)
+    return prop
+
+
+class FakeThreadPool(object):
+    def callInThreadWithCallback(self, onResult, f, *args, **kw):
+        onResult(True, f(*args, **kw))
+
+
+class FakeReactor(Clock):
+    def callFromThread(self, f, *args, **kw):
+        f(*args, **kw)
+
+    def getThreadPool(self):
+        return FakeThreadPool()
+
+
+class FakePool(object):
+    """
+    A process pool that never finishes its jobs, as if its workers had died.
+    """
+
+    def __init__(self):
+        self.callbacks = []
+        self.calls = []
+
+    def apply_async(self, func, args, callback):
+        self.callbacks.append(callback)
+
+    def terminate(self):
+        self.calls.append('terminate')
+
+    def join(self):
+        self.calls.append('join')
+
+
+LINES = ['{"id_str": "%s"}' % (i,) for i in range(10)]
+MESSAGES = [{"id_str": str(i)} for i in range(10)]
+
+
+class TestDecodeLines(TestCase):
+    _decode_lines = from_decoding('decode_lines')
+
+    def test_decode_lines(self):
+        """
+        decode_lines() decodes each line with the given function.
+        """
+        self.assertEqual(self._decode_lines(len, ['a', 'bb']), [1, 2])
+
+
+class TestThreadPoolDecoder(TestCase):
+    _ThreadPoolDecoder = from_decoding('ThreadPoolDecoder')
+
+    def _decoder(self, **kw):
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self.addCleanup(pool.stop)
+        return self._ThreadPoolDecoder(threadpool=pool, **kw)
+
+    @inlineCallbacks
+    def test_decode(self):
+        """
+        Messages are decoded in the thread pool.
+        """
+        messages = yield self._decoder().decode(LINES)
+        self.assertEqual(messages, MESSAGES)
+
+    @inlineCallbacks
+    def test_decode_error(self):
+        """
+        A decoding error fails the Deferred.
+        """
+        d = self._decoder().decode(['{"a": '])
+        yield self.assertFailure(d, ValueError)
+
+    def test_codec(self):
+        """
+        The codec is looked up with get_codec().
+        """
+        from txtwitter.codec import STDLIB_CODEC
+        self.assertIs(self._decoder().codec, STDLIB_CODEC)
+        self.assertEqual(
+            self._decoder(batch_size=10, max_pending=2).batch_size, 10)
+
+
+class TestProcessPoolDecoder(TestCase):
+    _ProcessPoolDecoder = from_decoding('ProcessPoolDecoder')
+
+    def _decoder(self):
+        decoder = self._ProcessPoolDecoder(processes=1)
+        self.addCleanup(decoder.close)
+        return decoder
+
+    @inlineCallbacks
+    def test_decode(self):
+        """
+        Messages are decoded in a worker process.
+        """
+        messages = yield self._decoder().decode(LINES)
+        self.assertEqual(messages, MESSAGES)
+
+    @inlineCallbacks
+    def test_decode_error(self):
+        """
+        A decoding error in a worker process fails the Deferred.
+        """
+        d = self._decoder().decode(['{"a": '])
+        yield self.assertFailure(d, ValueError)
+
+    def test_timeout(self):
+        """
+        A batch that is never decoded, because its worker died, fails with
+        ``TimeoutError``.
+        """
+        reactor = FakeReactor()
+        decoder = self._ProcessPoolDecoder(timeout=10, reactor=reactor)
+        decoder._pool = pool = FakePool()
+        d = decoder.decode(LINES)
+        reactor.advance(9)
+        self.assertNoResult(d)
+        reactor.advance(1)
+        self.failureResultOf(d, TimeoutError)
+        # A result that turns up after all is ignored.
+        [callback] = pool.callbacks
+        callback((True, MESSAGES))
+
+    def test_close(self):
+        """
+        Closing a decoder cancels the batches still being decoded, drops
+        their results if they arrive, and terminates the pool in a thread.
+        """
+        reactor = FakeReactor()
+        decoder = self._ProcessPoolDecoder(reactor=reactor)
+        decoder._pool = pool = FakePool()
+        d = decoder.decode(LINES)
+        closed = decoder.close()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.successResultOf(closed), None)
+        self.assertEqual(pool.calls, ['terminate', 'join'])
+        self.assertEqual(decoder._pool, None)
+        [callback] = pool.callbacks
+        callback((True, MESSAGES))
+
+    @inlineCallbacks
+    def test_close_pending(self):
+        """
+        Closing a decoder with a batch outstanding doesn't wait for the batch.
+        """
+        decoder = self._ProcessPoolDecoder(processes=1)
+        d = decoder.decode(LINES)
+        yield decoder.close()
+        self.failureResultOf(d, CancelledError)
+
+    def test_close_unused(self):
+        """
+        Closing a decoder that has not been used does nothing.
+        """
+        decoder = self._ProcessPoolDecoder()
+        self.successResultOf(decoder.close())
+        self.assertEqual(decoder._pool, None)
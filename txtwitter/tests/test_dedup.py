@@ -0,0 +1,223 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txtwitter.tests.fake_messages import dm, tweet
+
+
+def from_dedup(name):
+    @property
+    def prop(self):
+        from txtwitter import dedup
+        return getattr(dedup, name)
+    return prop
+
+
+BASE_ID = 500000000000000000
+
+
+class TestRecentIDs(TestCase):
+    _RecentIDs = from_dedup('RecentIDs')
+
+    def test_add(self):
+        """
+        Adding an ID reports whether it was new.
+        """
+        ids = self._RecentIDs(10)
+        self.assertEqual(ids.add(BASE_ID), True)
+        self.assertEqual(ids.add(BASE_ID + 1), True)
+        self.assertEqual(ids.add(BASE_ID), False)
+        self.assertEqual(len(ids), 2)
+        self.assertTrue(BASE_ID + 1 in ids)
+        self.assertFalse(BASE_ID + 2 in ids)
+
+    def test_max_size(self):
+        """
+        Only the most recent ``max_size`` IDs are remembered.
+        """
+        ids = self._RecentIDs(3)
+        for i in range(5):
+            ids.add(BASE_ID + i)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(
+            [BASE_ID + i in ids for i in range(5)],
+            [False, False, True, True, True])
+        # Repeats don't count as additions.
+        self.assertEqual(ids.add(BASE_ID + 2), False)
+        self.assertEqual(ids.add(BASE_ID), True)
+        self.assertEqual(
+            [BASE_ID + i in ids for i in range(5)],
+            [True, False, False, True, True])
+
+    def test_max_age(self):
+        """
+        IDs are forgotten ``max_age`` seconds after they are added.
+        """
+        clock = Clock()
+        ids = self._RecentIDs(10, max_age=60, clock=clock)
+        ids.add(BASE_ID)
+        clock.advance(30)
+        ids.add(BASE_ID + 1)
+        clock.advance(29)
+        self.assertEqual(len(ids), 2)
+        clock.advance(1)
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(ids.add(BASE_ID), True)
+        self.assertEqual(ids.add(BASE_ID + 1), False)
+        clock.advance(30)
+        self.assertFalse(BASE_ID + 1 in ids)
+        self.assertTrue(BASE_ID in ids)
+
+    def test_memory_size(self):
+        """
+        The memory used grows with the number of IDs remembered, up to the
+        maximum size.
+        """
+        ids = self._RecentIDs(100)
+        empty = ids.memory_size()
+        for i in range(100):
+            ids.add(BASE_ID + i)
+        full = ids.memory_size()
+        self.assertTrue(full > empty)
+        for i in range(100, 1000):
+            ids.add(BASE_ID + i)
+        self.assertTrue(ids.memory_size() <= full * 1.5)
+
+
+class TestBloomIDs(TestCase):
+    _BloomIDs = from_dedup('BloomIDs')
+
+    def test_sizing(self):
+        """
+        The filters are sized for the capacity and error rate.
+        """
+        ids = self._BloomIDs(1000, error_rate=0.01)
+        self.assertEqual(ids.num_bits, 9586)
+        self.assertEqual(ids.num_hashes, 7)
+        self.assertEqual(ids.memory_size(), 2 * 1199)
+
+    def test_invalid_error_rate(self):
+        self.assertRaises(ValueError, self._BloomIDs, 1000, error_rate=0)
+        self.assertRaises(ValueError, self._BloomIDs, 1000, error_rate=1)
+
+    def test_add(self):
+        """
+        Adding an ID reports whether it was new.
+        """
+        ids = self._BloomIDs(100)
+        self.assertEqual(ids.add(BASE_ID), True)
+        self.assertEqual(ids.add(BASE_ID + 1), True)
+        self.assertEqual(ids.add(BASE_ID), False)
+        self.assertTrue(BASE_ID + 1 in ids)
+        self.assertFalse(BASE_ID + 2 in ids)
+
+    def test_capacity(self):
+        """
+        At least the last ``capacity`` IDs are remembered, and IDs from more
+        than two generations ago are forgotten.
+        """
+        ids = self._BloomIDs(100)
+        for i in range(250):
+            ids.add(BASE_ID + i)
+        self.assertTrue(all(BASE_ID + i in ids for i in range(150, 250)))
+        self.assertFalse(any(BASE_ID + i in ids for i in range(100)))
+
+    def test_max_age(self):
+        """
+        The filters are rotated when the current one is ``max_age`` seconds
+        old.
+        """
+        clock = Clock()
+        ids = self._BloomIDs(100, max_age=60, clock=clock)
+        ids.add(BASE_ID)
+        clock.advance(60)
+        self.assertTrue(BASE_ID in ids)
+        ids.add(BASE_ID + 1)
+        clock.advance(60)
+        self.assertFalse(BASE_ID in ids)
+        self.assertTrue(BASE_ID + 1 in ids)
+
+    def test_false_positive_rate(self):
+        """
+        The false-positive rate is close to the error rate.
+        """
+        ids = self._BloomIDs(1000, error_rate=0.01)
+        for i in range(1000):
+            ids.add(BASE_ID + i * 4096)
+        false_positives = sum(
+            1 for i in range(10000) if BASE_ID + 1 + i * 4096 in ids)
+        self.assertTrue(false_positives < 300, false_positives)
+
+
+class TestDeduplicator(TestCase):
+    _Deduplicator = from_dedup('Deduplicator')
+    _RecentIDs = from_dedup('RecentIDs')
+
+    def test_drops_duplicates(self):
+        """
+        Repeated tweets and DMs are dropped, and other messages are passed
+        through.
+        """
+        delivered = []
+        dedup = self._Deduplicator(delivered.append)
+        messages = [
+            tweet('1'), tweet('2'), tweet('1'), {'direct_message': dm('1')},
+            {'friends_str': []}, {'friends_str': []}, dm('1'),
+        ]
+        for message in messages:
+            dedup(message)
+        # The DM has the same ID as a tweet, but isn't a repeat of it.
+        self.assertEqual(delivered, [
+            tweet('1'), tweet('2'), {'direct_message': dm('1')},
+            {'friends_str': []}, {'friends_str': []}])
+        self.assertEqual(dedup.get_stats(), {
+            'delivered': 5,
+            'duplicates': 2,
+        })
+
+    def test_seen(self):
+        """
+        The given ID store is used.
+        """
+        seen = self._RecentIDs(1)
+        delivered = []
+        dedup = self._Deduplicator(delivered.append, seen)
+        for id_str in ['1', '2', '1']:
+            dedup(tweet(id_str))
+        self.assertEqual(len(delivered), 3)
+        self.assertTrue(1 in seen)
+        self.assertFalse(2 in seen)
+
+    def test_batches(self):
+        """
+        Batches are filtered, and empty batches are dropped.
+        """
+        delivered = []
+        dedup = self._Deduplicator(delivered.append)
+        dedup([tweet('1'), tweet('2')])
+        dedup([tweet('2'), tweet('3')])
+        dedup([tweet('1')])
+        self.assertEqual(
+            delivered, [[tweet('1'), tweet('2')], [tweet('3')]])
+
+    def test_return_value(self):
+        """
+        The delegate's return value is returned.
+        """
+        d = Deferred()
+        dedup = self._Deduplicator(lambda message: d)
+        self.assertIdentical(dedup(tweet('1')), d)
+        self.assertEqual(dedup(tweet('1')), None)
+
+    def test_envelopes(self):
+        """
+        Envelopes are de-duplicated without being decoded.
+        """
+        import json
+        from txtwitter.envelope import MessageEnvelope
+        delivered = []
+        dedup = self._Deduplicator(delivered.append)
+        for id_str in ['1', '2', '1']:
+            dedup(MessageEnvelope(json.dumps(tweet(id_str))))
+        self.assertEqual([env.id_str for env in delivered], ['1', '2'])
+        self.assertEqual([env.decoded for env in delivered], [False, False])
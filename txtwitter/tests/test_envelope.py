@@ -0,0 +1,151 @@
+import json
+
+from twisted.trial.unittest import TestCase
+
+
+def from_envelope(name):
+    @property
+    def prop(self):
+        from txtwitter import envelope
+        return getattr(envelope, name)
+    return prop
+
+
+TWEET = {
+    'created_at': 'Mon Sep 24 03:35:21 +0000 2012',
+    'id_str': '1',
+    'text': 'Tweet!',
+    'user': {'id_str': '2', 'screen_name': 'fakeuser'},
+}
+DM = {
+    'id_str': '1',
+    'text': 'DM!',
+    'sender': {'id_str': '2'},
+    'recipient': {'id_str': '3'},
+}
+
+
+class TestClassify(TestCase):
+    _classify = from_envelope('classify')
+
+    def test_wrappers(self):
+        """
+        Single-key wrapper messages are classified by their key.
+        """
+        for kind in ['delete', 'limit', 'scrub_geo', 'direct_message']:
+            raw = json.dumps({kind: {'track': 1}})
+            self.assertEqual(self._classify(raw), kind)
+        self.assertEqual(
+            self._classify(' { "friends_str" : []}'), 'friends_str')
+
+    def test_tweet(self):
+        """
+        Messages with the keys of a tweet are classified as tweets.
+        """
+        self.assertEqual(self._classify(json.dumps(TWEET)), 'tweet')
+        self.assertEqual(
+            self._classify(json.dumps(TWEET, separators=(',', ':'))),
+            'tweet')
+
+    def test_dm(self):
+        """
+        Messages with the keys of a direct message are classified as DMs.
+        """
+        self.assertEqual(self._classify(json.dumps(DM)), 'dm')
+
+    def test_event(self):
+        """
+        Events are classified as events, even if they contain a tweet.
+        """
+        raw = json.dumps({
+            'target_object': TWEET, 'event': 'favorite', 'source': {}})
+        self.assertEqual(self._classify(raw), 'event')
+
+    def test_unknown(self):
+        """
+        Keys inside string values are not mistaken for real keys.
+        """
+        raw = json.dumps({'foo': '"id_str": "text": "user":'})
+        self.assertEqual(self._classify(raw), 'unknown')
+
+
+class TestMessageEnvelope(TestCase):
+    _MessageEnvelope = from_envelope('MessageEnvelope')
+
+    def test_kind_without_decoding(self):
+        """
+        An envelope's kind is available without decoding it.
+        """
+        env = self._MessageEnvelope('{"delete": {"status": {}}}')
+        self.assertEqual(env.kind, 'delete')
+        self.assertEqual(env.is_notice, True)
+        self.assertEqual(env.decoded, False)
+
+    def test_lazy_decoding(self):
+        """
+        The message is decoded once, when its contents are first accessed.
+        """
+        decoded = []
+
+        def loads(raw):
+            decoded.append(raw)
+            return json.loads(raw)
+        from txtwitter.codec import JSONCodec
+        raw = json.dumps(TWEET)
+        env = self._MessageEnvelope(raw, JSONCodec('fake', loads, None))
+        self.assertEqual(env.is_notice, False)
+        self.assertEqual(decoded, [])
+        self.assertEqual(env['text'], 'Tweet!')
+        self.assertEqual(env.get('user'), TWEET['user'])
+        self.assertEqual(env.message, TWEET)
+        self.assertEqual(decoded, [raw])
+
+    def test_id_str(self):
+        """
+        The ID of a tweet or direct message (wrapped or not) is read without
+        decoding the message, and IDs in nested objects are ignored.
+        """
+        raws = [
+            json.dumps(TWEET),
+            json.dumps(DM),
+            json.dumps({'direct_message': DM}),
+            ('{"user": {"id_str": "2"}, "text": "{\\"id_str\\": \\"3\\"}",'
+             ' "entities": [{"id_str": "4"}], "id_str": "1"}'),
+        ]
+        for raw in raws:
+            env = self._MessageEnvelope(raw)
+            self.assertEqual(env.id_str, '1')
+            self.assertEqual(env.decoded, False)
+
+    def test_id_str_none(self):
+        """
+        Messages of other kinds, and tweets without a string ID, have no ID.
+        """
+        raws = [
+            '{"delete": {"status": {"id_str": "1"}}}',
+            json.dumps({'event': 'follow', 'target_object': TWEET}),
+            '{"id_str": null, "text": "", "user": {"id_str": "2"}}',
+        ]
+        for raw in raws:
+            self.assertEqual(self._MessageEnvelope(raw).id_str, None)
+
+    def test_id_str_decoded(self):
+        """
+        The ID of a message that has already been decoded is taken from the
+        decoded message.
+        """
+        env = self._MessageEnvelope(json.dumps({'direct_message': DM}))
+        env.message
+        self.assertEqual(env.id_str, '1')
+
+    def test_dict_interface(self):
+        """
+        Envelopes support the read-only parts of the dict interface.
+        """
+        env = self._MessageEnvelope(json.dumps(DM))
+        self.assertEqual(sorted(env.keys()), sorted(DM.keys()))
+        self.assertEqual(sorted(env), sorted(DM))
+        self.assertEqual(len(env), 4)
+        self.assertTrue('sender' in env)
+        self.assertEqual(env.get('missing', 'x'), 'x')
+        self.assertEqual(dict(env.items()), DM)
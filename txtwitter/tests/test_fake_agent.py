@@ -60,6 +60,37 @@ class TestFakeAgent(TestCase):
             }), FileBodyProducer(StringIO('multipart_body')))
         self.assertEqual(resp, fake_resp)
 
+    @inlineCallbacks
+    def test_persistent_connection_reused(self):
+        agent = self._FakeAgent(persistent=True)
+        agent.add_expected_request(
+            'GET', 'http://a/foo', {}, self._FakeResponse('foo'))
+        agent.add_expected_request(
+            'GET', 'http://a/bar', {}, self._FakeResponse('bar'))
+        resp = yield agent.request('GET', 'http://a/foo')
+        self.assertEqual(agent.idle_connections(), 0)
+        yield readBody(resp)
+        self.assertEqual(agent.idle_connections(('http', 'a')), 1)
+        resp = yield agent.request('GET', 'http://a/bar')
+        yield readBody(resp)
+        self.assertEqual(agent.connections_opened, 1)
+        self.assertEqual(agent.connections_reused, 1)
+
+    @inlineCallbacks
+    def test_persistent_connection_busy(self):
+        agent = self._FakeAgent(persistent=True)
+        agent.add_expected_request(
+            'GET', 'http://a/foo', {}, self._FakeResponse('foo'))
+        agent.add_expected_request(
+            'GET', 'http://a/bar', {}, self._FakeResponse('bar'))
+        resp1 = yield agent.request('GET', 'http://a/foo')
+        resp2 = yield agent.request('GET', 'http://a/bar')
+        yield readBody(resp1)
+        yield readBody(resp2)
+        self.assertEqual(agent.connections_opened, 2)
+        self.assertEqual(agent.connections_reused, 0)
+        self.assertEqual(agent.idle_connections(), 2)
+
     def test_response_static(self):
         resp = self._FakeResponse('foo', 400)
         body = self.successResultOf(readBody(resp))
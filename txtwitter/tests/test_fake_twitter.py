@@ -3,9 +3,12 @@ from datetime import datetime
 from urllib import urlencode
 
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 from twisted.protocols.basic import LineOnlyReceiver
 from twisted.trial.unittest import TestCase
 
+from txtwitter.error import RateLimitedError
+
 
 def from_fake_twitter(name):
     @property
@@ -122,6 +125,15 @@ class TestFakeStream(TestCase):
             {'baz': 'qux'}
         ])
 
+    def test_deliver_length_delimited(self):
+        stream = self._FakeStream(delimited='length')
+        data = []
+        stream.resp.deliver_data = data.append
+
+        stream.deliver({'foo': 'bar'})
+
+        self.assertEqual(''.join(data), '16\r\n{"foo": "bar"}\r\n')
+
 
 class TestFakeTweet(TestCase):
     _FakeTwitterData = from_fake_twitter('FakeTwitterData')
@@ -692,6 +704,7 @@ class TestFakeTwitter(TestCase):
 class TestFakeTwitterClient(TestCase):
     _FakeTwitter = from_fake_twitter('FakeTwitter')
     _FakeImage = from_fake_twitter('FakeImage')
+    _FakeMediaFile = from_fake_twitter('FakeMediaFile')
 
     def _FakeTwitterClient(self, user_id_str=None, fake_twitter=None):
         if fake_twitter is None:
@@ -703,6 +716,66 @@ class TestFakeTwitterClient(TestCase):
         failure = self.failureResultOf(client.statuses_show('1'))
         self.assertEqual(failure.value.args[0], 404)
 
+    def test_rate_limit_headers(self):
+        """
+        Calls to rate limited endpoints are counted per user, and the rate
+        limit headers are recorded by the client.
+        """
+        clock = Clock()
+        twitter = self._FakeTwitter(clock=clock)
+        twitter.rate_limits['statuses/show.json'] = 2
+        twitter.add_user('1', 'fakeuser', 'Fake User')
+        twitter.add_tweet('1', 'hello', '1')
+        client = self._FakeTwitterClient('1', fake_twitter=twitter)
+        other_client = self._FakeTwitterClient('2', fake_twitter=twitter)
+
+        self.successResultOf(client.statuses_show('1'))
+        rate_limit = client.rate_limit('statuses/show.json')
+        self.assertEqual(rate_limit.limit, 2)
+        self.assertEqual(rate_limit.remaining, 1)
+        self.assertEqual(rate_limit.reset, 900)
+        self.assertEqual(client.time_until_allowed('statuses/show.json'), 0)
+
+        self.successResultOf(client.statuses_show('1'))
+        self.assertEqual(client.rate_limit('statuses/show.json').remaining, 0)
+        self.assertEqual(client.time_until_allowed('statuses/show.json'), 900)
+
+        self.successResultOf(other_client.statuses_show('1'))
+        self.assertEqual(
+            other_client.rate_limit('statuses/show.json').remaining, 1)
+
+    def test_rate_limit_exceeded(self):
+        """
+        Calls beyond the rate limit fail with a 429 until the window resets.
+        """
+        clock = Clock()
+        twitter = self._FakeTwitter(clock=clock)
+        twitter.rate_limits['statuses/show.json'] = 1
+        twitter.add_user('1', 'fakeuser', 'Fake User')
+        twitter.add_tweet('1', 'hello', '1')
+        client = self._FakeTwitterClient('1', fake_twitter=twitter)
+
+        self.successResultOf(client.statuses_show('1'))
+        failure = self.failureResultOf(
+            client.statuses_show('1'), RateLimitedError)
+        self.assertEqual(failure.value.status, '429')
+
+        clock.advance(900)
+        self.assertEqual(client.time_until_allowed('statuses/show.json'), 0)
+        self.successResultOf(client.statuses_show('1'))
+        self.assertEqual(client.rate_limit('statuses/show.json').reset, 1800)
+
+    def test_no_rate_limit_headers(self):
+        """
+        Endpoints without a configured rate limit don't emit any headers.
+        """
+        twitter = self._FakeTwitter()
+        twitter.add_user('1', 'fakeuser', 'Fake User')
+        twitter.add_tweet('1', 'hello', '1')
+        client = self._FakeTwitterClient('1', fake_twitter=twitter)
+        self.successResultOf(client.statuses_show('1'))
+        self.assertEqual(client.rate_limit('statuses/show.json'), None)
+
     def test_call_statuses_show(self):
         twitter = self._FakeTwitter()
         twitter.add_user('1', 'fakeuser', 'Fake User')
@@ -711,6 +784,19 @@ class TestFakeTwitterClient(TestCase):
         tweet = self.successResultOf(client.statuses_show('1'))
         self.assertEqual(tweet['text'], 'hello')
 
+    def test_call_statuses_user_timeline_delegate(self):
+        twitter = self._FakeTwitter()
+        twitter.add_user('1', 'fakeuser', 'Fake User')
+        twitter.add_tweet('1', 'hello', '1')
+        twitter.add_tweet('2', 'goodbye', '1')
+        client = self._FakeTwitterClient(fake_twitter=twitter)
+        tweets = []
+        count = self.successResultOf(
+            client.statuses_user_timeline(user_id='1', delegate=tweets.append))
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            [tweet['text'] for tweet in tweets], ['goodbye', 'hello'])
+
     @inlineCallbacks
     def test_upload_media(self):
         client = self._FakeTwitterClient()
@@ -727,6 +813,57 @@ class TestFakeTwitterClient(TestCase):
             'size': 1,
         })
 
+    def test_media_upload_chunked(self):
+        twitter = self._FakeTwitter()
+        client = self._FakeTwitterClient(fake_twitter=twitter)
+        content = ''.join(chr(i % 256) for i in xrange(1000))
+        progress = []
+        media = self.successResultOf(client.media_upload_chunked(
+            self._FakeMediaFile('video.mp4', content), 'video/mp4',
+            segment_size=300, progress_callback=(
+                lambda sent, total: progress.append((sent, total)))))
+        self.assertEqual(media['media_id_str'], '1000')
+        self.assertEqual(media['size'], 1000)
+        self.assertEqual(twitter.get_media('1000').file_content, content)
+        self.assertEqual(progress, [
+            (300, 1000), (600, 1000), (900, 1000), (1000, 1000)])
+        self.assertEqual(twitter.chunked_uploads, {})
+
+    def test_media_upload_chunked_retry(self):
+        clock = Clock()
+        twitter = self._FakeTwitter(clock=clock)
+        twitter.append_failures[1] = 2
+        client = self._FakeTwitterClient(fake_twitter=twitter)
+        content = 'x' * 100 + 'y' * 100 + 'z' * 50
+        d = client.media_upload_chunked(
+            self._FakeMediaFile('video.mp4', content), 'video/mp4',
+            segment_size=100, max_retries=2)
+        clock.pump([60, 60])
+        media = self.successResultOf(d)
+        self.assertEqual(
+            twitter.get_media(media['media_id_str']).file_content, content)
+
+    def test_media_upload_chunked_retries_exhausted(self):
+        clock = Clock()
+        twitter = self._FakeTwitter(clock=clock)
+        twitter.append_failures[1] = 3
+        client = self._FakeTwitterClient(fake_twitter=twitter)
+        d = client.media_upload_chunked(
+            self._FakeMediaFile('video.mp4', 'x' * 250), 'video/mp4',
+            segment_size=100, max_retries=2)
+        clock.pump([60, 60])
+        failure = self.failureResultOf(d)
+        self.assertEqual(failure.value.args[0], 503)
+        self.assertEqual(twitter.media, {})
+
+    def test_media_upload_chunked_finalize_size_mismatch(self):
+        twitter = self._FakeTwitter()
+        client = self._FakeTwitterClient(fake_twitter=twitter)
+        failure = self.failureResultOf(client.media_upload_chunked(
+            self._FakeMediaFile('video.mp4', 'x' * 250), 'video/mp4',
+            total_bytes=300))
+        self.assertEqual(failure.value.args[0], 400)
+
 
 class FakeTwitterStreamProtocol(LineOnlyReceiver):
     def __init__(self, delegate):
@@ -0,0 +1,189 @@
+import json
+
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+from twisted.web.http import PotentialDataLoss
+
+from txtwitter.tests.fake_agent import FakeResponse
+
+
+class DelayedTransport(object):
+    """
+    A transport that doesn't report the connection as lost until told to,
+    like a real one.
+    """
+
+    stopped = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+def from_jsonstream(name):
+    @property
+    def prop(self):
+        from txtwitter import jsonstream
+        return getattr(jsonstream, name)
+    return prop
+
+
+class TestJSONArrayDecoder(TestCase):
+    _JSONArrayDecoder = from_jsonstream('JSONArrayDecoder')
+
+    def feed_bytewise(self, data):
+        decoder = self._JSONArrayDecoder()
+        items = []
+        for char in data:
+            items.extend(decoder.feed(char))
+        return decoder, items
+
+    def test_empty_array(self):
+        """
+        An empty array should decode to no items.
+        """
+        decoder = self._JSONArrayDecoder()
+        self.assertEqual(decoder.feed(' [ ] '), [])
+        self.assertEqual(decoder.is_array, True)
+        self.assertEqual(decoder.finished, True)
+        self.assertEqual(decoder.close(), None)
+
+    def test_single_chunk(self):
+        """
+        All elements in a single chunk should be returned together.
+        """
+        decoder = self._JSONArrayDecoder()
+        self.assertEqual(
+            decoder.feed('[1, "two", {"three": [3]}, null]'),
+            [1, "two", {"three": [3]}, None])
+        decoder.close()
+
+    def test_items_as_they_complete(self):
+        """
+        Each element should be returned as soon as it is complete.
+        """
+        decoder = self._JSONArrayDecoder()
+        self.assertEqual(decoder.feed('[{"id_str": "1"'), [])
+        self.assertEqual(decoder.feed('}, {"id_str": "2"}'), [{"id_str": "1"}])
+        self.assertEqual(decoder.feed(']'), [{"id_str": "2"}])
+        self.assertEqual(decoder.finished, True)
+
+    def test_bytewise(self):
+        """
+        Elements should be decoded correctly no matter how the data is split,
+        including structural characters and escapes inside strings.
+        """
+        data = [
+            {"text": "a [tricky], {string} \\\" with \" quotes"},
+            ["nested", ["lists"], {"and": {"dicts": []}}],
+            u"unicode \u2603",
+        ]
+        decoder, items = self.feed_bytewise(json.dumps(data))
+        self.assertEqual(items, data)
+        decoder.close()
+
+    def test_not_array(self):
+        """
+        A document that isn't an array should be decoded on close.
+        """
+        decoder, items = self.feed_bytewise('{"errors": [{"code": 34}]}')
+        self.assertEqual(items, [])
+        self.assertEqual(decoder.is_array, False)
+        self.assertEqual(decoder.close(), {"errors": [{"code": 34}]})
+
+    def test_incomplete(self):
+        """
+        Closing an incomplete array should raise ValueError.
+        """
+        decoder = self._JSONArrayDecoder()
+        decoder.feed('[1, 2')
+        self.assertRaises(ValueError, decoder.close)
+
+    def test_empty_document(self):
+        """
+        Closing without any data should raise ValueError.
+        """
+        decoder = self._JSONArrayDecoder()
+        self.assertRaises(ValueError, decoder.close)
+
+    def test_extra_data(self):
+        """
+        Data after the end of the array should raise ValueError on close.
+        """
+        decoder = self._JSONArrayDecoder()
+        decoder.feed('[1] 2')
+        self.assertRaises(ValueError, decoder.close)
+
+    def test_invalid_element(self):
+        """
+        An invalid element should raise ValueError.
+        """
+        decoder = self._JSONArrayDecoder()
+        self.assertRaises(ValueError, decoder.feed, '[1, foo, 3]')
+
+
+class TestJSONArrayProtocol(TestCase):
+    _JSONArrayProtocol = from_jsonstream('JSONArrayProtocol')
+
+    def test_deliver_items(self):
+        """
+        Items should be delivered as they arrive and the Deferred should fire
+        with the count when the body is complete.
+        """
+        items = []
+        d = Deferred()
+        resp = FakeResponse(None)
+        resp.deliverBody(self._JSONArrayProtocol(d, items.append))
+        resp.deliver_data('[{"id_str": "1"}, {"id_')
+        self.assertEqual(items, [{"id_str": "1"}])
+        resp.deliver_data('str": "2"}]')
+        self.assertEqual(items, [{"id_str": "1"}, {"id_str": "2"}])
+        self.assertNoResult(d)
+        resp.finished()
+        self.assertEqual(self.successResultOf(d), 2)
+
+    def test_deliver_non_array(self):
+        """
+        A non-array body should be delivered as a single item.
+        """
+        items = []
+        d = Deferred()
+        resp = FakeResponse('{"id_str": "1"}')
+        resp.deliverBody(self._JSONArrayProtocol(d, items.append))
+        self.assertEqual(items, [{"id_str": "1"}])
+        self.assertEqual(self.successResultOf(d), 1)
+
+    def test_invalid_body(self):
+        """
+        An invalid body should stop the download and errback the Deferred.
+        """
+        items = []
+        d = Deferred()
+        resp = FakeResponse(None)
+        resp.deliverBody(self._JSONArrayProtocol(d, items.append))
+        resp.deliver_data('[1, foo, 3')
+        self.failureResultOf(d, ValueError)
+
+    def test_truncated_body(self):
+        """
+        A truncated body should errback the Deferred.
+        """
+        d = Deferred()
+        resp = FakeResponse('[1, 2')
+        resp.deliverBody(self._JSONArrayProtocol(d, lambda item: None))
+        self.failureResultOf(d, ValueError)
+
+    def test_cancelled_before_connection_lost(self):
+        """
+        If the Deferred is cancelled, the connection being lost afterwards
+        shouldn't fire it again.
+        """
+        transport = DelayedTransport()
+        d = Deferred(lambda d: transport.stopProducing())
+        protocol = self._JSONArrayProtocol(d, lambda item: None)
+        protocol.makeConnection(transport)
+        protocol.dataReceived('[1, 2')
+        d.cancel()
+        self.assertTrue(transport.stopped)
+        self.failureResultOf(d, CancelledError)
+        protocol.connectionLost(Failure(PotentialDataLoss()))
@@ -24,6 +24,21 @@ class TestTweetFunctions(TestCase):
             'friends': [],
         }))
 
+    def test_is_tweet_envelope(self):
+        """
+        is_tweet() should accept message envelopes, and reject other kinds of
+        message without decoding them.
+        """
+        from txtwitter.envelope import MessageEnvelope
+        tweet = MessageEnvelope(
+            '{"id_str": "12345", "text": "This is a tweet.", "user": {}}')
+        self.assertEqual(True, self.messagetools.is_tweet(tweet))
+        self.assertEqual(
+            'This is a tweet.', self.messagetools.tweet_text(tweet))
+        notice = MessageEnvelope('{"delete": {"status": {"id_str": "1"}}}')
+        self.assertEqual(False, self.messagetools.is_tweet(notice))
+        self.assertEqual(False, notice.decoded)
+
     def test_ensure_tweet(self):
         """
         ensure_tweet() should return the original message for a tweet message.
@@ -273,6 +288,22 @@ class TestTweetFunctions(TestCase):
             'friends': [],
         }))
 
+    def test_is_dm_envelope(self):
+        """
+        is_dm() should accept message envelopes, and reject other kinds of
+        message without decoding them.
+        """
+        from txtwitter.envelope import MessageEnvelope
+        dm = MessageEnvelope(
+            '{"id_str": "12345", "text": "This is a DM.", "sender": {},'
+            ' "recipient": {}}')
+        self.assertEqual(True, self.messagetools.is_dm(dm))
+        self.assertEqual('This is a DM.', self.messagetools.dm_text(dm))
+        tweet = MessageEnvelope(
+            '{"id_str": "12345", "text": "This is a tweet.", "user": {}}')
+        self.assertEqual(False, self.messagetools.is_dm(tweet))
+        self.assertEqual(False, tweet.decoded)
+
     def test_ensure_dm(self):
         """
         ensure_dm() should return the original message for a dm message.
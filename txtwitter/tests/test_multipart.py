@@ -0,0 +1,177 @@
+from twisted.internet.task import Cooperator
+from twisted.trial.unittest import TestCase
+
+from txtwitter.tests.fake_twitter import FakeImage, FakeMediaFile
+
+
+def from_multipart(name):
+    @property
+    def prop(self):
+        from txtwitter import multipart
+        return getattr(multipart, name)
+    return prop
+
+
+class ListConsumer(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+EXPECTED_BODY = (
+    '--txtwitter\r\n'
+    'Content-Disposition: form-data, name=additional_owners\r\n'
+    '\r\n'
+    '1,2,\r\n'
+    '--txtwitter\r\n'
+    'Content-Disposition: form-data; name=media; filename=image\r\n'
+    'Content-Type: application/octet-stream\r\n'
+    '\r\n'
+    'raw_binary_content\r\n'
+    '--txtwitter--\r\n'
+)
+
+
+class TestMultipartBodyProducer(TestCase):
+    _MultipartBodyProducer = from_multipart('MultipartBodyProducer')
+
+    def setUp(self):
+        self._scheduled = []
+        self.cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=self._scheduled.append)
+
+    def run_cooperator(self):
+        while self._scheduled:
+            self._scheduled.pop(0)()
+
+    def make_producer(self, media, **kw):
+        return self._MultipartBodyProducer(
+            'txtwitter', {'additional_owners': '1,2,'}, 'media', media,
+            cooperator=self.cooperator, **kw)
+
+    def test_body(self):
+        """
+        The produced body should contain the params and the file.
+        """
+        producer = self.make_producer(
+            FakeMediaFile('image', 'raw_binary_content'))
+        consumer = ListConsumer()
+        d = producer.startProducing(consumer)
+        self.run_cooperator()
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+        self.assertEqual(producer.length, len(EXPECTED_BODY))
+
+    def test_length_known_before_reading(self):
+        """
+        The length should be known without reading a seekable file.
+        """
+        media = FakeMediaFile('image', 'raw_binary_content')
+        producer = self.make_producer(media)
+        self.assertEqual(producer.length, len(EXPECTED_BODY))
+        self.assertEqual(media.tell(), 0)
+
+    def test_chunked(self):
+        """
+        The file should be written in chunks no larger than the chunk size.
+        """
+        producer = self.make_producer(
+            FakeMediaFile('image', 'raw_binary_content'), chunk_size=4)
+        consumer = ListConsumer()
+        producer.startProducing(consumer)
+        self.run_cooperator()
+        self.assertEqual(consumer.writes[1:-1], [
+            'raw_', 'bina', 'ry_c', 'onte', 'nt'])
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+
+    def test_current_position(self):
+        """
+        The file should be read from its current position.
+        """
+        media = FakeMediaFile('image', 'skipped:raw_binary_content')
+        media.seek(len('skipped:'))
+        producer = self.make_producer(media)
+        consumer = ListConsumer()
+        producer.startProducing(consumer)
+        self.run_cooperator()
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+        self.assertEqual(producer.length, len(EXPECTED_BODY))
+
+    def test_unseekable(self):
+        """
+        A file without seek() and tell() should be read up front.
+        """
+        producer = self.make_producer(FakeImage('image', 'raw_binary_content'))
+        self.assertEqual(producer.length, len(EXPECTED_BODY))
+        consumer = ListConsumer()
+        producer.startProducing(consumer)
+        self.run_cooperator()
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+
+    def test_seek_fails(self):
+        """
+        A file whose seek() and tell() raise IOError should be read up front.
+        """
+        class PipeFile(FakeMediaFile):
+            def seek(self, *args):
+                raise IOError(29, 'Illegal seek')
+
+            def tell(self):
+                raise IOError(29, 'Illegal seek')
+
+        producer = self.make_producer(PipeFile('image', 'raw_binary_content'))
+        self.assertEqual(producer.length, len(EXPECTED_BODY))
+        consumer = ListConsumer()
+        producer.startProducing(consumer)
+        self.run_cooperator()
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+
+    def test_pause_resume(self):
+        """
+        A paused producer should not write until it is resumed.
+        """
+        producer = self.make_producer(
+            FakeMediaFile('image', 'raw_binary_content'), chunk_size=4)
+        consumer = ListConsumer()
+        d = producer.startProducing(consumer)
+        self._scheduled.pop(0)()
+        self.assertEqual(len(consumer.writes), 1)
+        producer.pauseProducing()
+        self.run_cooperator()
+        self.assertEqual(len(consumer.writes), 1)
+        producer.resumeProducing()
+        self.run_cooperator()
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
+        self.successResultOf(d)
+
+    def test_stop(self):
+        """
+        A stopped producer should not write any more and its Deferred should
+        not fire.
+        """
+        producer = self.make_producer(
+            FakeMediaFile('image', 'raw_binary_content'), chunk_size=4)
+        consumer = ListConsumer()
+        d = producer.startProducing(consumer)
+        self._scheduled.pop(0)()
+        producer.stopProducing()
+        self.run_cooperator()
+        self.assertEqual(len(consumer.writes), 1)
+        self.assertNoResult(d)
+
+    def test_stop_after_finished(self):
+        """
+        Stopping a producer that has already finished should do nothing.
+        """
+        producer = self.make_producer(
+            FakeMediaFile('image', 'raw_binary_content'))
+        consumer = ListConsumer()
+        d = producer.startProducing(consumer)
+        self.run_cooperator()
+        self.successResultOf(d)
+        producer.stopProducing()
+        producer.stopProducing()
+        self.assertEqual(''.join(consumer.writes), EXPECTED_BODY)
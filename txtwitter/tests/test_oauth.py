@@ -0,0 +1,108 @@
+from urllib import urlencode
+
+from oauthlib import oauth1
+from twisted.trial.unittest import TestCase
+
+
+def from_oauth(name):
+    @property
+    def prop(self):
+        from txtwitter import oauth
+        return getattr(oauth, name)
+    return prop
+
+
+CREDS = ('consumer-key', 'consumer secret~+', 'token-key', 'token-secret')
+
+
+class TestOAuthSigner(TestCase):
+    _OAuthSigner = from_oauth('OAuthSigner')
+    _base_string_uri = from_oauth('base_string_uri')
+
+    def assert_matches_oauthlib(self, uri, method, body=None, headers=None,
+                                creds=CREDS):
+        consumer_key, consumer_secret, token_key, token_secret = creds
+        client = oauth1.Client(
+            consumer_key, client_secret=consumer_secret,
+            resource_owner_key=token_key, resource_owner_secret=token_secret,
+            encoding='utf-8', decoding='utf-8', nonce='1234',
+            timestamp='1400000000')
+        signer = self._OAuthSigner(*creds)
+        expected = client.sign(
+            uri, http_method=method, body=body, headers=headers)
+        signed = signer.sign(
+            uri, http_method=method, body=body, headers=headers,
+            nonce='1234', timestamp='1400000000')
+        self.assertEqual(signed, expected)
+
+    def test_base_string_uri(self):
+        """
+        base_string_uri() should normalize the scheme and host and strip the
+        query and default port.
+        """
+        self.assertEqual(
+            self._base_string_uri('HTTPS://Api.Twitter.com:443/a b?x=1'),
+            'https://api.twitter.com/a%20b')
+        self.assertEqual(
+            self._base_string_uri('http://example.com:8080'),
+            'http://example.com:8080/')
+
+    def test_sign_get(self):
+        """
+        Signing a GET request with query parameters should produce the same
+        result as oauthlib.
+        """
+        self.assert_matches_oauthlib(
+            'https://api.twitter.com/1.1/statuses/show.json?id=123&a-b=&a=c',
+            'GET')
+
+    def test_sign_post_form(self):
+        """
+        Signing a POST request with a form-encoded body should produce the
+        same result as oauthlib.
+        """
+        body = urlencode({
+            'status': u'Hello \u2603 & ~*'.encode('utf-8'),
+            'trim_user': 'true',
+        })
+        self.assert_matches_oauthlib(
+            'https://api.twitter.com/1.1/statuses/update.json', 'POST',
+            body=body,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def test_sign_multipart(self):
+        """
+        Signing a multipart request without a body should produce the same
+        result as oauthlib.
+        """
+        self.assert_matches_oauthlib(
+            'https://upload.twitter.com/1.1/media/upload.json', 'POST',
+            headers={'Content-Type': 'multipart/form-data; boundary=x'})
+
+    def test_sign_unicode_credentials(self):
+        """
+        Unicode credentials should be encoded as UTF-8.
+        """
+        self.assert_matches_oauthlib(
+            'https://api.twitter.com/1.1/direct_messages.json', 'GET',
+            creds=(u'ck', u'cs\xe9', u'tk', u'ts\xe9'))
+
+    def test_nonce_unique(self):
+        """
+        Generated nonces should not repeat.
+        """
+        signer = self._OAuthSigner(*CREDS)
+        nonces = set(signer.make_nonce() for _ in xrange(1000))
+        self.assertEqual(len(nonces), 1000)
+
+    def test_sign_does_not_modify_headers(self):
+        """
+        The headers passed in should not be modified.
+        """
+        signer = self._OAuthSigner(*CREDS)
+        headers = {'Content-Type': 'multipart/form-data; boundary=x'}
+        _, signed_headers, _ = signer.sign(
+            'https://example.com/', 'POST', headers=headers)
+        self.assertEqual(headers.keys(), ['Content-Type'])
+        self.assertEqual(
+            sorted(signed_headers.keys()), ['Authorization', 'Content-Type'])
@@ -0,0 +1,99 @@
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+
+def from_pool(name):
+    @property
+    def prop(self):
+        from txtwitter import pool
+        return getattr(pool, name)
+    return prop
+
+
+class FakeEndpoint(object):
+    def __init__(self):
+        self.protocols = []
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        self.protocols.append(protocol)
+        return succeed(protocol)
+
+
+class TestTwitterConnectionPool(TestCase):
+    _TwitterConnectionPool = from_pool('TwitterConnectionPool')
+
+    def test_config(self):
+        """
+        The number of persistent connections per host and the idle timeout
+        should be configurable.
+        """
+        pool = self._TwitterConnectionPool(
+            Clock(), max_persistent_per_host=7, idle_timeout=30)
+        self.assertEqual(pool.maxPersistentPerHost, 7)
+        self.assertEqual(pool.cachedConnectionTimeout, 30)
+        self.assertEqual(pool.persistent, True)
+
+    def test_stats_initial(self):
+        """
+        A new pool should have zeroed statistics.
+        """
+        pool = self._TwitterConnectionPool(Clock())
+        self.assertEqual(pool.get_stats(), {
+            'requested': 0,
+            'created': 0,
+            'reused': 0,
+            'expired': 0,
+            'idle': 0,
+        })
+
+    def test_stats_new_connection(self):
+        """
+        Requesting a connection from an empty pool should create a new one.
+        """
+        pool = self._TwitterConnectionPool(Clock())
+        endpoint = FakeEndpoint()
+        self.successResultOf(pool.getConnection('key', endpoint))
+        self.assertEqual(len(endpoint.protocols), 1)
+        stats = pool.get_stats()
+        self.assertEqual(stats['requested'], 1)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 0)
+
+    def test_stats_reused_connection(self):
+        """
+        Requesting a connection when one is idle should reuse it.
+        """
+        pool = self._TwitterConnectionPool(Clock())
+        endpoint = FakeEndpoint()
+        conn = self.successResultOf(pool.getConnection('key', endpoint))
+        pool._putConnection('key', conn)
+        self.assertEqual(pool.idle_connections(), 1)
+
+        self.successResultOf(pool.getConnection('key', endpoint))
+        self.assertEqual(len(endpoint.protocols), 1)
+        self.assertEqual(pool.get_stats(), {
+            'requested': 2,
+            'created': 1,
+            'reused': 1,
+            'expired': 0,
+            'idle': 0,
+        })
+
+    def test_stats_expired_connection(self):
+        """
+        Idle connections should expire after the idle timeout.
+        """
+        clock = Clock()
+        pool = self._TwitterConnectionPool(clock, idle_timeout=10)
+        endpoint = FakeEndpoint()
+        conn = self.successResultOf(pool.getConnection('key', endpoint))
+        pool._putConnection('key', conn)
+        clock.advance(9)
+        self.assertEqual(pool.idle_connections(), 1)
+        clock.advance(1)
+        self.assertEqual(pool.idle_connections(), 0)
+        self.assertEqual(pool.get_stats()['expired'], 1)
@@ -0,0 +1,129 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from twisted.web.http_headers import Headers
+
+
+def from_ratelimit(name):
+    @property
+    def prop(self):
+        from txtwitter import ratelimit
+        return getattr(ratelimit, name)
+    return prop
+
+
+def rate_limit_headers(limit, remaining, reset):
+    return Headers({
+        'x-rate-limit-limit': [str(limit)],
+        'x-rate-limit-remaining': [str(remaining)],
+        'x-rate-limit-reset': [str(reset)],
+    })
+
+
+class TestEndpointForURI(TestCase):
+    _endpoint_for_uri = from_ratelimit('endpoint_for_uri')
+
+    def test_strips_query(self):
+        """
+        The query string is not part of the endpoint.
+        """
+        self.assertEqual(
+            self._endpoint_for_uri('https://api.example.com/foo.json?a=1'),
+            'https://api.example.com/foo.json')
+        self.assertEqual(
+            self._endpoint_for_uri('https://api.example.com/foo.json'),
+            'https://api.example.com/foo.json')
+
+
+class TestRateLimit(TestCase):
+    _RateLimit = from_ratelimit('RateLimit')
+
+    def test_from_headers(self):
+        """
+        A RateLimit can be built from response headers.
+        """
+        rate_limit = self._RateLimit.from_headers(
+            rate_limit_headers(15, 14, 1000))
+        self.assertEqual(rate_limit.limit, 15)
+        self.assertEqual(rate_limit.remaining, 14)
+        self.assertEqual(rate_limit.reset, 1000)
+
+    def test_from_headers_missing(self):
+        """
+        Headers without rate limit information give ``None``.
+        """
+        self.assertEqual(self._RateLimit.from_headers(Headers()), None)
+        headers = rate_limit_headers(15, 14, 1000)
+        headers.removeHeader('x-rate-limit-reset')
+        self.assertEqual(self._RateLimit.from_headers(headers), None)
+
+    def test_from_headers_invalid(self):
+        """
+        Headers with non-integer values give ``None``.
+        """
+        headers = rate_limit_headers(15, 'lots', 1000)
+        self.assertEqual(self._RateLimit.from_headers(headers), None)
+
+
+class TestRateLimitTracker(TestCase):
+    _RateLimitTracker = from_ratelimit('RateLimitTracker')
+
+    def test_update_and_get(self):
+        """
+        Rate limits are recorded per token and endpoint.
+        """
+        tracker = self._RateLimitTracker(Clock())
+        tracker.update('tok1', 'ep1', rate_limit_headers(15, 14, 1000))
+        tracker.update('tok2', 'ep1', rate_limit_headers(15, 3, 1000))
+        tracker.update('tok1', 'ep2', rate_limit_headers(180, 100, 1000))
+        self.assertEqual(tracker.get('tok1', 'ep1').remaining, 14)
+        self.assertEqual(tracker.get('tok2', 'ep1').remaining, 3)
+        self.assertEqual(tracker.get('tok1', 'ep2').remaining, 100)
+        self.assertEqual(tracker.get('tok2', 'ep2'), None)
+        self.assertEqual(sorted(tracker.endpoints('tok1')), ['ep1', 'ep2'])
+
+    def test_update_replaces(self):
+        """
+        Newer information replaces older information for the same endpoint.
+        """
+        tracker = self._RateLimitTracker(Clock())
+        tracker.update('tok', 'ep', rate_limit_headers(15, 14, 1000))
+        tracker.update('tok', 'ep', rate_limit_headers(15, 13, 1000))
+        self.assertEqual(tracker.get('tok', 'ep').remaining, 13)
+
+    def test_update_ignores_missing_headers(self):
+        """
+        Responses without rate limit headers don't clear what is known.
+        """
+        tracker = self._RateLimitTracker(Clock())
+        tracker.update('tok', 'ep', rate_limit_headers(15, 14, 1000))
+        self.assertEqual(tracker.update('tok', 'ep', Headers()), None)
+        self.assertEqual(tracker.get('tok', 'ep').remaining, 14)
+
+    def test_time_until_allowed(self):
+        """
+        The wait is zero while requests remain and counts down to the reset
+        time once they have run out.
+        """
+        clock = Clock()
+        clock.advance(900)
+        tracker = self._RateLimitTracker(clock)
+        self.assertEqual(tracker.time_until_allowed('tok', 'ep'), 0)
+
+        tracker.update('tok', 'ep', rate_limit_headers(15, 1, 1000))
+        self.assertEqual(tracker.time_until_allowed('tok', 'ep'), 0)
+
+        tracker.update('tok', 'ep', rate_limit_headers(15, 0, 1000))
+        self.assertEqual(tracker.time_until_allowed('tok', 'ep'), 100)
+        clock.advance(60)
+        self.assertEqual(tracker.time_until_allowed('tok', 'ep'), 40)
+        clock.advance(60)
+        self.assertEqual(tracker.time_until_allowed('tok', 'ep'), 0)
+
+    def test_clear(self):
+        """
+        clear() forgets everything.
+        """
+        tracker = self._RateLimitTracker(Clock())
+        tracker.update('tok', 'ep', rate_limit_headers(15, 0, 1000))
+        tracker.clear()
+        self.assertEqual(tracker.get('tok', 'ep'), None)
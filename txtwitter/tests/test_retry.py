@@ -0,0 +1,214 @@
+from twisted.internet.defer import CancelledError, Deferred, fail, succeed
+from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from txtwitter.error import RateLimitedError, TwitterAPIError
+
+
+def from_retry(name):
+    @property
+    def prop(self):
+        from txtwitter import retry
+        return getattr(retry, name)
+    return prop
+
+
+class FlakyFunc(object):
+    """
+    A function that fails with the given errors before succeeding.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            return fail(self.errors.pop(0))
+        return succeed('ok')
+
+
+class TestRetryPolicy(TestCase):
+    _RetryPolicy = from_retry('RetryPolicy')
+
+    def _policy(self, **kw):
+        clock = Clock()
+        kw.setdefault('jitter', False)
+        return clock, self._RetryPolicy(clock=clock, **kw)
+
+    def test_is_retryable(self):
+        """
+        Server errors, rate limiting and network errors are retryable, but
+        other API errors and cancellation are not.
+        """
+        clock, policy = self._policy()
+        self.assertTrue(
+            policy.is_retryable(Failure(TwitterAPIError(503))))
+        self.assertTrue(
+            policy.is_retryable(Failure(RateLimitedError(429))))
+        self.assertTrue(
+            policy.is_retryable(Failure(ConnectionRefusedError())))
+        self.assertFalse(
+            policy.is_retryable(Failure(TwitterAPIError(404))))
+        self.assertFalse(policy.is_retryable(Failure(CancelledError())))
+
+    def test_is_retryable_configured(self):
+        """
+        The retryable status codes and network errors are configurable.
+        """
+        clock, policy = self._policy(
+            retry_statuses=[500], retry_network_errors=False)
+        self.assertTrue(
+            policy.is_retryable(Failure(TwitterAPIError(500))))
+        self.assertFalse(
+            policy.is_retryable(Failure(TwitterAPIError(503))))
+        self.assertFalse(
+            policy.is_retryable(Failure(ConnectionRefusedError())))
+
+    def test_backoff(self):
+        """
+        The backoff delay doubles after each attempt up to the maximum.
+        """
+        clock, policy = self._policy(base_delay=1, max_delay=5)
+        self.assertEqual(
+            [policy.backoff(n) for n in range(1, 6)], [1, 2, 4, 5, 5])
+
+    def test_backoff_jitter(self):
+        """
+        With jitter, the backoff delay is scaled by a random factor.
+        """
+        clock, policy = self._policy(base_delay=1, jitter=True)
+        policy.random = lambda: 0.5
+        self.assertEqual(policy.backoff(3), 2)
+
+    def test_retry_delay_methods(self):
+        """
+        POST requests are only retried if enabled.
+        """
+        err = Failure(TwitterAPIError(503))
+        clock, policy = self._policy()
+        self.assertEqual(policy.retry_delay('GET', err, 1), 1)
+        self.assertEqual(policy.retry_delay('POST', err, 1), None)
+        clock, policy = self._policy(retry_posts=True)
+        self.assertEqual(policy.retry_delay('POST', err, 1), 1)
+
+    def test_retry_delay_rate_limit(self):
+        """
+        The retry delay is at least the time until the rate limit resets.
+        """
+        err = Failure(RateLimitedError(429))
+        clock, policy = self._policy()
+        self.assertEqual(policy.retry_delay('GET', err, 1, 30), 30)
+        self.assertEqual(policy.retry_delay('GET', err, 1, 0), 1)
+
+    def test_run_success(self):
+        """
+        A successful call is not retried.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc()
+        self.assertEqual(self.successResultOf(policy.run(func)), 'ok')
+        self.assertEqual(func.calls, 1)
+
+    def test_run_retries(self):
+        """
+        Retryable failures are retried after the backoff delay.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc(TwitterAPIError(503), TwitterAPIError(500))
+        d = policy.run(func)
+        self.assertEqual(func.calls, 1)
+        clock.advance(1)
+        self.assertEqual(func.calls, 2)
+        clock.advance(1)
+        self.assertEqual(func.calls, 2)
+        self.assertNoResult(d)
+        clock.advance(1)
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(self.successResultOf(d), 'ok')
+        self.assertEqual(policy.retries, 2)
+
+    def test_run_max_attempts(self):
+        """
+        The last failure is returned once the maximum number of attempts has
+        been made.
+        """
+        clock, policy = self._policy(max_attempts=2)
+        func = FlakyFunc(TwitterAPIError(503), TwitterAPIError(502))
+        d = policy.run(func)
+        clock.advance(1)
+        failure = self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(failure.value.status, '502')
+        self.assertEqual(func.calls, 2)
+
+    def test_run_not_retryable(self):
+        """
+        Non-retryable failures are returned immediately.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc(TwitterAPIError(404))
+        self.failureResultOf(policy.run(func), TwitterAPIError)
+        self.assertEqual(func.calls, 1)
+
+    def test_run_post_not_retried(self):
+        """
+        POST requests aren't retried by default.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc(TwitterAPIError(503))
+        self.failureResultOf(policy.run(func, 'POST'), TwitterAPIError)
+        self.assertEqual(func.calls, 1)
+
+    def test_run_rate_limit_delay(self):
+        """
+        Retries wait for the rate limit to reset.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc(RateLimitedError(429))
+        d = policy.run(func, rate_limit_delay=lambda: 60)
+        clock.advance(59)
+        self.assertEqual(func.calls, 1)
+        clock.advance(1)
+        self.assertEqual(self.successResultOf(d), 'ok')
+
+    def test_run_deadline(self):
+        """
+        No retry is attempted beyond the deadline.
+        """
+        clock, policy = self._policy(deadline=2, max_attempts=5)
+        func = FlakyFunc(*[TwitterAPIError(503)] * 4)
+        d = policy.run(func)
+        clock.advance(1)
+        self.assertEqual(func.calls, 2)
+        # The next delay is 2 seconds, which would take us past the deadline.
+        self.failureResultOf(d, TwitterAPIError)
+
+    def test_cancel_waiting(self):
+        """
+        Cancelling while waiting to retry stops any further attempts.
+        """
+        clock, policy = self._policy()
+        func = FlakyFunc(TwitterAPIError(503))
+        d = policy.run(func)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(clock.getDelayedCalls(), [])
+        self.assertEqual(func.calls, 1)
+
+    def test_cancel_in_flight(self):
+        """
+        Cancelling while an attempt is in flight cancels the attempt.
+        """
+        clock, policy = self._policy()
+        cancelled = []
+
+        def func():
+            return Deferred(cancelled.append)
+        d = policy.run(func)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(clock.getDelayedCalls(), [])
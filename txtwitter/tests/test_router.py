@@ -0,0 +1,197 @@
+import json
+
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import TestCase
+
+from txtwitter.envelope import MessageEnvelope
+
+
+def from_router(name):
+    @property
+    def prop(self):
+        from txtwitter import router
+        return getattr(router, name)
+    return prop
+
+
+TWEET = {
+    'created_at': 'Mon Sep 24 03:35:21 +0000 2012',
+    'id_str': '1',
+    'text': 'Tweet!',
+    'user': {'id_str': '2', 'screen_name': 'fakeuser'},
+}
+DM = {
+    'id_str': '1',
+    'text': 'DM!',
+    'sender': {'id_str': '2'},
+    'recipient': {'id_str': '3'},
+}
+EVENT = {
+    'event': 'favorite',
+    'source': {'id_str': '2'},
+    'target': {'id_str': '3'},
+    'target_object': TWEET,
+}
+
+MESSAGES = [
+    ('tweet', TWEET),
+    ('dm', DM),
+    ('dm', {'direct_message': DM}),
+    ('event', EVENT),
+    ('delete', {'delete': {'status': {'id_str': '1'}}}),
+    ('limit', {'limit': {'track': 5}}),
+    ('warning', {'warning': {'code': 'FALLING_BEHIND'}}),
+    ('friends', {'friends': [1, 2]}),
+    ('friends', {'friends_str': ['1', '2']}),
+    ('unknown', {'scrub_geo': {'user_id_str': '2'}}),
+    ('unknown', {'id_str': '1', 'text': 'Not a tweet'}),
+    ('unknown', {}),
+]
+
+
+class TestMessageKind(TestCase):
+    _message_kind = from_router('message_kind')
+
+    def test_dicts(self):
+        """
+        Decoded messages are classified by their top-level keys.
+        """
+        for kind, message in MESSAGES:
+            self.assertEqual(self._message_kind(message), kind)
+
+    def test_envelopes(self):
+        """
+        Envelopes are classified the same way as the messages they contain,
+        without being decoded.
+        """
+        for kind, message in MESSAGES:
+            envelope = MessageEnvelope(json.dumps(message))
+            self.assertEqual(self._message_kind(envelope), kind)
+            self.assertEqual(envelope.decoded, False)
+
+
+class TestMessageId(TestCase):
+    _message_id = from_router('message_id')
+
+    def test_message_id(self):
+        """
+        Tweets and direct messages have IDs, whether or not DMs are wrapped
+        and whether or not the message is in an envelope.
+        """
+        for message in [TWEET, DM, {'direct_message': DM}]:
+            self.assertEqual(self._message_id(message), '1')
+            envelope = MessageEnvelope(json.dumps(message))
+            self.assertEqual(self._message_id(envelope), '1')
+            self.assertEqual(envelope.decoded, False)
+
+    def test_no_id(self):
+        """
+        Other kinds of message don't have IDs.
+        """
+        for message in [EVENT, {'delete': {'status': {'id_str': '1'}}}]:
+            self.assertEqual(self._message_id(message), None)
+
+    def test_kind(self):
+        """
+        The message's kind can be given if it is already known.
+        """
+        self.assertEqual(self._message_id(DM, 'dm'), '1')
+        self.assertEqual(self._message_id(DM, 'event'), None)
+
+
+class TestMessageRouter(TestCase):
+    _MessageRouter = from_router('MessageRouter')
+
+    def test_route(self):
+        """
+        Each message is passed unchanged to the handler for its kind.
+        """
+        routed = []
+        router = self._MessageRouter(
+            tweet=lambda msg: routed.append(('tweet', msg)),
+            dm=lambda msg: routed.append(('dm', msg)),
+            delete=lambda msg: routed.append(('delete', msg)))
+        delete = {'delete': {'status': {'id_str': '1'}}}
+        wrapped_dm = {'direct_message': DM}
+        for message in [TWEET, delete, wrapped_dm, EVENT]:
+            router(message)
+        self.assertEqual(routed, [
+            ('tweet', TWEET), ('delete', delete), ('dm', wrapped_dm)])
+
+    def test_add_remove_handler(self):
+        """
+        Handlers can be added, replaced and removed after the router is
+        created.
+        """
+        routed = []
+        router = self._MessageRouter()
+        router(TWEET)
+        router.add_handler('tweet', lambda msg: routed.append(1))
+        router(TWEET)
+        router.add_handler('tweet', lambda msg: routed.append(2))
+        router(TWEET)
+        router.remove_handler('tweet')
+        router.remove_handler('tweet')
+        router(TWEET)
+        self.assertEqual(routed, [1, 2])
+
+    def test_unknown_kind(self):
+        """
+        Registering a handler for a kind of message that doesn't exist is an
+        error.
+        """
+        self.assertRaises(
+            ValueError, self._MessageRouter, tweets=lambda msg: None)
+        router = self._MessageRouter()
+        self.assertRaises(
+            ValueError, router.add_handler, 'tweets', lambda msg: None)
+
+    def test_return_value(self):
+        """
+        The handler's return value is returned, so that stream delegates can
+        apply backpressure.
+        """
+        d = Deferred()
+        router = self._MessageRouter(tweet=lambda msg: d)
+        self.assertIdentical(router(TWEET), d)
+        self.assertEqual(router(DM), None)
+
+    def test_batch(self):
+        """
+        Each message in a batch is routed on its own, and the batch is only
+        finished once all of their handlers' ``Deferred``s have fired.
+        """
+        routed = []
+        ds = []
+
+        def handle_dm(msg):
+            routed.append(('dm', msg))
+            ds.append(Deferred())
+            return ds[-1]
+
+        router = self._MessageRouter(
+            tweet=lambda msg: routed.append(('tweet', msg)), dm=handle_dm)
+        d = router([TWEET, DM, EVENT, DM])
+        self.assertEqual(
+            routed, [('tweet', TWEET), ('dm', DM), ('dm', DM)])
+        ds[0].callback(None)
+        self.assertNoResult(d)
+        ds[1].callback(None)
+        self.successResultOf(d)
+        self.assertEqual(router([TWEET, EVENT]), None)
+        self.assertEqual(router.get_stats()['tweet'], 2)
+
+    def test_stats(self):
+        """
+        The router counts messages by kind, whether or not they are handled.
+        """
+        router = self._MessageRouter(tweet=lambda msg: None)
+        for _, message in MESSAGES:
+            router(message)
+        stats = router.get_stats()
+        self.assertEqual(stats['tweet'], 1)
+        self.assertEqual(stats['dm'], 2)
+        self.assertEqual(stats['friends'], 2)
+        self.assertEqual(stats['unknown'], 3)
+        self.assertEqual(stats['event'], 1)
+        self.assertEqual(sum(stats.values()), len(MESSAGES))
@@ -0,0 +1,265 @@
+from twisted.internet.defer import CancelledError, Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+from twisted.web.http_headers import Headers
+
+
+def from_scheduler(name):
+    @property
+    def prop(self):
+        from txtwitter import scheduler
+        return getattr(scheduler, name)
+    return prop
+
+
+class FakeEndpoint(object):
+    """
+    A fake API endpoint that records requests and updates a rate limit
+    tracker when they are answered.
+    """
+
+    def __init__(self, rate_limits, token, endpoint):
+        self.rate_limits = rate_limits
+        self.token = token
+        self.endpoint = endpoint
+        self.requests = []
+
+    def request_func(self, name):
+        def request():
+            d = Deferred()
+            self.requests.append((name, d))
+            return d
+        return request
+
+    def respond(self, index, remaining, reset, limit=15):
+        name, d = self.requests[index]
+        self.rate_limits.update(self.token, self.endpoint, Headers({
+            'x-rate-limit-limit': [str(limit)],
+            'x-rate-limit-remaining': [str(remaining)],
+            'x-rate-limit-reset': [str(reset)],
+        }))
+        d.callback(name)
+
+    def sent(self):
+        return [name for name, _ in self.requests]
+
+
+class TestRequestScheduler(TestCase):
+    _RequestScheduler = from_scheduler('RequestScheduler')
+    _PRIORITY_HIGH = from_scheduler('PRIORITY_HIGH')
+    _PRIORITY_LOW = from_scheduler('PRIORITY_LOW')
+
+    def _scheduler_and_endpoint(self, **kw):
+        clock = Clock()
+        scheduler = self._RequestScheduler(clock=clock, **kw)
+        endpoint = FakeEndpoint(scheduler.rate_limits, 'tok', 'ep')
+        return clock, scheduler, endpoint
+
+    def _submit(self, scheduler, endpoint, name, **kw):
+        return scheduler.submit(
+            'tok', 'ep', endpoint.request_func(name), **kw)
+
+    def test_unknown_rate_limit(self):
+        """
+        Requests to an endpoint with an unknown rate limit are sent one at a
+        time until a response tells us the rate limit.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        d1 = self._submit(scheduler, endpoint, 'r1')
+        for name in ['r2', 'r3', 'r4']:
+            self._submit(scheduler, endpoint, name)
+        self.assertEqual(endpoint.sent(), ['r1'])
+        self.assertEqual(scheduler.queue_depth(), 3)
+        endpoint.respond(0, 14, 900)
+        self.assertEqual(self.successResultOf(d1), 'r1')
+        self.assertEqual(endpoint.sent(), ['r1', 'r2', 'r3', 'r4'])
+
+    def test_unknown_rate_limit_no_headers(self):
+        """
+        If a response doesn't tell us the rate limit, the next request is
+        sent once it completes.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        d1 = self._submit(scheduler, endpoint, 'r1')
+        self._submit(scheduler, endpoint, 'r2')
+        self._submit(scheduler, endpoint, 'r3')
+        endpoint.requests[0][1].errback(ZeroDivisionError())
+        self.failureResultOf(d1, ZeroDivisionError)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
+
+    def test_synchronous_request(self):
+        """
+        Requests that complete synchronously are handled.
+        """
+        scheduler = self._RequestScheduler(clock=Clock())
+        ds = [scheduler.submit('tok', 'ep', lambda: succeed(i))
+              for i in range(1000)]
+        self.assertEqual([self.successResultOf(d) for d in ds], range(1000))
+
+    def test_failed_request(self):
+        """
+        A failed request fails the submitted Deferred and doesn't block the
+        queue.
+        """
+        scheduler = self._RequestScheduler(clock=Clock(), max_concurrent=1)
+        d1 = scheduler.submit('tok', 'ep', lambda: 1 / 0)
+        d2 = scheduler.submit('tok', 'ep', lambda: 'ok')
+        self.failureResultOf(d1, ZeroDivisionError)
+        self.assertEqual(self.successResultOf(d2), 'ok')
+
+    def test_held_until_reset(self):
+        """
+        Requests beyond the remaining rate limit are held until the window
+        resets.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 1, 900)
+
+        self._submit(scheduler, endpoint, 'r2')
+        d3 = self._submit(scheduler, endpoint, 'r3')
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
+        endpoint.respond(1, 0, 900)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
+        self.assertEqual(scheduler.queue_depth(), 1)
+        self.assertEqual(scheduler.queue_depth('tok', 'ep'), 1)
+        self.assertEqual(scheduler.queue_depth('tok', 'other'), 0)
+
+        clock.advance(899)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
+        clock.advance(1)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2', 'r3'])
+        endpoint.respond(2, 14, 1800)
+        self.assertEqual(self.successResultOf(d3), 'r3')
+        self.assertEqual(scheduler.queue_depth(), 0)
+
+    def test_in_flight_counted(self):
+        """
+        Requests in flight count against the remaining rate limit.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 2, 900)
+        for name in ['r2', 'r3', 'r4']:
+            self._submit(scheduler, endpoint, name)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2', 'r3'])
+        endpoint.respond(1, 1, 900)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2', 'r3'])
+
+    def test_stale_window(self):
+        """
+        A window whose reset time has passed is assumed to have been reset.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 0, 900)
+        clock.advance(1000)
+        self._submit(scheduler, endpoint, 'r2')
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
+
+    def test_max_concurrent(self):
+        """
+        No more than ``max_concurrent`` requests are in flight at once.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint(
+            max_concurrent=2)
+        self._submit(scheduler, endpoint, 'r0')
+        endpoint.respond(0, 14, 900)
+        for name in ['r1', 'r2', 'r3']:
+            self._submit(scheduler, endpoint, name)
+        self.assertEqual(endpoint.sent(), ['r0', 'r1', 'r2'])
+        endpoint.respond(1, 13, 900)
+        self.assertEqual(endpoint.sent(), ['r0', 'r1', 'r2', 'r3'])
+
+    def test_priority(self):
+        """
+        Queued requests are released in priority order, and in submission
+        order within a priority.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 0, 900)
+        self._submit(
+            scheduler, endpoint, 'low1', priority=self._PRIORITY_LOW)
+        self._submit(scheduler, endpoint, 'normal')
+        self._submit(
+            scheduler, endpoint, 'low2', priority=self._PRIORITY_LOW)
+        self._submit(
+            scheduler, endpoint, 'high', priority=self._PRIORITY_HIGH)
+        clock.advance(900)
+        self.assertEqual(
+            endpoint.sent(), ['r1', 'high', 'normal', 'low1', 'low2'])
+
+    def test_endpoints_independent(self):
+        """
+        An exhausted endpoint doesn't hold up requests to other endpoints or
+        for other tokens.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        other_ep = FakeEndpoint(scheduler.rate_limits, 'tok', 'ep2')
+        other_tok = FakeEndpoint(scheduler.rate_limits, 'tok2', 'ep')
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 0, 900)
+        self._submit(scheduler, endpoint, 'r2')
+        scheduler.submit('tok', 'ep2', other_ep.request_func('ep2'))
+        scheduler.submit('tok2', 'ep', other_tok.request_func('tok2'))
+        self.assertEqual(endpoint.sent(), ['r1'])
+        self.assertEqual(other_ep.sent(), ['ep2'])
+        self.assertEqual(other_tok.sent(), ['tok2'])
+
+    def test_stats(self):
+        """
+        The scheduler records queue depth and wait time statistics.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 0, 100)
+        self._submit(scheduler, endpoint, 'r2')
+        clock.advance(50)
+        self._submit(scheduler, endpoint, 'r3')
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['dispatched'], 1)
+        self.assertEqual(stats['max_wait'], 0)
+
+        clock.advance(50)
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['in_flight'], 2)
+        self.assertEqual(stats['dispatched'], 3)
+        self.assertEqual(stats['total_wait'], 150)
+        self.assertEqual(stats['mean_wait'], 50)
+        self.assertEqual(stats['max_wait'], 100)
+        self.assertEqual(
+            stats['endpoints'][('tok', 'ep')]['total_wait'], 150)
+
+    def test_cancel_queued(self):
+        """
+        Cancelling a queued request removes it from the queue.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint()
+        self._submit(scheduler, endpoint, 'r1')
+        endpoint.respond(0, 0, 900)
+        d2 = self._submit(scheduler, endpoint, 'r2')
+        self._submit(scheduler, endpoint, 'r3')
+        d2.cancel()
+        self.failureResultOf(d2, CancelledError)
+        self.assertEqual(scheduler.queue_depth(), 1)
+        clock.advance(900)
+        self.assertEqual(endpoint.sent(), ['r1', 'r3'])
+
+    def test_cancel_in_flight(self):
+        """
+        Cancelling a released request cancels the request itself.
+        """
+        clock, scheduler, endpoint = self._scheduler_and_endpoint(
+            max_concurrent=1)
+        d1 = self._submit(scheduler, endpoint, 'r1')
+        self._submit(scheduler, endpoint, 'r2')
+        d1.cancel()
+        self.failureResultOf(d1, CancelledError)
+        self.assertTrue(endpoint.requests[0][1].called)
+        self.assertEqual(endpoint.sent(), ['r1', 'r2'])
@@ -0,0 +1,172 @@
+from twisted.application.service import Service
+from twisted.trial.unittest import TestCase
+
+from txtwitter.tests.fake_messages import tweet
+
+
+def from_sharding(name):
+    @property
+    def prop(self):
+        from txtwitter import sharding
+        return getattr(sharding, name)
+    return prop
+
+
+class FakeFilterService(Service):
+    def __init__(self, client, delegate, follow, track, kw):
+        self.client = client
+        self.delegate = delegate
+        self.follow = follow
+        self.track = track
+        self.kw = kw
+
+
+class FakeClient(object):
+    """
+    Creates fake filter streams and records them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.streams = []
+
+    def stream_filter(self, delegate, follow=None, track=None, **kw):
+        svc = FakeFilterService(self, delegate, follow, track, kw)
+        self.streams.append(svc)
+        return svc
+
+
+class TestShardedFilterStream(TestCase):
+    _ShardedFilterStream = from_sharding('ShardedFilterStream')
+
+    def _stream(self, clients=3, **kw):
+        clients = [FakeClient(i) for i in range(clients)]
+        messages = []
+        kw.setdefault('max_follow', 3)
+        kw.setdefault('max_track', 2)
+        stream = self._ShardedFilterStream(clients, messages.append, **kw)
+        return stream, clients, messages
+
+    def _active(self, clients):
+        return [
+            (client.streams[-1].follow, client.streams[-1].track)
+            for client in clients
+            if client.streams and client.streams[-1].parent is not None]
+
+    def test_single_shard(self):
+        """
+        A filter within the limits uses one stream.
+        """
+        stream, clients, messages = self._stream(
+            follow=['1', '2'], track=['foo'], stall_warnings=True,
+            delimited='length')
+        self.assertEqual(self._active(clients), [(['1', '2'], ['foo'])])
+        self.assertEqual(
+            clients[0].streams[0].kw,
+            {'stall_warnings': True, 'delimited': 'length'})
+        self.assertEqual(stream.get_stats()['shards'], 1)
+
+    def test_split(self):
+        """
+        Follow and track sets that are too large are split across shards.
+        """
+        stream, clients, messages = self._stream(
+            follow=['1', '2', '3', '4', '5', '6', '7'], track=['a', 'b', 'c'])
+        self.assertEqual(self._active(clients), [
+            (['1', '2', '3'], ['a', 'b']),
+            (['4', '5', '6'], ['c']),
+            (['7'], None),
+        ])
+
+    def test_too_large(self):
+        """
+        A filter that needs more shards than there are clients is an error.
+        """
+        self.assertRaises(
+            ValueError, self._stream, clients=2,
+            track=['a', 'b', 'c', 'd', 'e'])
+        stream, clients, messages = self._stream(clients=2, track=['a'])
+        self.assertRaises(
+            ValueError, stream.set_filter, follow=[str(i) for i in range(7)])
+        self.assertEqual(self._active(clients), [(None, ['a'])])
+
+    def test_start_stop(self):
+        """
+        The shards are started and stopped with the service.
+        """
+        stream, clients, messages = self._stream(
+            follow=['1', '2', '3', '4'])
+        shards = [client.streams[0] for client in clients[:2]]
+        self.assertEqual([svc.running for svc in shards], [0, 0])
+        stream.startService()
+        self.assertEqual([svc.running for svc in shards], [1, 1])
+        stream.stopService()
+        self.assertEqual([svc.running for svc in shards], [0, 0])
+
+    def test_merged_and_deduplicated(self):
+        """
+        Messages from all shards go to the delegate, with duplicates removed.
+        """
+        stream, clients, messages = self._stream(
+            follow=['1', '2', '3', '4'])
+        delegates = [client.streams[0].delegate for client in clients[:2]]
+        delegates[0](tweet('10'))
+        delegates[1](tweet('11'))
+        delegates[1](tweet('10'))
+        delegates[0]({'limit': {'track': 1}})
+        self.assertEqual(
+            messages, [tweet('10'), tweet('11'), {'limit': {'track': 1}}])
+        stats = stream.get_stats()
+        self.assertEqual(stats['delivered'], 3)
+        self.assertEqual(stats['duplicates'], 1)
+
+    def test_rebalance_minimal(self):
+        """
+        Changing the filter only reconnects the shards whose share changed,
+        and new items go to shards that already have room.
+        """
+        stream, clients, messages = self._stream(
+            follow=['1', '2', '3', '4', '5'])
+        stream.startService()
+        self.assertEqual(self._active(clients), [
+            (['1', '2', '3'], None), (['4', '5'], None)])
+
+        stream.set_filter(follow=['1', '2', '3', '4', '5', '6'])
+        self.assertEqual(len(clients[0].streams), 1)
+        self.assertEqual(len(clients[1].streams), 2)
+        self.assertEqual(self._active(clients), [
+            (['1', '2', '3'], None), (['4', '5', '6'], None)])
+        self.assertEqual(clients[1].streams[0].running, 0)
+        self.assertEqual(clients[1].streams[1].running, 1)
+
+        # Removing an item from one shard and adding one elsewhere fills the
+        # gap rather than moving everything around.
+        stream.set_filter(follow=['1', '3', '4', '5', '6', '7'])
+        self.assertEqual(self._active(clients), [
+            (['1', '3', '7'], None), (['4', '5', '6'], None)])
+        self.assertEqual(len(clients[1].streams), 2)
+        self.assertEqual(clients[2].streams, [])
+        self.assertEqual(stream.get_stats()['restarts'], 2)
+
+    def test_rebalance_new_shard(self):
+        """
+        Shards are added when the filter grows, and removed when their share
+        is empty.
+        """
+        stream, clients, messages = self._stream(follow=['1', '2'])
+        stream.startService()
+        stream.set_filter(follow=['1', '2'], track=['a', 'b', 'c'])
+        self.assertEqual(self._active(clients), [
+            (['1', '2'], ['a', 'b']), (None, ['c'])])
+        stream.set_filter(follow=['1', '2'])
+        self.assertEqual(self._active(clients), [(['1', '2'], None)])
+        self.assertEqual(clients[1].streams[0].running, 0)
+        self.assertEqual(stream.get_stats()['shards'], 1)
+
+    def test_get_shards(self):
+        stream, clients, messages = self._stream(
+            clients=2, follow=['1'], track=['a', 'b', 'c'])
+        self.assertEqual(stream.get_shards(), [
+            (frozenset(['1']), frozenset(['a', 'b'])),
+            (frozenset(), frozenset(['c'])),
+        ])
@@ -1,4 +1,4 @@
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 from twisted.trial.unittest import TestCase
@@ -35,6 +35,7 @@ class TestTwitterClient(TestCase):
         called = []
         svc = self._TwitterStreamService(lambda: d, None)
         svc.set_connect_callback(lambda s: called.append(s))
+        svc.clock = Clock()
         svc.startService()
         self.assertEqual(called, [])
         d.callback(FakeResponse(None))
@@ -50,6 +51,7 @@ class TestTwitterClient(TestCase):
         """
         d = Deferred()
         svc = self._TwitterStreamService(lambda: d, None)
+        svc.clock = Clock()
         svc.startService()
         self.assertEqual(None, svc.connect_callback)
         self.assertEqual(None, svc._stream_response)
@@ -96,7 +98,7 @@ class TestTwitterClient(TestCase):
     def test_HTTP_500_initial_reconnect_delay(self):
         """
         The first HTTP error response should set the initial reconnect delay to
-        one second.
+        five seconds.
         """
         d = Deferred()
         svc = self._TwitterStreamService(lambda: d, None)
@@ -105,7 +107,7 @@ class TestTwitterClient(TestCase):
 
         self.assertEqual(svc.reconnect_delay, 0)
         d.callback(FakeResponse(None, 500))
-        self.assertEqual(svc.reconnect_delay, 1)
+        self.assertEqual(svc.reconnect_delay, 5)
 
     def test_HTTP_500_second_reconnect_delay(self):
         """
@@ -115,26 +117,29 @@ class TestTwitterClient(TestCase):
         d = Deferred()
         svc = self._TwitterStreamService(lambda: d, None)
         svc.clock = Clock()
-        svc.reconnect_delay = 1
+        svc.reconnect_delay = 5
+        svc._reconnect_reason = 'http'
         svc.startService()
 
-        self.assertEqual(svc.reconnect_delay, 1)
+        self.assertEqual(svc.reconnect_delay, 5)
         d.callback(FakeResponse(None, 500))
-        self.assertEqual(svc.reconnect_delay, 2)
+        self.assertEqual(svc.reconnect_delay, 10)
 
     def test_HTTP_500_max_reconnect_delay(self):
         """
-        The reconnect delay should never go over the maximum of ten minutes.
+        The reconnect delay for HTTP errors should never go over the maximum
+        of 320 seconds.
         """
         d = Deferred()
         svc = self._TwitterStreamService(lambda: d, None)
         svc.clock = Clock()
         svc.reconnect_delay = 60 * 60 * 24
+        svc._reconnect_reason = 'http'
         svc.startService()
 
         self.assertEqual(svc.reconnect_delay, 60 * 60 * 24)
         d.callback(FakeResponse(None, 500))
-        self.assertEqual(svc.reconnect_delay, 60 * 10)
+        self.assertEqual(svc.reconnect_delay, 320)
 
     def test_HTTP_500_schedules_reconnect(self):
         """
@@ -222,11 +227,37 @@ class TestTwitterClient(TestCase):
         svc = self._TwitterStreamService(lambda: d, None)
         svc.clock = Clock()
         svc.reconnect_delay = 60
+        svc._reconnect_reason = 'rate_limit'
         svc.startService()
 
         d.callback(FakeResponse(None, 420))
         self.assertEqual(svc.reconnect_delay, 120)
 
+    def test_codec_default(self):
+        """
+        The stdlib codec should be used if none is specified.
+        """
+        from txtwitter.codec import STDLIB_CODEC
+        svc = self._TwitterStreamService(None, None)
+        self.assertIs(svc.codec, STDLIB_CODEC)
+
+    def test_codec_decodes_messages(self):
+        """
+        Messages should be decoded with the service's codec.
+        """
+        from txtwitter.codec import JSONCodec
+        d = Deferred()
+        messages = []
+        codec = JSONCodec('fake', lambda line: ('decoded', line), None)
+        svc = self._TwitterStreamService(
+            lambda: d, messages.append, codec=codec)
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        resp.deliver_data('{"foo": "bar"}\r\n')
+        self.assertEqual(messages, [('decoded', '{"foo": "bar"}')])
+
     def test_stop_service_not_started(self):
         """
         Stopping an unstarted service should do nothing.
@@ -289,3 +320,895 @@ class TestTwitterClient(TestCase):
         self.assertEqual(svc.running, False)
         self.assertEqual(svc._reconnect_delayedcall, None)
         self.assertEqual(svc.reconnect_delay, 0)
+
+
+class TestReconnectPolicy(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _service(self, **kw):
+        attempts = []
+
+        def connect():
+            d = Deferred()
+            attempts.append(d)
+            return d
+
+        svc = self._TwitterStreamService(connect, lambda msg: None, **kw)
+        svc.clock = Clock()
+        svc.startService()
+        return svc, attempts
+
+    def _delays(self, svc, attempts, fail, count):
+        """
+        Fail ``count`` connection attempts in a row with ``fail`` and return
+        the delay before each following attempt.
+        """
+        delays = []
+        for _ in range(count):
+            fail(attempts[-1])
+            [call] = svc.clock.getDelayedCalls()
+            delays.append(call.getTime() - svc.clock.seconds())
+            svc.clock.advance(delays[-1])
+        return delays
+
+    def test_dropped_connection_reconnects_immediately(self):
+        """
+        When an established connection drops, we reconnect immediately, and
+        back off if that fails.
+        """
+        svc, attempts = self._service()
+        resp = FakeResponse(None)
+        attempts[0].callback(resp)
+        resp.deliver_data('{}\r\n')
+        resp.finished()
+        self.assertEqual(svc.reconnect_delay, 0)
+        svc.clock.advance(0)
+        self.assertEqual(len(attempts), 2)
+        attempts[1].errback(Exception("Connection refused"))
+        self.assertEqual(svc.reconnect_delay, 0.25)
+        self.assertEqual(len(attempts), 2)
+
+    def test_dropped_before_established(self):
+        """
+        A connection that drops before it delivers anything counts as another
+        failure like the one before it, or as a network error if there wasn't
+        one.
+        """
+        svc, attempts = self._service()
+
+        def connect_and_drop(d):
+            resp = FakeResponse(None)
+            d.callback(resp)
+            resp.finished()
+
+        delays = self._delays(svc, attempts, connect_and_drop, 3)
+        self.assertEqual(delays, [0.25, 0.5, 0.75])
+
+        svc, attempts = self._service()
+        self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 500)), 2)
+        delays = self._delays(svc, attempts, connect_and_drop, 2)
+        self.assertEqual(delays, [20, 40])
+
+    def test_uptime_establishes(self):
+        """
+        A connection that stays up long enough without delivering anything
+        still counts as established.
+        """
+        svc, attempts = self._service()
+        self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 500)), 2)
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        svc.clock.advance(svc.RECONNECT_RESET_UPTIME)
+        resp.finished()
+        self.assertEqual(svc.reconnect_delay, 0)
+
+    def test_network_errors(self):
+        """
+        Network errors back off linearly by 250ms up to 16 seconds.
+        """
+        svc, attempts = self._service()
+        delays = self._delays(
+            svc, attempts, lambda d: d.errback(Exception("Oops")), 65)
+        self.assertEqual(delays[:4], [0.25, 0.5, 0.75, 1])
+        self.assertEqual(delays[-3:], [15.75, 16, 16])
+
+    def test_HTTP_errors(self):
+        """
+        HTTP errors back off exponentially from 5 seconds up to 320 seconds.
+        """
+        svc, attempts = self._service()
+        delays = self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 503)), 8)
+        self.assertEqual(delays, [5, 10, 20, 40, 80, 160, 320, 320])
+
+    def test_rate_limit(self):
+        """
+        Rate limiting backs off exponentially from one minute up to ten
+        minutes.
+        """
+        svc, attempts = self._service()
+        delays = self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 420)), 6)
+        self.assertEqual(delays, [60, 120, 240, 480, 600, 600])
+
+    def test_error_kind_changes(self):
+        """
+        A different kind of error starts that kind's schedule from the
+        beginning.
+        """
+        svc, attempts = self._service()
+        self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 420)), 3)
+        self._delays(
+            svc, attempts, lambda d: d.errback(Exception("Oops")), 1)
+        self.assertEqual(svc.reconnect_delay, 0.25)
+        self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 500)), 2)
+        self.assertEqual(svc.reconnect_delay, 10)
+
+    def test_success_resets(self):
+        """
+        Receiving a message on a new connection resets the backoff.
+        """
+        svc, attempts = self._service()
+        self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 500)), 3)
+        self.assertEqual(svc.reconnect_delay, 20)
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        resp.deliver_data('{}\r\n')
+        resp.finished()
+        self.assertEqual(svc.reconnect_delay, 0)
+        svc.clock.advance(0)
+        attempts[-1].callback(FakeResponse(None, 500))
+        self.assertEqual(svc.reconnect_delay, 5)
+
+    def test_jitter(self):
+        """
+        Jitter lengthens each delay by up to the given fraction, but leaves
+        immediate reconnects alone.
+        """
+        svc, attempts = self._service(reconnect_jitter=0.5)
+        svc._random = lambda: 0.2
+        delays = self._delays(
+            svc, attempts, lambda d: d.callback(FakeResponse(None, 500)), 2)
+        self.assertEqual(delays, [5.5, 11])
+        self.assertEqual(svc.reconnect_delay, 10)
+
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        resp.deliver_data('{}\r\n')
+        resp.finished()
+        svc.clock.advance(0)
+        self.assertEqual(len(attempts), 4)
+
+    def test_jitter_random(self):
+        """
+        Without a fake random number source, jittered delays fall between the
+        delay and the delay plus the jitter.
+        """
+        for _ in range(20):
+            svc, attempts = self._service(reconnect_jitter=0.25)
+            [delay] = self._delays(
+                svc, attempts, lambda d: d.callback(FakeResponse(None, 420)),
+                1)
+            self.assertTrue(60 <= delay <= 75, delay)
+            svc.stopService()
+
+    def test_stop_service_connecting_no_disconnect(self):
+        """
+        Cancelling a connection attempt when the service is stopped doesn't
+        count as a disconnection.
+        """
+        called = []
+        svc, attempts = self._service()
+        svc.set_disconnect_callback(lambda s, r: called.append(r))
+        svc.stopService()
+        self.assertEqual(called, [])
+        self.assertEqual(svc.clock.getDelayedCalls(), [])
+
+
+class TestMessageFraming(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, **kw):
+        d = Deferred()
+        messages = []
+        reasons = []
+        svc = self._TwitterStreamService(lambda: d, messages.append, **kw)
+        svc.set_disconnect_callback(lambda s, r: reasons.append(r))
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        return svc, resp, messages, reasons
+
+    def _frame(self, message):
+        message += '\r\n'
+        return '%d\r\n%s' % (len(message), message)
+
+    def test_delimited_invalid(self):
+        """
+        Only length delimiting is supported.
+        """
+        self.assertRaises(
+            ValueError, self._TwitterStreamService, None, None,
+            delimited='foo')
+
+    def test_length_delimited(self):
+        """
+        Length delimited messages are delivered however the data is split.
+        """
+        svc, resp, messages, reasons = self._connect(delimited='length')
+        data = (
+            self._frame('{"id_str": "1"}') + '\r\n' +
+            self._frame('{"id_str": "2", "text": "a\\r\\nb"}') +
+            self._frame('{"id_str": "3"}'))
+        for i in range(len(data)):
+            resp.deliver_data(data[i])
+        resp.deliver_data(data)
+        expected = [
+            {"id_str": "1"}, {"id_str": "2", "text": "a\r\nb"},
+            {"id_str": "3"}]
+        self.assertEqual(messages, expected * 2)
+        self.assertEqual(reasons, [])
+
+    def test_length_delimited_too_large(self):
+        """
+        A message larger than the maximum size disconnects the stream with an
+        error, and the stream is reconnected.
+        """
+        from txtwitter.error import MessageTooLargeError
+        svc, resp, messages, reasons = self._connect(
+            delimited='length', max_message_size=17)
+        resp.deliver_data(
+            self._frame('{"id_str": "1"}') + self._frame('{"id_str": "12"}') +
+            self._frame('{"id_str": "3"}'))
+        self.assertEqual(messages, [{"id_str": "1"}])
+        [reason] = reasons
+        reason.trap(MessageTooLargeError)
+        self.assertNotEqual(svc._reconnect_delayedcall, None)
+
+    def test_length_delimited_invalid_length(self):
+        """
+        Data that isn't a length where one is expected disconnects the stream
+        with an error.
+        """
+        from txtwitter.error import StreamFramingError
+        svc, resp, messages, reasons = self._connect(delimited='length')
+        resp.deliver_data('{"id_str": "1"}\r\n')
+        self.assertEqual(messages, [])
+        [reason] = reasons
+        reason.trap(StreamFramingError)
+
+    def test_length_delimited_stopped_by_delegate(self):
+        """
+        No more messages are delivered once the service has been stopped.
+        """
+        d = Deferred()
+        messages = []
+
+        def delegate(message):
+            messages.append(message)
+            svc.stopService()
+        svc = self._TwitterStreamService(
+            lambda: d, delegate, delimited='length')
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        resp.deliver_data(self._frame('{"a": 1}') + self._frame('{"a": 2}'))
+        self.assertEqual(messages, [{"a": 1}])
+
+    def test_line_too_large(self):
+        """
+        A newline delimited message larger than the maximum size disconnects
+        the stream with an error.
+        """
+        from txtwitter.error import MessageTooLargeError
+        svc, resp, messages, reasons = self._connect(max_message_size=20)
+        resp.deliver_data('{"id_str": "1"}\r\n{"id_str": "123456789"}\r\n')
+        self.assertEqual(messages, [{"id_str": "1"}])
+        [reason] = reasons
+        reason.trap(MessageTooLargeError)
+
+    def test_large_line(self):
+        """
+        Messages larger than ``LineOnlyReceiver``'s default limit are accepted.
+        """
+        svc, resp, messages, reasons = self._connect()
+        text = 'x' * 20000
+        resp.deliver_data('{"text": "%s"}\r\n' % (text,))
+        self.assertEqual(messages, [{"text": text}])
+
+
+class TestStallDetection(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, **kw):
+        # Reconnects are immediate, so they get a Deferred that never fires.
+        connect_deferreds = [Deferred()]
+        messages = []
+        reasons = []
+        svc = self._TwitterStreamService(
+            lambda: (connect_deferreds or [Deferred()]).pop(0),
+            messages.append, **kw)
+        svc.set_disconnect_callback(lambda s, r: reasons.append(r))
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        svc._connect_d.callback(resp)
+        return svc, resp, reasons
+
+    def test_stalled(self):
+        """
+        A stream that receives no data for 90 seconds is disconnected as
+        stalled and reconnected.
+        """
+        from txtwitter.error import StreamStalledError
+        svc, resp, reasons = self._connect()
+        svc.clock.advance(89)
+        self.assertEqual(reasons, [])
+        svc.clock.advance(1)
+        [reason] = reasons
+        reason.trap(StreamStalledError)
+        self.assertNotEqual(svc._connect_d, None)
+
+    def test_keep_alive_resets_timer(self):
+        """
+        Any data, including keep-alive newlines, resets the stall timer.
+        """
+        svc, resp, reasons = self._connect()
+        svc.clock.advance(60)
+        resp.deliver_data('\r\n')
+        svc.clock.advance(60)
+        resp.deliver_data('{"a": ')
+        svc.clock.advance(89)
+        self.assertEqual(reasons, [])
+        svc.clock.advance(1)
+        self.assertEqual(len(reasons), 1)
+
+    def test_stalled_length_delimited(self):
+        """
+        Length delimited streams are also checked for stalls.
+        """
+        from txtwitter.error import StreamStalledError
+        svc, resp, reasons = self._connect(delimited='length')
+        svc.clock.advance(60)
+        resp.deliver_data('\r\n')
+        svc.clock.advance(89)
+        self.assertEqual(reasons, [])
+        svc.clock.advance(1)
+        [reason] = reasons
+        reason.trap(StreamStalledError)
+
+    def test_stall_timeout_configurable(self):
+        """
+        The stall timeout can be configured.
+        """
+        svc, resp, reasons = self._connect(stall_timeout=10)
+        svc.clock.advance(10)
+        self.assertEqual(len(reasons), 1)
+
+    def test_stop_service_cancels_timer(self):
+        """
+        Stopping the service cancels the stall timer.
+        """
+        svc, resp, reasons = self._connect()
+        svc.stopService()
+        self.assertEqual(svc.clock.getDelayedCalls(), [])
+        [reason] = reasons
+        reason.trap(ResponseDone)
+
+
+class TestBackpressure(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, delegate, **kw):
+        # Reconnects are immediate, so they get a Deferred that never fires.
+        connect_deferreds = [Deferred()]
+        svc = self._TwitterStreamService(
+            lambda: (connect_deferreds or [Deferred()]).pop(0), delegate, **kw)
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        svc._connect_d.callback(resp)
+        return svc, resp
+
+    def _slow_delegate(self):
+        pending = []
+
+        def delegate(message):
+            d = Deferred()
+            pending.append((message, d))
+            return d
+        return pending, delegate
+
+    def test_window(self):
+        """
+        No more than ``max_in_flight`` messages are handed to the delegate at
+        once, and the stream is paused while the window is full.
+        """
+        pending, delegate = self._slow_delegate()
+        svc, resp = self._connect(delegate, max_in_flight=2)
+        resp.deliver_data('{"a": 1}\r\n')
+        self.assertEqual(resp.paused, False)
+        resp.deliver_data('{"a": 2}\r\n{"a": 3}\r\n{"a": 4}\r\n')
+        self.assertEqual(resp.paused, True)
+        self.assertEqual([m for m, _ in pending], [{"a": 1}, {"a": 2}])
+        self.assertEqual(svc.get_stats()['queued'], 2)
+
+        # Data that arrives while paused is held by the transport.
+        resp.deliver_data('{"a": 5}\r\n')
+        self.assertEqual(svc.get_stats()['queued'], 2)
+
+        pending[0][1].callback(None)
+        self.assertEqual(len(pending), 3)
+        self.assertEqual(resp.paused, True)
+        pending[1][1].callback(None)
+        pending[2][1].callback(None)
+        self.assertEqual(
+            [m for m, _ in pending],
+            [{"a": 1}, {"a": 2}, {"a": 3}, {"a": 4}, {"a": 5}])
+        # The held message has filled the window again.
+        self.assertEqual(resp.paused, True)
+        pending[3][1].callback(None)
+        self.assertEqual(resp.paused, False)
+
+    def test_synchronous_delegate(self):
+        """
+        Delegates that don't return Deferreds are never held back.
+        """
+        messages = []
+        svc, resp = self._connect(messages.append, max_in_flight=1)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n')
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(resp.paused, False)
+
+    def test_fired_deferreds(self):
+        """
+        Delegates that return already fired Deferreds are handled without
+        pausing.
+        """
+        messages = []
+
+        def delegate(message):
+            messages.append(message)
+            return succeed(None)
+        svc, resp = self._connect(delegate, max_in_flight=1)
+        resp.deliver_data('{"a": 1}\r\n' * 1000)
+        self.assertEqual(len(messages), 1000)
+        self.assertEqual(svc.get_stats()['in_flight'], 0)
+
+    def test_delegate_failure_logged(self):
+        """
+        A failed delegate Deferred is logged and frees its slot.
+        """
+        svc, resp = self._connect(
+            lambda message: fail(ZeroDivisionError()), max_in_flight=1)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n')
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 2)
+        self.assertEqual(svc.get_stats()['in_flight'], 0)
+
+    def test_paused_stream_not_stalled(self):
+        """
+        A paused stream isn't disconnected as stalled.
+        """
+        pending, delegate = self._slow_delegate()
+        svc, resp = self._connect(delegate, max_in_flight=1)
+        reasons = []
+        svc.set_disconnect_callback(lambda s, r: reasons.append(r))
+        resp.deliver_data('{"a": 1}\r\n')
+        svc.clock.advance(svc.stall_timeout * 2)
+        self.assertEqual(reasons, [])
+        pending[0][1].callback(None)
+        svc.clock.advance(svc.stall_timeout)
+        self.assertEqual(len(reasons), 1)
+
+    def test_stats(self):
+        """
+        Queue depth and time spent paused are recorded.
+        """
+        pending, delegate = self._slow_delegate()
+        svc, resp = self._connect(delegate, max_in_flight=1)
+        self.assertEqual(svc.get_stats(), {
+            'in_flight': 0,
+            'queued': 0,
+            'max_queued': 0,
+            'decoding': 0,
+            'paused': False,
+            'pauses': 0,
+            'paused_time': 0,
+        })
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n')
+        svc.clock.advance(5)
+        self.assertEqual(svc.get_stats(), {
+            'in_flight': 1,
+            'queued': 2,
+            'max_queued': 2,
+            'decoding': 0,
+            'paused': True,
+            'pauses': 1,
+            'paused_time': 5,
+        })
+        for i in range(3):
+            pending[i][1].callback(None)
+            svc.clock.advance(1)
+        stats = svc.get_stats()
+        self.assertEqual(stats['paused'], False)
+        self.assertEqual(stats['paused_time'], 7)
+
+
+class TestBatching(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, delegate, **kw):
+        d = Deferred()
+        svc = self._TwitterStreamService(lambda: d, delegate, **kw)
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        return svc, resp
+
+    def test_batch_size(self):
+        """
+        A batch is delivered as soon as it is full.
+        """
+        batches = []
+        svc, resp = self._connect(batches.append, batch_size=2)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n')
+        self.assertEqual(batches, [[{"a": 1}, {"a": 2}]])
+
+    def test_batch_latency(self):
+        """
+        A partial batch is delivered once its first message has waited for
+        the maximum latency.
+        """
+        batches = []
+        svc, resp = self._connect(
+            batches.append, batch_size=10, batch_latency=2)
+        resp.deliver_data('{"a": 1}\r\n')
+        svc.clock.advance(1)
+        resp.deliver_data('{"a": 2}\r\n')
+        self.assertEqual(batches, [])
+        svc.clock.advance(1)
+        self.assertEqual(batches, [[{"a": 1}, {"a": 2}]])
+        resp.deliver_data('{"a": 3}\r\n')
+        svc.clock.advance(1.5)
+        self.assertEqual(len(batches), 1)
+        svc.clock.advance(0.5)
+        self.assertEqual(batches, [[{"a": 1}, {"a": 2}], [{"a": 3}]])
+
+    def test_full_batch_cancels_timer(self):
+        """
+        Filling a batch cancels its latency timer.
+        """
+        batches = []
+        svc, resp = self._connect(batches.append, batch_size=2)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n')
+        self.assertEqual(svc._batch_delayedcall, None)
+        # Only the stall timer is left.
+        self.assertEqual(len(svc.clock.getDelayedCalls()), 1)
+
+    def test_batches_in_flight(self):
+        """
+        Each batch counts once against ``max_in_flight``.
+        """
+        pending = []
+
+        def delegate(batch):
+            d = Deferred()
+            pending.append((batch, d))
+            return d
+        svc, resp = self._connect(delegate, batch_size=2, max_in_flight=1)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n{"a": 4}\r\n')
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(resp.paused, True)
+        pending[0][1].callback(None)
+        self.assertEqual(pending[1][0], [{"a": 3}, {"a": 4}])
+
+    def test_flush_on_disconnect(self):
+        """
+        A partial batch is delivered when the connection is lost or the
+        service is stopped.
+        """
+        batches = []
+        svc, resp = self._connect(batches.append, batch_size=10)
+        resp.deliver_data('{"a": 1}\r\n')
+        resp.finished()
+        self.assertEqual(batches, [[{"a": 1}]])
+        svc.stopService()
+        self.assertEqual(svc.clock.getDelayedCalls(), [])
+
+
+class FakeDecoder(object):
+    """
+    A decoder whose batches are decoded when the test says so.
+    """
+
+    def __init__(self, batch_size=3, max_pending=2):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.batches = []
+        self.closed = False
+
+    def decode(self, lines):
+        d = Deferred()
+        self.batches.append((lines, d))
+        return d
+
+    def close(self):
+        self.closed = True
+
+    def finish(self, index):
+        import json
+        lines, d = self.batches[index]
+        d.callback([json.loads(line) for line in lines])
+
+
+class TestDecoder(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, **kw):
+        d = Deferred()
+        messages = []
+        decoder = FakeDecoder(**kw)
+        svc = self._TwitterStreamService(
+            lambda: d, messages.append, decoder=decoder)
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        return svc, resp, decoder, messages
+
+    def test_batch_size(self):
+        """
+        Raw messages are sent to the decoder when a batch is full.
+        """
+        svc, resp, decoder, messages = self._connect()
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n{"a": 4}\r\n')
+        self.assertEqual(
+            [lines for lines, _ in decoder.batches],
+            [['{"a": 1}', '{"a": 2}', '{"a": 3}']])
+        self.assertEqual(messages, [])
+        decoder.finish(0)
+        self.assertEqual(messages, [{"a": 1}, {"a": 2}, {"a": 3}])
+
+    def test_partial_batch(self):
+        """
+        A partial batch is sent to the decoder once the reactor has nothing
+        else to do.
+        """
+        svc, resp, decoder, messages = self._connect()
+        resp.deliver_data('{"a": 1}\r\n')
+        self.assertEqual(decoder.batches, [])
+        svc.clock.advance(0)
+        self.assertEqual(len(decoder.batches), 1)
+
+    def test_order_preserved(self):
+        """
+        Decoded messages are delivered in the order they were received, even
+        if later batches finish decoding first.
+        """
+        svc, resp, decoder, messages = self._connect(
+            batch_size=1, max_pending=10)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n')
+        decoder.finish(2)
+        decoder.finish(1)
+        self.assertEqual(messages, [])
+        decoder.finish(0)
+        self.assertEqual(messages, [{"a": 1}, {"a": 2}, {"a": 3}])
+
+    def test_max_pending(self):
+        """
+        The stream is paused while the decoder has ``max_pending`` batches
+        outstanding.
+        """
+        svc, resp, decoder, messages = self._connect(batch_size=1)
+        resp.deliver_data('{"a": 1}\r\n')
+        self.assertEqual(resp.paused, False)
+        resp.deliver_data('{"a": 2}\r\n')
+        self.assertEqual(resp.paused, True)
+        self.assertEqual(svc.get_stats()['decoding'], 2)
+        decoder.finish(0)
+        self.assertEqual(resp.paused, False)
+        self.assertEqual(messages, [{"a": 1}])
+
+    def test_decode_failure(self):
+        """
+        A batch that fails to decode is logged and skipped.
+        """
+        svc, resp, decoder, messages = self._connect(batch_size=1)
+        resp.deliver_data('{"a": 1}\r\n{"a": 2}\r\n')
+        decoder.batches[0][1].errback(ValueError())
+        decoder.finish(1)
+        self.assertEqual(messages, [{"a": 2}])
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+    def test_decode_on_disconnect(self):
+        """
+        Raw messages are sent to the decoder when the connection is lost.
+        """
+        svc, resp, decoder, messages = self._connect()
+        resp.deliver_data('{"a": 1}\r\n')
+        resp.finished()
+        self.assertEqual(len(decoder.batches), 1)
+        svc.stopService()
+        self.assertEqual(svc.clock.getDelayedCalls(), [])
+
+    def test_stop_service_closes_decoder(self):
+        """
+        Stopping the service drops messages that haven't been decoded yet,
+        cancels the batches being decoded, and closes the decoder.
+        """
+        svc, resp, decoder, messages = self._connect()
+        resp.deliver_data(
+            '{"a": 1}\r\n{"a": 2}\r\n{"a": 3}\r\n{"a": 4}\r\n')
+        svc.stopService()
+        self.assertEqual(len(decoder.batches), 1)
+        self.assertEqual(decoder.batches[0][1].called, True)
+        self.assertEqual(decoder.closed, True)
+        self.assertEqual(svc.get_stats()['decoding'], 0)
+        svc.clock.advance(0)
+        self.assertEqual(len(decoder.batches), 1)
+        self.assertEqual(messages, [])
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+
+class TestEnvelopes(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def test_envelopes(self):
+        """
+        In envelope mode, the delegate receives undecoded envelopes.
+        """
+        d = Deferred()
+        messages = []
+        svc = self._TwitterStreamService(
+            lambda: d, messages.append, envelopes=True)
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        d.callback(resp)
+        resp.deliver_data('{"limit": {"track": 5}}\r\n{"id_str": "1"}\r\n')
+        [limit, other] = messages
+        self.assertEqual(limit.kind, 'limit')
+        self.assertEqual(limit.decoded, False)
+        self.assertEqual(other['id_str'], '1')
+
+
+class TestBackfill(TestCase):
+    _TwitterStreamService = from_streamservice('TwitterStreamService')
+
+    def _connect(self, **kw):
+        from txtwitter.backfill import StreamBackfill
+        from txtwitter.tests.test_backfill import FakeClient
+        attempts = []
+
+        def connect():
+            attempts.append(Deferred())
+            return attempts[-1]
+
+        client = FakeClient()
+        messages = []
+        svc = self._TwitterStreamService(
+            connect, messages.append,
+            backfill=StreamBackfill(client, **kw))
+        svc.clock = Clock()
+        svc.startService()
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        return svc, client, attempts, resp, messages
+
+    def test_backfill_on_reconnect(self):
+        """
+        After a reconnect, the gap is backfilled into the delegate without
+        repeating messages the stream delivers itself.
+        """
+        svc, client, attempts, resp, messages = self._connect()
+        resp.deliver_data('{"id_str": "10", "text": "", "user": {}}\r\n')
+        self.assertEqual(client.requests, [])
+
+        resp.finished()
+        svc.clock.advance(0)
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        self.assertEqual(client.requests, [])
+
+        # The first message establishes the connection, and starts the
+        # backfill before it is recorded.
+        resp.deliver_data('{"id_str": "12", "text": "", "user": {}}\r\n')
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '10')
+        client.respond([
+            {"id_str": "12", "text": "", "user": {}},
+            {"id_str": "11", "text": "", "user": {}},
+        ])
+        resp.deliver_data('{"id_str": "13", "text": "", "user": {}}\r\n')
+        self.assertEqual(
+            [message['id_str'] for message in messages],
+            ['10', '12', '11', '13'])
+        svc.stopService()
+
+    def test_backfill_before_buffered_data(self):
+        """
+        Messages the new connection delivers as soon as it is set up don't
+        move the start of the backfill past the gap.
+        """
+        svc, client, attempts, resp, messages = self._connect()
+        resp.deliver_data('{"id_str": "10", "text": "", "user": {}}\r\n')
+        resp.finished()
+        svc.clock.advance(0)
+
+        # This is delivered synchronously by deliverBody().
+        resp = FakeResponse(
+            '{"id_str": "12", "text": "", "user": {}}\r\n')
+        attempts[-1].callback(resp)
+        self.assertEqual(
+            [message['id_str'] for message in messages], ['10', '12'])
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '10')
+        client.respond([
+            {"id_str": "12", "text": "", "user": {}},
+            {"id_str": "11", "text": "", "user": {}},
+        ])
+        self.assertEqual(
+            [message['id_str'] for message in messages], ['10', '12', '11'])
+        svc.stopService()
+
+    def test_stop_service_stops_backfill(self):
+        """
+        Stopping the service cancels any backfill in progress.
+        """
+        svc, client, attempts, resp, messages = self._connect()
+        resp.deliver_data('{"id_str": "10", "text": "", "user": {}}\r\n')
+        resp.finished()
+        svc.clock.advance(0)
+        attempts[-1].callback(FakeResponse(None))
+        svc.clock.advance(svc.RECONNECT_RESET_UPTIME)
+        self.assertEqual(len(client.requests), 1)
+        svc.stopService()
+        self.assertEqual(client.cancelled, ['mentions'])
+
+    def test_backfill_after_uptime(self):
+        """
+        A quiet connection is established, and the backfill started, once it
+        has been up for ``RECONNECT_RESET_UPTIME`` seconds.
+        """
+        svc, client, attempts, resp, messages = self._connect()
+        resp.deliver_data('{"id_str": "10", "text": "", "user": {}}\r\n')
+        resp.finished()
+        svc.clock.advance(0)
+        attempts[-1].callback(FakeResponse(None))
+        svc.clock.advance(svc.RECONNECT_RESET_UPTIME - 1)
+        self.assertEqual(client.requests, [])
+        svc.clock.advance(1)
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '10')
+        svc.stopService()
+
+    def test_no_backfill_while_flapping(self):
+        """
+        Connections that drop before they are established don't start
+        backfills, and only one is started once a connection is established.
+        """
+        svc, client, attempts, resp, messages = self._connect()
+        resp.deliver_data('{"id_str": "10", "text": "", "user": {}}\r\n')
+        resp.finished()
+        for _ in range(10):
+            svc.clock.advance(svc.reconnect_delay)
+            resp = FakeResponse(None)
+            attempts[-1].callback(resp)
+            resp.finished()
+        self.assertEqual(client.requests, [])
+        svc.clock.advance(svc.reconnect_delay)
+        resp = FakeResponse(None)
+        attempts[-1].callback(resp)
+        resp.deliver_data('{"id_str": "12", "text": "", "user": {}}\r\n')
+        [(method, kw, _)] = client.requests
+        self.assertEqual(kw['since_id'], '10')
+        self.assertEqual(svc.backfill.get_stats()['backfills'], 1)
+        svc.stopService()
+        self.assertEqual(svc.clock.getDelayedCalls(), [])
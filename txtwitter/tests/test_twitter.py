@@ -1,6 +1,7 @@
 import json
 
 from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
 from txtwitter.tests.fake_agent import FakeAgent, FakeResponse
@@ -281,6 +282,504 @@ class TestTwitterClient(TestCase):
             agent=agent)
         return agent, client
 
+    # Connection pooling
+
+    def test_default_agent_no_pool(self):
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret')
+        self.assertEqual(client._agent._pool.persistent, False)
+
+    def test_default_agent_with_pool(self):
+        from txtwitter.pool import TwitterConnectionPool
+        pool = TwitterConnectionPool(Clock())
+        client1 = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            pool=pool)
+        client2 = self._TwitterClient(
+            'token-key2', 'token-secret2', 'consumer-key', 'consumer-secret',
+            pool=pool)
+        self.assertIs(client1._agent._pool, pool)
+        self.assertIs(client2._agent._pool, pool)
+
+    @inlineCallbacks
+    def test_warm_up_connections(self):
+        agent = FakeAgent(persistent=True)
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent)
+        agent.add_expected_request(
+            'HEAD', 'https://api.twitter.com/1.1/', {}, FakeResponse(''))
+        yield client.warm_up_connections(1)
+        self.assertEqual(agent.connections_opened, 1)
+        self.assertEqual(agent.idle_connections(), 1)
+
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        yield client.statuses_show("123")
+        self.assertEqual(agent.connections_opened, 1)
+        self.assertEqual(agent.connections_reused, 1)
+
+    @inlineCallbacks
+    def test_connection_reused_between_calls(self):
+        agent = FakeAgent(persistent=True)
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        agent.add_expected_request(
+            'GET', uri, {'id': '124'}, self._resp_json({"id_str": "124"}))
+        yield client.statuses_show("123")
+        yield client.statuses_show("124")
+        self.assertEqual(agent.connections_opened, 1)
+        self.assertEqual(agent.connections_reused, 1)
+
+    # JSON codecs
+
+    @inlineCallbacks
+    def test_codec(self):
+        from txtwitter.codec import JSONCodec
+        agent = FakeAgent()
+        codec = JSONCodec('fake', lambda body: ('decoded', body), None)
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, codec=codec)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, FakeResponse('{"id_str": "123"}'))
+        resp = yield client.statuses_show("123")
+        self.assertEqual(resp, ('decoded', '{"id_str": "123"}'))
+
+    def test_codec_passed_to_stream(self):
+        from txtwitter.codec import JSONCodec
+        codec = JSONCodec('fake', None, None)
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=FakeAgent(), codec=codec)
+        svc = client.stream_filter(lambda msg: None, track=['foo'])
+        self.assertIs(svc.codec, codec)
+
+    # Rate limits
+
+    def _rate_limited_response(self, data, remaining, reset, code=200):
+        resp = self._resp_json(data, code)
+        resp.headers.setRawHeaders('x-rate-limit-limit', ['180'])
+        resp.headers.setRawHeaders('x-rate-limit-remaining', [str(remaining)])
+        resp.headers.setRawHeaders('x-rate-limit-reset', [str(reset)])
+        return resp
+
+    @inlineCallbacks
+    def test_rate_limit_recorded(self):
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        self.assertEqual(client.rate_limit('statuses/show.json'), None)
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'},
+            self._rate_limited_response({"id_str": "123"}, 179, 1000))
+        yield client.statuses_show("123")
+        rate_limit = client.rate_limit('statuses/show.json')
+        self.assertEqual(rate_limit.limit, 180)
+        self.assertEqual(rate_limit.remaining, 179)
+        self.assertEqual(rate_limit.reset, 1000)
+        self.assertEqual(
+            client.rate_limit('statuses/home_timeline.json'), None)
+        self.assertEqual(
+            client.rate_limits.get('token-key', uri).remaining, 179)
+
+    @inlineCallbacks
+    def test_time_until_allowed(self):
+        from txtwitter.ratelimit import RateLimitTracker
+        clock = Clock()
+        clock.advance(400)
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, rate_limits=RateLimitTracker(clock))
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'},
+            self._rate_limited_response({"id_str": "123"}, 0, 1000))
+        self.assertEqual(client.time_until_allowed('statuses/show.json'), 0)
+        yield client.statuses_show("123")
+        self.assertEqual(client.time_until_allowed('statuses/show.json'), 600)
+
+    @inlineCallbacks
+    def test_rate_limit_exceeded(self):
+        from txtwitter.error import RateLimitedError
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._rate_limited_response(
+                {"errors": [{"code": 88}]}, 0, 1000, code=429))
+        err = yield self.assertFailure(
+            client.statuses_show("123"), RateLimitedError)
+        self.assertEqual(err.status, '429')
+        self.assertEqual(
+            client.rate_limit('statuses/show.json').remaining, 0)
+
+    # Scheduling
+
+    def test_scheduler(self):
+        from txtwitter.scheduler import PRIORITY_HIGH, RequestScheduler
+        clock = Clock()
+        clock.advance(100)
+        scheduler = RequestScheduler(clock=clock)
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, scheduler=scheduler)
+        self.assertIs(client.rate_limits, scheduler.rate_limits)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        for id_str, reset in [('1', 1000), ('2', 1900), ('3', 1900)]:
+            agent.add_expected_request(
+                'GET', uri, {'id': id_str}, self._rate_limited_response(
+                    {"id_str": id_str}, 0, reset))
+
+        d1 = client.statuses_show('1')
+        self.assertEqual(self.successResultOf(d1), {"id_str": "1"})
+        d2 = client.statuses_show('2')
+        d3 = client.with_priority(PRIORITY_HIGH).statuses_show('3')
+        self.assertNoResult(d2)
+        self.assertNoResult(d3)
+        self.assertEqual(scheduler.queue_depth(), 2)
+
+        clock.advance(900)
+        self.assertEqual(self.successResultOf(d3), {"id_str": "3"})
+        self.assertNoResult(d2)
+        self.assertEqual(
+            client.time_until_allowed('statuses/show.json'), 900)
+        clock.advance(900)
+        self.assertEqual(self.successResultOf(d2), {"id_str": "2"})
+
+    @inlineCallbacks
+    def test_scheduler_not_used_for_streams(self):
+        from txtwitter.scheduler import RequestScheduler
+        scheduler = RequestScheduler(clock=Clock(), max_concurrent=0)
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, scheduler=scheduler)
+        uri = 'https://stream.twitter.com/1.1/statuses/filter.json'
+        stream = FakeResponse(None)
+        agent.add_expected_request('POST', uri, {'track': 'foo'}, stream)
+
+        connected = Deferred()
+        svc = client.stream_filter(lambda tweet: None, track=['foo'])
+        svc.set_connect_callback(connected.callback)
+        svc.startService()
+        yield connected
+        self.assertEqual(scheduler.get_stats()['submitted'], 0)
+        yield svc.stopService()
+
+    def test_with_priority(self):
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=FakeAgent())
+        high = client.with_priority(0)
+        self.assertEqual(high._priority, 0)
+        self.assertNotEqual(client._priority, 0)
+        self.assertIs(high._agent, client._agent)
+        self.assertIs(high.rate_limits, client.rate_limits)
+
+    # Request coalescing
+
+    def test_coalesce_requests(self):
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, coalesce_requests=True)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        response_d = Deferred()
+        agent.add_expected_request('GET', uri, {'id': '123'}, response_d)
+        d1 = client.statuses_show('123')
+        d2 = client.statuses_show('123')
+        self.assertEqual(client.coalescer.coalesced, 1)
+        response_d.callback(self._resp_json({"id_str": "123"}))
+        result1 = self.successResultOf(d1)
+        result2 = self.successResultOf(d2)
+        self.assertEqual(result1, {"id_str": "123"})
+        self.assertIs(result1, result2)
+
+    def test_coalesce_requests_different_params(self):
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, coalesce_requests=True)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request('GET', uri, {'id': '123'}, Deferred())
+        agent.add_expected_request(
+            'GET', uri, {'id': '123', 'trim_user': 'true'}, Deferred())
+        client.statuses_show('123')
+        client.statuses_show('123', trim_user=True)
+        self.assertEqual(client.coalescer.coalesced, 0)
+        self.assertEqual(client.coalescer.in_flight(), 2)
+
+    def test_no_coalescing_by_default(self):
+        agent, client = self._agent_and_TwitterClient()
+        self.assertEqual(client.coalescer, None)
+
+    # Response caching
+
+    def _cached_client(self):
+        from txtwitter.cache import ResponseCache
+        clock = Clock()
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, cache=ResponseCache(clock=clock))
+        return clock, agent, client
+
+    def test_cache(self):
+        clock, agent, client = self._cached_client()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        d1 = client.statuses_show('123')
+        self.assertEqual(self.successResultOf(d1), {"id_str": "123"})
+
+        # The next response would be different, but we shouldn't see it until
+        # the cached one has expired.
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'},
+            self._resp_json({"id_str": "123", "text": "new"}))
+        d2 = client.statuses_show('123')
+        self.assertEqual(self.successResultOf(d2), {"id_str": "123"})
+        self.assertEqual(client.cache.hits, 1)
+
+        clock.advance(60)
+        d3 = client.statuses_show('123')
+        self.assertEqual(
+            self.successResultOf(d3), {"id_str": "123", "text": "new"})
+
+    def test_cache_uncacheable(self):
+        clock, agent, client = self._cached_client()
+        uri = 'https://api.twitter.com/1.1/statuses/home_timeline.json'
+        agent.add_expected_request('GET', uri, {}, self._resp_json([]))
+        self.successResultOf(client.statuses_home_timeline())
+        self.assertEqual(len(client.cache), 0)
+
+    @inlineCallbacks
+    def test_cache_invalidated_by_statuses_destroy(self):
+        clock, agent, client = self._cached_client()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        self.successResultOf(client.statuses_show('123'))
+        self.assertEqual(len(client.cache), 1)
+
+        agent.add_expected_request(
+            'POST', 'https://api.twitter.com/1.1/statuses/destroy.json',
+            {'id': '123'}, self._resp_json({"id_str": "123"}))
+        yield client.statuses_destroy('123')
+        self.assertEqual(len(client.cache), 0)
+
+    def test_cache_shared_between_tokens(self):
+        clock, agent, client = self._cached_client()
+        other = self._TwitterClient(
+            'other-key', 'other-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, cache=client.cache)
+        uri = 'https://api.twitter.com/1.1/direct_messages/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '1'}, self._resp_json([{"text": "mine"}]))
+        self.successResultOf(client.direct_messages_show('1'))
+        agent.add_expected_request(
+            'GET', uri, {'id': '1'}, self._resp_json([{"text": "theirs"}]))
+        self.assertEqual(
+            self.successResultOf(other.direct_messages_show('1')),
+            {"text": "theirs"})
+        self.assertEqual(
+            self.successResultOf(client.direct_messages_show('1')),
+            {"text": "mine"})
+
+    @inlineCallbacks
+    def test_cache_invalidated_by_statuses_destroy_int_id(self):
+        clock, agent, client = self._cached_client()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        self.successResultOf(client.statuses_show('123'))
+
+        agent.add_expected_request(
+            'POST', 'https://api.twitter.com/1.1/statuses/destroy.json',
+            {'id': '123'}, self._resp_json({"id_str": "123"}))
+        yield client.statuses_destroy(123)
+        self.assertEqual(len(client.cache), 0)
+
+    @inlineCallbacks
+    def test_cache_invalidated_by_friendships_destroy(self):
+        clock, agent, client = self._cached_client()
+        client.cache.ttls['users/show.json'] = 60
+        client.cache.set('users/show.json', {'user_id': '1'}, {"id_str": "1"})
+        client.cache.set('users/show.json', {'user_id': '2'}, {"id_str": "2"})
+        agent.add_expected_request(
+            'POST', 'https://api.twitter.com/1.1/friendships/destroy.json',
+            {'user_id': '1'}, self._resp_json({"id_str": "1"}))
+        yield client.friendships_destroy(user_id='1')
+        self.assertEqual(
+            client.cache.get('users/show.json', {'user_id': '1'}), None)
+        self.assertEqual(
+            client.cache.get('users/show.json', {'user_id': '2'}),
+            {"id_str": "2"})
+
+    # Retries
+
+    def test_retry_policy(self):
+        from txtwitter.retry import RetryPolicy
+        clock = Clock()
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, retry_policy=RetryPolicy(jitter=False, clock=clock))
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({}, code=503))
+        d = client.statuses_show('123')
+        self.assertNoResult(d)
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        clock.advance(1)
+        self.assertEqual(self.successResultOf(d), {"id_str": "123"})
+
+    def test_retry_policy_honours_rate_limit(self):
+        from txtwitter.retry import RetryPolicy
+        clock = Clock()
+        clock.advance(100)
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, retry_policy=RetryPolicy(jitter=False, clock=clock))
+        client.rate_limits.clock = clock
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'},
+            self._rate_limited_response({}, 0, 400, code=429))
+        d = client.statuses_show('123')
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, self._resp_json({"id_str": "123"}))
+        clock.advance(299)
+        self.assertNoResult(d)
+        clock.advance(1)
+        self.assertEqual(self.successResultOf(d), {"id_str": "123"})
+
+    # Timeouts
+
+    def _timeout_client(self, **kw):
+        clock = Clock()
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, **kw)
+        client.reactor = clock
+        return clock, agent, client
+
+    def test_timeout_waiting_for_response(self):
+        from txtwitter.error import RequestTimeoutError
+        clock, agent, client = self._timeout_client(timeout=10)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        cancelled = []
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, Deferred(cancelled.append))
+        d = client.statuses_show('123')
+        self.assertEqual(client.pending_requests(), 1)
+        clock.advance(9)
+        self.assertNoResult(d)
+        clock.advance(1)
+        self.failureResultOf(d, RequestTimeoutError)
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(client.pending_requests(), 0)
+
+    def test_timeout_reading_body(self):
+        from twisted.internet.error import TimeoutError
+        clock, agent, client = self._timeout_client(timeout=10)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        response = FakeResponse(None)
+        reasons = []
+        response.finished_callback = reasons.append
+        agent.add_expected_request('GET', uri, {'id': '123'}, response)
+        d = client.statuses_show('123')
+        response.deliver_data('{"id_str": ')
+        clock.advance(10)
+        # RequestTimeoutError is a subclass of Twisted's TimeoutError.
+        self.failureResultOf(d, TimeoutError)
+        self.assertEqual(len(reasons), 1)
+        self.assertEqual(client.pending_requests(), 0)
+
+    def test_timeout_delegate(self):
+        from txtwitter.error import RequestTimeoutError
+        clock, agent, client = self._timeout_client(timeout=10)
+        uri = 'https://api.twitter.com/1.1/statuses/home_timeline.json'
+        response = FakeResponse(None)
+        agent.add_expected_request('GET', uri, {}, response)
+        items = []
+        d = client.statuses_home_timeline(delegate=items.append)
+        response.deliver_data('[{"id_str": "1"}, {"id_str": ')
+        clock.advance(10)
+        self.failureResultOf(d, RequestTimeoutError)
+        self.assertEqual(items, [{"id_str": "1"}])
+
+    def test_with_timeout(self):
+        from txtwitter.error import RequestTimeoutError
+        clock, agent, client = self._timeout_client()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        agent.add_expected_request('GET', uri, {'id': '123'}, Deferred())
+        agent.add_expected_request('GET', uri, {'id': '124'}, Deferred())
+        d1 = client.statuses_show('123')
+        d2 = client.with_timeout(5).statuses_show('124')
+        self.assertEqual(client.pending_requests(), 2)
+        clock.advance(5)
+        self.failureResultOf(d2, RequestTimeoutError)
+        self.assertNoResult(d1)
+        self.assertEqual(client.pending_requests(), 1)
+        d1.cancel()
+        self.assertEqual(client.pending_requests(), 0)
+        self.failureResultOf(d1)
+
+    def test_pending_requests(self):
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        response_d = Deferred()
+        agent.add_expected_request('GET', uri, {'id': '123'}, response_d)
+        self.assertEqual(client.pending_requests(), 0)
+        d = client.statuses_show('123')
+        self.assertEqual(client.pending_requests(), 1)
+        response_d.callback(self._resp_json({"id_str": "123"}))
+        self.successResultOf(d)
+        self.assertEqual(client.pending_requests(), 0)
+
+    # Compression
+
+    def test_compress(self):
+        import zlib
+        from twisted.web.http_headers import Headers
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, compress=True)
+        uri = 'https://api.twitter.com/1.1/statuses/show.json'
+        body = json.dumps({"id_str": "123", "text": "Tweet! " * 50})
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(body) + compressor.flush()
+        agent.add_expected_request(
+            'GET', uri, {'id': '123'}, FakeResponse(
+                compressed, headers=Headers({'content-encoding': ['gzip']})))
+        d = client.statuses_show('123')
+        self.assertEqual(self.successResultOf(d), json.loads(body))
+        self.assertEqual(client.compression_stats.get_stats(), {
+            'responses': 1,
+            'compressed_responses': 1,
+            'wire_bytes': len(compressed),
+            'decoded_bytes': len(body),
+            'ratio': float(len(compressed)) / len(body),
+        })
+        # Streams use the uncompressed agent.
+        self.assertEqual(client._agent, agent)
+
+    def test_compress_off(self):
+        agent, client = self._agent_and_TwitterClient()
+        self.assertEqual(client.compression_stats, None)
+
     # Timelines
 
     @inlineCallbacks
@@ -397,6 +896,35 @@ class TestTwitterClient(TestCase):
         resp = yield client.statuses_home_timeline()
         self.assertEqual(resp, response_list)
 
+    def test_statuses_home_timeline_delegate(self):
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://api.twitter.com/1.1/statuses/home_timeline.json'
+        resp = FakeResponse(None)
+        agent.add_expected_request('GET', uri, {}, resp)
+        tweets = []
+        d = client.statuses_home_timeline(delegate=tweets.append)
+        resp.deliver_data('[{"id_str": "123", "text": "Tweet!"}, ')
+        self.assertEqual(tweets, [{"id_str": "123", "text": "Tweet!"}])
+        resp.deliver_data('{"id_str": "122", "text": "Tweet!"}]')
+        self.assertNoResult(d)
+        resp.finished()
+        self.assertEqual(self.successResultOf(d), 2)
+        self.assertEqual(tweets, [
+            {"id_str": "123", "text": "Tweet!"},
+            {"id_str": "122", "text": "Tweet!"},
+        ])
+
+    def test_statuses_home_timeline_delegate_unexpected_response(self):
+        from txtwitter.error import TwitterAPIError
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://api.twitter.com/1.1/statuses/home_timeline.json'
+        agent.add_expected_request('GET', uri, {}, FakeResponse('', 204))
+        tweets = []
+        d = client.statuses_home_timeline(delegate=tweets.append)
+        failure = self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(failure.value.status, '204')
+        self.assertEqual(tweets, [])
+
     @inlineCallbacks
     def test_statuses_home_timeline_all_params(self):
         agent, client = self._agent_and_TwitterClient()
@@ -698,6 +1226,19 @@ class TestTwitterClient(TestCase):
         resp = yield client.media_upload(media, additional_owners=[1, 2])
         self.assertEqual(resp, response_dict)
 
+    def test_media_upload_scheduled(self):
+        from txtwitter.scheduler import RequestScheduler
+        scheduler = RequestScheduler(clock=Clock(), max_concurrent=0)
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=FakeAgent(), scheduler=scheduler)
+        d = client.media_upload(FakeImage('image', 'raw_binary_content'))
+        self.assertNoResult(d)
+        self.assertEqual(scheduler.queue_depth(
+            endpoint='https://upload.twitter.com/1.1/media/upload.json'), 1)
+        d.cancel()
+        self.failureResultOf(d)
+
     # TODO: Tests for statuses_update_with_media()
     # TODO: Tests for statuses_oembed()
     # TODO: Tests for statuses_retweeters_ids()
@@ -761,6 +1302,107 @@ class TestTwitterClient(TestCase):
         yield svc.stopService()
         stream.finished()
 
+    def test_stream_compressed(self):
+        import zlib
+        from twisted.web.http_headers import Headers
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, compress_streams=True)
+        uri = 'https://userstream.twitter.com/1.1/user.json'
+        params = {'stringify_friend_ids': 'true', 'with': 'followings'}
+
+        def gzip_stream():
+            response = FakeResponse(None, headers=Headers(
+                {'content-encoding': ['gzip']}))
+            agent.add_expected_request('GET', uri, params, response)
+            compressor = zlib.compressobj(
+                9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+            def frame(data):
+                return (compressor.compress(data) +
+                        compressor.flush(zlib.Z_SYNC_FLUSH))
+            return response, frame
+
+        tweets = []
+        svc = client.userstream_user(tweets.append)
+        svc.clock = Clock()
+        stream1, frame1 = gzip_stream()
+        svc.startService()
+
+        data1 = frame1('{"id_str": "1"}\r\n')
+        for i in range(len(data1)):
+            stream1.deliver_data(data1[i])
+        self.assertEqual(tweets, [{"id_str": "1"}])
+
+        # The connection drops partway through a compressed frame.
+        data2 = frame1('{"id_str": "2"}\r\n')[:-8]
+        stream1.deliver_data(data2)
+        stream2, frame2 = gzip_stream()
+        stream1.finished()
+        svc.clock.advance(svc.reconnect_delay)
+
+        data3 = frame2('{"id_str": "3"}\r\n')
+        stream2.deliver_data(data3)
+        self.assertEqual(tweets, [{"id_str": "1"}, {"id_str": "3"}])
+
+        stats = client.stream_compression_stats.get_stats()
+        self.assertEqual(stats['responses'], 2)
+        self.assertEqual(stats['compressed_responses'], 2)
+        self.assertEqual(
+            stats['wire_bytes'], len(data1) + len(data2) + len(data3))
+        self.assertEqual(client.compression_stats, None)
+        svc.stopService()
+
+    def test_stream_uncompressed_by_default(self):
+        agent = FakeAgent()
+        client = self._TwitterClient(
+            'token-key', 'token-secret', 'consumer-key', 'consumer-secret',
+            agent=agent, compress=True)
+        self.assertEqual(client.stream_compression_stats, None)
+        self.assertIs(client._stream_agent, agent)
+
+    @inlineCallbacks
+    def test_stream_filter_length_delimited(self):
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://stream.twitter.com/1.1/statuses/filter.json'
+        stream = FakeResponse(None)
+        agent.add_expected_request(
+            'POST', uri, {'track': 'foo', 'delimited': 'length'}, stream)
+
+        connected = Deferred()
+        tweets = []
+        svc = client.stream_filter(
+            tweets.append, track=['foo'], delimited='length')
+        self.assertEqual(svc.delimited, 'length')
+        svc.set_connect_callback(connected.callback)
+        svc.startService()
+        yield connected
+        stream.deliver_data('17\r\n{"id_str": "1"}\r\n')
+        self.assertEqual(tweets, [{"id_str": "1"}])
+        yield svc.stopService()
+
+    @inlineCallbacks
+    def test_stream_filter_rate_limited(self):
+        from txtwitter.error import RateLimitedError
+        agent, client = self._agent_and_TwitterClient()
+        uri = 'https://stream.twitter.com/1.1/statuses/filter.json'
+        agent.add_expected_request(
+            'POST', uri, {'track': 'foo'}, FakeResponse('', 420))
+
+        disconnected = Deferred()
+        reasons = []
+        svc = client.stream_filter(lambda tweet: None, track=['foo'])
+        svc.clock = Clock()
+        svc.set_disconnect_callback(
+            lambda svc, reason: disconnected.callback(reasons.append(reason)))
+        svc.startService()
+        yield disconnected
+        [reason] = reasons
+        self.assertTrue(reason.check(RateLimitedError))
+        self.assertEqual(svc.reconnect_delay, 60)
+        yield svc.stopService()
+
     # TODO: Tests for stream_sample()
     # TODO: Tests for stream_firehose()
 
@@ -823,6 +1465,13 @@ class TestTwitterClient(TestCase):
         yield svc.stopService()
         stream.finished()
 
+    def test_userstream_user_backfill(self):
+        from txtwitter.backfill import StreamBackfill
+        agent, client = self._agent_and_TwitterClient()
+        backfill = StreamBackfill(client, direct_messages=True)
+        svc = client.userstream_user(lambda msg: None, backfill=backfill)
+        self.assertIs(svc.backfill, backfill)
+
     # Direct Messages
 
     @inlineCallbacks
@@ -0,0 +1,242 @@
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from txtwitter.error import TwitterAPIError
+from txtwitter.retry import RetryPolicy
+from txtwitter.tests.fake_twitter import FakeMediaFile
+
+
+def from_upload(name):
+    @property
+    def prop(self):
+        from txtwitter import upload
+        return getattr(upload, name)
+    return prop
+
+
+class StubUploadClient(object):
+    """
+    A client that records APPEND requests and lets the test fire them.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.clock = Clock()
+        self.retry_policy = RetryPolicy(jitter=False, clock=self.clock)
+        self.rate_limit_wait = 0
+
+    def _upload_time_until_allowed(self, resource):
+        return self.rate_limit_wait
+
+    def _upload_media(self, uri, media, params, parse=True):
+        d = Deferred()
+        self.requests.append((int(params['segment_index']), media.read(), d))
+        return d
+
+    def pending_indexes(self):
+        return [index for index, _, d in self.requests if not d.called]
+
+    def respond(self, index, result=None):
+        for req_index, _, d in self.requests:
+            if req_index == index and not d.called:
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+                return
+        raise AssertionError("No pending request for segment %s" % (index,))
+
+
+class TestChunkedUploader(TestCase):
+    _ChunkedUploader = from_upload('ChunkedUploader')
+
+    def make_uploader(self, content, segment_size=10, max_concurrent=2,
+                      max_retries=1, progress_callback=None):
+        client = StubUploadClient()
+        uploader = self._ChunkedUploader(
+            client, FakeMediaFile('video.mp4', content), '123', len(content),
+            segment_size, max_concurrent, max_retries, progress_callback)
+        return client, uploader
+
+    def test_concurrency_limit(self):
+        """
+        No more than ``max_concurrent`` segments should be in flight.
+        """
+        client, uploader = self.make_uploader('a' * 45, max_concurrent=2)
+        d = uploader.start()
+        self.assertEqual(client.pending_indexes(), [0, 1])
+        client.respond(1)
+        self.assertEqual(client.pending_indexes(), [0, 2])
+        client.respond(0)
+        client.respond(2)
+        self.assertEqual(client.pending_indexes(), [3, 4])
+        client.respond(3)
+        self.assertNoResult(d)
+        client.respond(4)
+        self.assertEqual(self.successResultOf(d), None)
+        self.assertEqual(
+            [(index, len(data)) for index, data, _ in client.requests],
+            [(0, 10), (1, 10), (2, 10), (3, 10), (4, 5)])
+
+    def test_progress(self):
+        """
+        The progress callback should be called after each segment.
+        """
+        progress = []
+        client, uploader = self.make_uploader(
+            'a' * 25, progress_callback=(
+                lambda sent, total: progress.append((sent, total))))
+        uploader.start()
+        client.respond(1)
+        client.respond(0)
+        client.respond(2)
+        self.assertEqual(progress, [(10, 25), (20, 25), (25, 25)])
+        self.assertEqual(uploader.bytes_uploaded, 25)
+
+    def test_empty(self):
+        """
+        An empty file should complete immediately.
+        """
+        client, uploader = self.make_uploader('')
+        self.assertEqual(self.successResultOf(uploader.start()), None)
+        self.assertEqual(client.requests, [])
+
+    def test_retry_segment(self):
+        """
+        A segment that fails with a retryable error should be resent without
+        affecting the other segments.
+        """
+        client, uploader = self.make_uploader('0123456789abcdefghij')
+        d = uploader.start()
+        client.respond(1, Failure(TwitterAPIError(503)))
+        self.assertEqual(client.pending_indexes(), [0])
+        client.clock.advance(1)
+        self.assertEqual(client.pending_indexes(), [0, 1])
+        client.respond(0)
+        client.respond(1)
+        self.successResultOf(d)
+        self.assertEqual(uploader.retries, 1)
+        self.assertEqual(
+            [(index, data) for index, data, _ in client.requests],
+            [(0, '0123456789'), (1, 'abcdefghij'), (1, 'abcdefghij')])
+
+    def test_retries_exhausted(self):
+        """
+        The upload should fail once a segment has used up its retries, after
+        waiting for in-flight segments.
+        """
+        client, uploader = self.make_uploader('a' * 40, max_retries=1)
+        d = uploader.start()
+        client.respond(1, Failure(TwitterAPIError(503)))
+        client.clock.advance(1)
+        client.respond(1, Failure(TwitterAPIError(503)))
+        self.assertEqual(client.pending_indexes(), [0])
+        self.assertNoResult(d)
+        client.respond(0)
+        failure = self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(failure.value.status, '503')
+        self.assertEqual(client.pending_indexes(), [])
+
+    def test_retry_backoff(self):
+        """
+        Each retry of a segment should wait longer than the last, following
+        the client's retry policy.
+        """
+        client, uploader = self.make_uploader('a' * 10, max_retries=3)
+        uploader.start()
+        for delay in [1, 2, 4]:
+            client.respond(0, Failure(TwitterAPIError(503)))
+            client.clock.advance(delay - 0.1)
+            self.assertEqual(client.pending_indexes(), [])
+            client.clock.advance(0.1)
+            self.assertEqual(client.pending_indexes(), [0])
+
+    def test_retry_waits_for_rate_limit(self):
+        """
+        A retry should wait until the rate limit allows it, if that is longer
+        than the backoff delay.
+        """
+        client, uploader = self.make_uploader('a' * 10)
+        uploader.start()
+        client.rate_limit_wait = 30
+        client.respond(0, Failure(TwitterAPIError(429)))
+        client.clock.advance(29)
+        self.assertEqual(client.pending_indexes(), [])
+        client.clock.advance(1)
+        self.assertEqual(client.pending_indexes(), [0])
+
+    def test_failure_abandons_waiting_retries(self):
+        """
+        When the upload fails, segments waiting to be retried should not be
+        sent.
+        """
+        client, uploader = self.make_uploader('a' * 20)
+        d = uploader.start()
+        client.respond(0, Failure(TwitterAPIError(503)))
+        client.respond(1, Failure(TwitterAPIError(400)))
+        self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(client.clock.getDelayedCalls(), [])
+
+    def test_non_retryable_failure(self):
+        """
+        A segment that fails with a non-retryable error should not be resent.
+        """
+        client, uploader = self.make_uploader('a' * 10)
+        d = uploader.start()
+        client.respond(0, Failure(TwitterAPIError(400)))
+        self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(uploader.retries, 0)
+
+    def test_retry_policy_decides(self):
+        """
+        Only failures the client's retry policy considers retryable should be
+        retried.
+        """
+        client, uploader = self.make_uploader('a' * 20)
+        client.retry_policy.retry_statuses = frozenset([503])
+        d = uploader.start()
+        client.respond(0, Failure(TwitterAPIError(503)))
+        client.respond(1, Failure(TwitterAPIError(500)))
+        self.failureResultOf(d, TwitterAPIError)
+        self.assertEqual(uploader.retries, 1)
+
+    def test_network_errors_not_retried(self):
+        """
+        Network errors should not be retried if the client's retry policy
+        says so.
+        """
+        client, uploader = self.make_uploader('a' * 10)
+        client.retry_policy.retry_network_errors = False
+        d = uploader.start()
+        client.respond(0, Failure(ValueError()))
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(uploader.retries, 0)
+
+    def test_cancelled_segment_not_retried(self):
+        """
+        A segment whose request was cancelled should not be retried.
+        """
+        client, uploader = self.make_uploader('a' * 10)
+        d = uploader.start()
+        client.respond(0, Failure(CancelledError()))
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(uploader.retries, 0)
+        self.assertEqual(client.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        """
+        Cancelling the upload should cancel the segments in flight and send no
+        more.
+        """
+        client, uploader = self.make_uploader('a' * 40)
+        d = uploader.start()
+        client.respond(0)
+        client.respond(1, Failure(TwitterAPIError(503)))
+        self.assertEqual(client.pending_indexes(), [2])
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(client.pending_indexes(), [])
+        self.assertEqual(client.clock.getDelayedCalls(), [])
+        self.assertEqual(len(client.requests), 3)
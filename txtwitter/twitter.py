@@ -1,16 +1,27 @@
-import json
+from copy import copy
 from StringIO import StringIO
 from urllib import urlencode
 
-from oauthlib import oauth1
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred, gatherResults, succeed
 from twisted.python.failure import Failure
 from twisted.web.client import (
     Agent, FileBodyProducer, PartialDownloadError, readBody)
 from twisted.web.http_headers import Headers
-
-from txtwitter.error import TwitterAPIError
+from twisted.web.iweb import UNKNOWN_LENGTH
+
+from txtwitter.coalesce import RequestCoalescer
+from txtwitter.codec import get_codec
+from txtwitter.compression import CompressedAgent, CompressionStats
+from txtwitter.error import (
+    RateLimitedError, RequestTimeoutError, TwitterAPIError)
+from txtwitter.jsonstream import JSONArrayProtocol
+from txtwitter.multipart import MultipartBodyProducer, remaining_length
+from txtwitter.oauth import OAuthSigner
+from txtwitter.ratelimit import RateLimitTracker, endpoint_for_uri
+from txtwitter.scheduler import PRIORITY_NORMAL
 from txtwitter.streamservice import TwitterStreamService
+from txtwitter.upload import ChunkedUploader
 
 
 TWITTER_API_URL = 'https://api.twitter.com/1.1/'
@@ -18,6 +29,12 @@ TWITTER_STREAM_URL = 'https://stream.twitter.com/1.1/'
 TWITTER_USERSTREAM_URL = 'https://userstream.twitter.com/1.1/'
 TWITTER_UPLOAD_URL = 'https://upload.twitter.com/1.1/'
 
+CHUNKED_UPLOAD_SEGMENT_SIZE = 1024 * 1024
+CHUNKED_UPLOAD_MAX_CONCURRENT = 4
+CHUNKED_UPLOAD_MAX_RETRIES = 3
+
+_MISSING = object()
+
 
 def _extract_partial_response(failure):
     failure.trap(PartialDownloadError)
@@ -230,20 +247,147 @@ class TwitterClient(object):
     def __init__(self, token_key, token_secret, consumer_key, consumer_secret,
                  api_url=TWITTER_API_URL, stream_url=TWITTER_STREAM_URL,
                  userstream_url=TWITTER_USERSTREAM_URL,
-                 upload_url=TWITTER_UPLOAD_URL, agent=None):
+                 upload_url=TWITTER_UPLOAD_URL, agent=None, pool=None,
+                 codec=None, rate_limits=None, scheduler=None,
+                 coalesce_requests=False, cache=None, retry_policy=None,
+                 timeout=None, compress=False, compress_streams=False):
         self._token_key = token_key
         self._token_secret = token_secret
         self._consumer_key = consumer_key
         self._consumer_secret = consumer_secret
+        self._signer = OAuthSigner(
+            consumer_key, consumer_secret, token_key, token_secret)
         self._api_url_base = api_url
         self._stream_url_base = stream_url
         self._userstream_url_base = userstream_url
         self._upload_url_base = upload_url
+        self._codec = get_codec(codec)
+        self._pool = pool
+        if rate_limits is None:
+            if scheduler is not None:
+                rate_limits = scheduler.rate_limits
+            else:
+                rate_limits = RateLimitTracker(self.reactor)
+        self.rate_limits = rate_limits
+        self.scheduler = scheduler
+        self._priority = PRIORITY_NORMAL
+        self.coalescer = None
+        if coalesce_requests:
+            self.coalescer = RequestCoalescer()
+        self.cache = cache
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        self._pending = set()
         if agent is None:
-            agent = Agent(self.reactor)
+            agent = Agent(self.reactor, pool=pool)
         self._agent = agent
+        self._rest_agent = agent
+        self.compression_stats = None
+        if compress:
+            self.compression_stats = CompressionStats()
+            self._rest_agent = CompressedAgent(agent, self.compression_stats)
+        # Each (re)connection is a separate response with its own
+        # decompressor, so a compressed frame cut short by a disconnect is
+        # discarded along with the connection rather than corrupting the next
+        # one.
+        self._stream_agent = agent
+        self.stream_compression_stats = None
+        if compress_streams:
+            self.stream_compression_stats = CompressionStats()
+            self._stream_agent = CompressedAgent(
+                agent, self.stream_compression_stats)
+
+    def warm_up_connections(self, count=None):
+        """
+        Open persistent connections to the API host ahead of time.
+
+        This is only useful if the client was created with a connection pool,
+        in which case the connections opened here will be returned to the pool
+        and reused by subsequent API calls.
+
+        Each connection is opened by sending an unsigned ``HEAD`` request to
+        the API base URL. The request is not made on behalf of any account,
+        and the error response it gets is read and ignored.
+
+        :param int count:
+            The number of connections to open. If ``None``, the pool's
+            number of persistent connections per host will be used.
+
+        :returns:
+            A ``Deferred`` that fires when all connections have been opened
+            and their responses have been read.
+        """
+        if count is None:
+            count = 1
+            if self._pool is not None:
+                count = self._pool.maxPersistentPerHost
+
+        def _drain(response):
+            return _read_body(response).addCallback(lambda _: None)
+
+        ds = []
+        for _ in xrange(count):
+            d = self._agent.request('HEAD', self._api_url_base)
+            ds.append(d.addCallback(_drain))
+        return gatherResults(ds, consumeErrors=True)
+
+    def with_priority(self, priority):
+        """
+        Get a view of this client that makes requests with a different
+        scheduling priority.
+
+        The view shares everything else (including its connections, rate
+        limits and scheduler) with this client. Priorities only have an effect
+        if the client was created with a scheduler.
+
+        :param int priority:
+            The priority, where lower values are released first. See the
+            ``PRIORITY_*`` constants in :mod:`txtwitter.scheduler`.
+        """
+        client = copy(self)
+        client._priority = priority
+        return client
+
+    def with_timeout(self, timeout):
+        """
+        Get a view of this client that makes requests with a different
+        timeout.
+
+        The view shares everything else (including its connections, rate
+        limits and pending requests) with this client.
+
+        :param float timeout:
+            The number of seconds each REST API call (including reading and
+            parsing the response, and any retries) may take before it is
+            cancelled and fails with
+            :class:`txtwitter.error.RequestTimeoutError`. If ``None``, calls
+            never time out.
+        """
+        client = copy(self)
+        client.timeout = timeout
+        return client
+
+    def pending_requests(self):
+        """
+        Return the number of REST API calls that have not completed yet.
+        """
+        return len(self._pending)
+
+    def _track_request(self, d):
+        if self.timeout is not None:
+            d.addTimeout(self.timeout, self.reactor, self._timed_out)
+        self._pending.add(d)
 
-    def _make_request(self, method, uri, body_parameters=None):
+        def _done(result):
+            self._pending.discard(d)
+            return result
+        return d.addBoth(_done)
+
+    def _timed_out(self, result, timeout):
+        return Failure(RequestTimeoutError(
+            "Request timed out after %s seconds." % (timeout,)))
+
+    def _make_request(self, method, uri, body_parameters=None, stream=False):
         headers = {}
         body = None
         if body_parameters is not None:
@@ -251,33 +395,108 @@ class TwitterClient(object):
                 'Content-Type': 'application/x-www-form-urlencoded',
             }
             body = urlencode(body_parameters)
-        client = oauth1.Client(
-            self._consumer_key, client_secret=self._consumer_secret,
-            resource_owner_key=self._token_key,
-            resource_owner_secret=self._token_secret, encoding='utf-8',
-            decoding='utf-8')
-        uri, headers, body = client.sign(
-            uri, http_method=method, headers=headers, body=body)
-        headers = Headers(dict((k, [v]) for k, v in headers.items()))
-
-        body_producer = None
-        if body is not None:
-            body_producer = FileBodyProducer(StringIO(body))
-
-        d = self._agent.request(method, uri, headers, body_producer)
-        return d.addCallback(self._handle_error)
+
+        def request():
+            # This is signed when the request is sent, rather than when it is
+            # queued, so that the timestamp is current.
+            signed_uri, signed_headers, signed_body = self._signer.sign(
+                uri, http_method=method, headers=headers, body=body)
+            signed_headers = Headers(
+                dict((k, [v]) for k, v in signed_headers.items()))
+
+            body_producer = None
+            if signed_body is not None:
+                body_producer = FileBodyProducer(StringIO(signed_body))
+
+            agent = self._stream_agent if stream else self._rest_agent
+            d = agent.request(
+                method, signed_uri, signed_headers, body_producer)
+            return d.addCallback(self._record_rate_limit, uri)
+
+        endpoint = endpoint_for_uri(uri)
+
+        def attempt():
+            if self.scheduler is None or stream:
+                d = request()
+            else:
+                d = self.scheduler.submit(
+                    self._token_key, endpoint, request, self._priority)
+            return d.addCallback(self._handle_error)
+
+        if self.retry_policy is None or stream:
+            return attempt()
+        return self.retry_policy.run(
+            attempt, method, lambda: self.rate_limits.time_until_allowed(
+                self._token_key, endpoint))
+
+    def _record_rate_limit(self, response, uri):
+        self.rate_limits.update(
+            self._token_key, endpoint_for_uri(uri), response.headers)
+        return response
 
     def _handle_error(self, response):
         if response.code < 400:
             return response
 
+        error_class = TwitterAPIError
+        if response.code in (420, 429):
+            # The streaming API uses 420 where the REST API uses 429.
+            error_class = RateLimitedError
         return _read_body(response).addCallback(lambda body: Failure(
-            TwitterAPIError(response.code, response=body)))
+            error_class(response.code, response=body)))
+
+    def _api_endpoint(self, resource):
+        return endpoint_for_uri(self._make_uri(self._api_url_base, resource))
+
+    def rate_limit(self, resource):
+        """
+        Get the most recently seen rate limit information for a REST API
+        resource.
+
+        :param str resource:
+            The resource path relative to the API base URL, for example
+            ``'statuses/home_timeline.json'``.
+
+        :returns:
+            A :class:`txtwitter.ratelimit.RateLimit`, or ``None`` if no
+            response from this resource has been seen yet.
+        """
+        return self.rate_limits.get(
+            self._token_key, self._api_endpoint(resource))
+
+    def time_until_allowed(self, resource):
+        """
+        Get the number of seconds until the next call to a REST API resource
+        is allowed by its rate limit.
+
+        :param str resource:
+            The resource path relative to the API base URL, for example
+            ``'statuses/home_timeline.json'``.
+
+        :returns:
+            The number of seconds to wait, which is ``0`` if a call may be
+            made now.
+        """
+        return self.rate_limits.time_until_allowed(
+            self._token_key, self._api_endpoint(resource))
 
     def _parse_response(self, response):
         # TODO: Better exception than this.
         assert response.code in (200, 201)
-        return readBody(response).addCallback(json.loads)
+        return readBody(response).addCallback(self._codec.loads)
+
+    def _parse_response_items(self, response, delegate):
+        if response.code not in (200, 201):
+            return _read_body(response).addCallback(lambda body: Failure(
+                TwitterAPIError(response.code, response=body)))
+
+        def cancel(d):
+            if protocol.transport is not None:
+                protocol.transport.stopProducing()
+        d = Deferred(cancel)
+        protocol = JSONArrayProtocol(d, delegate, decode=self._codec.loads)
+        response.deliverBody(protocol)
+        return d
 
     def _make_uri(self, base_uri, resource, parameters=None):
         uri = "%s/%s" % (base_uri.rstrip('/'), resource.lstrip('/'))
@@ -285,69 +504,124 @@ class TwitterClient(object):
             uri = "%s?%s" % (uri, urlencode(parameters))
         return uri
 
-    def _get_api(self, resource, parameters):
+    def _get_api(self, resource, parameters, delegate=None):
+        if delegate is not None:
+            uri = self._make_uri(self._api_url_base, resource, parameters)
+            d = self._make_request('GET', uri)
+            d.addCallback(self._parse_response_items, delegate)
+            return self._track_request(d)
+        if self.cache is not None:
+            cached = self.cache.get(
+                resource, parameters, _MISSING, self._token_key)
+            if cached is not _MISSING:
+                return succeed(cached)
+        if self.coalescer is not None:
+            key = (resource, tuple(sorted(parameters.items())))
+            return self._track_request(self.coalescer.call(
+                key, self._fetch_api, resource, parameters))
+        return self._track_request(self._fetch_api(resource, parameters))
+
+    def _fetch_api(self, resource, parameters):
         uri = self._make_uri(self._api_url_base, resource, parameters)
         d = self._make_request('GET', uri)
-        return d.addCallback(self._parse_response)
+        d.addCallback(self._parse_response)
+        if self.cache is not None:
+            d.addCallback(
+                self._cache_response, resource, parameters,
+                self.cache.generation)
+        return d
+
+    def _cache_response(self, response, resource, parameters, generation):
+        self.cache.set(
+            resource, parameters, response, generation, self._token_key)
+        return response
+
+    def _invalidate_cache(self, d, resource=None, **parameters):
+        """
+        Invalidate cached responses once a write request has completed
+        (successfully or not, since we can't tell whether a failed write had
+        any effect).
+        """
+        if self.cache is None:
+            return d
+
+        def _invalidate(result):
+            self.cache.invalidate(resource, **parameters)
+            return result
+        return d.addBoth(_invalidate)
+
+    def _invalidate_user(self, d, params):
+        # Any cached response requested by this user's ID or screen name may
+        # include the relationship that is being changed.
+        for name in ['user_id', 'screen_name']:
+            if name in params:
+                d = self._invalidate_cache(d, **{name: params[name]})
+        return d
 
     def _post_api(self, resource, parameters):
         uri = self._make_uri(self._api_url_base, resource)
         d = self._make_request('POST', uri, parameters)
-        return d.addCallback(self._parse_response)
+        return self._track_request(d.addCallback(self._parse_response))
+
+    # Streaming connections bypass the scheduler and are never retried here,
+    # because TwitterStreamService has its own reconnection policy.
 
     def _post_stream(self, resource, parameters):
         uri = self._make_uri(self._stream_url_base, resource)
-        return self._make_request('POST', uri, parameters)
+        return self._make_request('POST', uri, parameters, stream=True)
 
     def _get_userstream(self, resource, parameters):
         uri = self._make_uri(self._userstream_url_base, resource, parameters)
-        return self._make_request('GET', uri)
+        return self._make_request('GET', uri, stream=True)
 
-    def _upload_media(self, uri, media, params):
+    def _post_upload(self, resource, parameters):
+        uri = self._make_uri(self._upload_url_base, resource)
+        d = self._make_request('POST', uri, parameters)
+        return self._track_request(d.addCallback(self._parse_response))
+
+    def _upload_media(self, uri, media, params, parse=True):
         boundary = 'txtwitter'
-        file_field = 'media'
-
-        body = ''
-        if params:
-            for key, value in params.items():
-                body += '--%s\r\n' % boundary
-                body += 'Content-Disposition: form-data, name=%s\r\n' % key
-                body += '\r\n'
-                body += str(value)
-                body += '\r\n'
-
-        body += '--%s\r\n' % boundary
-        body += 'Content-Disposition: form-data; name=%s; filename=%s\r\n' % (
-            file_field, media.name)
-        body += 'Content-Type: application/octet-stream\r\n'
-        body += '\r\n'
-        body += media.read()
-        body += '\r\n--%s--\r\n' % boundary
-
-        client = oauth1.Client(
-            self._consumer_key, client_secret=self._consumer_secret,
-            resource_owner_key=self._token_key,
-            resource_owner_secret=self._token_secret, encoding='utf-8',
-            decoding='utf-8')
         uri = self._make_uri(self._upload_url_base, uri)
         headers = {
             'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
         }
-        uri, headers, _ = client.sign(uri, http_method='POST', headers=headers)
-        headers = Headers(dict((k, [v]) for k, v in headers.items()))
-        body_producer = FileBodyProducer(StringIO(body))
 
-        d = self._agent.request('POST', uri, headers, body_producer)
+        def request():
+            # As in _make_request(), this is signed when it is sent.
+            body_producer = MultipartBodyProducer(
+                boundary, params, 'media', media)
+            signed_uri, signed_headers, _ = self._signer.sign(
+                uri, http_method='POST', headers=headers)
+            signed_headers = Headers(
+                dict((k, [v]) for k, v in signed_headers.items()))
+            d = self._rest_agent.request(
+                'POST', signed_uri, signed_headers, body_producer)
+            return d.addCallback(self._record_rate_limit, uri)
+
+        if self.scheduler is None:
+            d = request()
+        else:
+            d = self.scheduler.submit(
+                self._token_key, endpoint_for_uri(uri), request,
+                self._priority)
         d.addCallback(self._handle_error)
-        d.addCallback(self._parse_response)
-        return d
+        if parse:
+            d.addCallback(self._parse_response)
+        else:
+            d.addCallback(_read_body).addCallback(lambda _: None)
+        return self._track_request(d)
+
+    def _upload_time_until_allowed(self, resource):
+        uri = self._make_uri(self._upload_url_base, resource)
+        return self.rate_limits.time_until_allowed(
+            self._token_key, endpoint_for_uri(uri))
 
     # Timelines
 
     def statuses_mentions_timeline(self, count=None, since_id=None,
                                    max_id=None, trim_user=None,
                                    contributor_details=None,
-                                   include_entities=None):
+                                   include_entities=None, delegate=None):
         """
         Returns a list of the most recent mentions (tweets containing a users's
         @screen_name) for the authenticating user.
@@ -379,7 +653,14 @@ class TwitterClient(object):
         :param bool include_entities:
             When set to ``False``, the ``entities`` node will not be included.
 
-        :returns: A list of tweet dicts.
+        :param delegate:
+            If provided, a function that will be called with each tweet dict
+            as soon as it has been decoded, before the rest of the response has
+            been received.
+
+        :returns:
+            A list of tweet dicts, or the number of tweets passed to
+            ``delegate`` if it was provided.
         """
         params = {}
         set_int_param(params, 'count', count)
@@ -388,13 +669,14 @@ class TwitterClient(object):
         set_bool_param(params, 'trim_user', trim_user)
         set_bool_param(params, 'contributor_details', contributor_details)
         set_bool_param(params, 'include_entities', include_entities)
-        return self._get_api('statuses/mentions_timeline.json', params)
+        return self._get_api(
+            'statuses/mentions_timeline.json', params, delegate)
 
     def statuses_user_timeline(self, user_id=None, screen_name=None,
                                since_id=None, count=None, max_id=None,
                                trim_user=None, exclude_replies=None,
                                contributor_details=None,
-                               include_rts=None):
+                               include_rts=None, delegate=None):
         """
         Returns a list of the most recent tweets posted by the specified user.
 
@@ -436,7 +718,14 @@ class TwitterClient(object):
         :param bool include_rts:
             When set to ``False``, retweets will not appear in the timeline.
 
-        :returns: A list of tweet dicts.
+        :param delegate:
+            If provided, a function that will be called with each tweet dict
+            as soon as it has been decoded, before the rest of the response has
+            been received.
+
+        :returns:
+            A list of tweet dicts, or the number of tweets passed to
+            ``delegate`` if it was provided.
         """
         params = {}
         set_str_param(params, 'user_id', user_id)
@@ -448,12 +737,12 @@ class TwitterClient(object):
         set_bool_param(params, 'exclude_replies', exclude_replies)
         set_bool_param(params, 'contributor_details', contributor_details)
         set_bool_param(params, 'include_rts', include_rts)
-        return self._get_api('statuses/user_timeline.json', params)
+        return self._get_api('statuses/user_timeline.json', params, delegate)
 
     def statuses_home_timeline(self, count=None, since_id=None, max_id=None,
                                trim_user=None, exclude_replies=None,
                                contributor_details=None,
-                               include_entities=None):
+                               include_entities=None, delegate=None):
         """
         Returns a collection of the most recent Tweets and retweets posted by
         the authenticating user and the users they follow.
@@ -488,7 +777,14 @@ class TwitterClient(object):
         :param bool include_entities:
             When set to ``False``, the ``entities`` node will not be included.
 
-        :returns: A list of tweet dicts.
+        :param delegate:
+            If provided, a function that will be called with each tweet dict
+            as soon as it has been decoded, before the rest of the response has
+            been received.
+
+        :returns:
+            A list of tweet dicts, or the number of tweets passed to
+            ``delegate`` if it was provided.
         """
         params = {}
         set_int_param(params, 'count', count)
@@ -498,13 +794,14 @@ class TwitterClient(object):
         set_bool_param(params, 'exclude_replies', exclude_replies)
         set_bool_param(params, 'contributor_details', contributor_details)
         set_bool_param(params, 'include_entities', include_entities)
-        return self._get_api('statuses/home_timeline.json', params)
+        return self._get_api('statuses/home_timeline.json', params, delegate)
 
     # TODO: Implement statuses_retweets_of_me()
 
     # Tweets
 
-    def statuses_retweets(self, id, count=None, trim_user=None):
+    def statuses_retweets(self, id, count=None, trim_user=None,
+                          delegate=None):
         """
         Returns a list of the most recent retweets of the Tweet specified by
         the id parameter.
@@ -521,12 +818,19 @@ class TwitterClient(object):
             When set to ``True``, the tweet's user object includes only the
             status author's numerical ID.
 
-        :returns: A tweet dict.
+        :param delegate:
+            If provided, a function that will be called with each tweet dict
+            as soon as it has been decoded, before the rest of the response has
+            been received.
+
+        :returns:
+            A list of tweet dicts, or the number of tweets passed to
+            ``delegate`` if it was provided.
         """
         params = {'id': id}
         set_int_param(params, 'count', count)
         set_bool_param(params, 'trim_user', trim_user)
-        return self._get_api('statuses/retweets.json', params)
+        return self._get_api('statuses/retweets.json', params, delegate)
 
     def statuses_show(self, id, trim_user=None, include_my_retweet=None,
                       include_entities=None):
@@ -577,7 +881,8 @@ class TwitterClient(object):
         """
         params = {'id': id}
         set_bool_param(params, 'trim_user', trim_user)
-        return self._post_api('statuses/destroy.json', params)
+        d = self._post_api('statuses/destroy.json', params)
+        return self._invalidate_cache(d, 'statuses/show.json', id=id)
 
     def statuses_update(self, status, in_reply_to_status_id=None, lat=None,
                         long=None, place_id=None, display_coordinates=None,
@@ -692,6 +997,84 @@ class TwitterClient(object):
             params, 'additional_owners', additional_owners, max_len=100)
         return self._upload_media('media/upload.json', media, params)
 
+    def media_upload_chunked(self, media, media_type, total_bytes=None,
+                             additional_owners=None, media_category=None,
+                             segment_size=CHUNKED_UPLOAD_SEGMENT_SIZE,
+                             max_concurrent=CHUNKED_UPLOAD_MAX_CONCURRENT,
+                             max_retries=CHUNKED_UPLOAD_MAX_RETRIES,
+                             progress_callback=None):
+        """
+        Uploads media to Twitter in segments, using the ``INIT``, ``APPEND``
+        and ``FINALIZE`` commands. This is required for video and large
+        images.
+
+        https://dev.twitter.com/rest/reference/post/media/upload-chunked
+
+        :param file media:
+            The media file to upload. It is read from its current position.
+
+        :param str media_type:
+            (*required*) The MIME type of the media being uploaded.
+
+        :param int total_bytes:
+            The size of the media in bytes. If ``None``, it is determined
+            from the file, which must then support ``seek()`` and ``tell()``.
+
+        :param list additional_owners:
+            A list of Twitter users that will be able to access the uploaded
+            file and embed it in their tweets (maximum 100 users).
+
+        :param str media_category:
+            The category of the media being uploaded (for example,
+            ``'tweet_video'``).
+
+        :param int segment_size:
+            The maximum size of each ``APPEND`` segment in bytes.
+
+        :param int max_concurrent:
+            The maximum number of ``APPEND`` requests in flight at once.
+
+        :param int max_retries:
+            The number of times each failed segment may be retried.
+
+        :param progress_callback:
+            If provided, a function that will be called with the number of
+            bytes uploaded so far and the total number of bytes after each
+            segment has been uploaded.
+
+        :returns:
+            A dict containing information about the file uploaded, as returned
+            by the ``FINALIZE`` command.
+        """
+        if total_bytes is None:
+            total_bytes = remaining_length(media)
+            if total_bytes is UNKNOWN_LENGTH:
+                raise ValueError(
+                    "Cannot determine media size, please provide total_bytes.")
+
+        params = {'command': 'INIT'}
+        set_int_param(params, 'total_bytes', total_bytes)
+        set_str_param(params, 'media_type', media_type)
+        set_str_param(params, 'media_category', media_category)
+        set_list_param(
+            params, 'additional_owners', additional_owners, max_len=100)
+        d = self._post_upload('media/upload.json', params)
+
+        def _append(init_response):
+            media_id = init_response['media_id_string']
+            uploader = ChunkedUploader(
+                self, media, media_id, total_bytes, segment_size,
+                max_concurrent, max_retries, progress_callback)
+            return uploader.start().addCallback(lambda _: media_id)
+
+        def _finalize(media_id):
+            return self._post_upload('media/upload.json', {
+                'command': 'FINALIZE',
+                'media_id': media_id,
+            })
+
+        return d.addCallback(_append).addCallback(_finalize)
+
     # TODO: Implement statuses_update_with_media()
     # TODO: Implement statuses_oembed()
     # TODO: Implement statuses_retweeters_ids()
@@ -703,7 +1086,7 @@ class TwitterClient(object):
     # Streaming
 
     def stream_filter(self, delegate, follow=None, track=None, locations=None,
-                      stall_warnings=None):
+                      stall_warnings=None, delimited=None):
         """
         Streams public messages filtered by various parameters.
 
@@ -711,7 +1094,9 @@ class TwitterClient(object):
 
         At least one of ``follow``, ``track``, or ``locations`` must be
         provided. See the API documentation linked above for details on these
-        parameters and the various limits on this API.
+        parameters and the various limits on this API. To follow or track more
+        than one stream allows, see
+        :class:`txtwitter.sharding.ShardedFilterStream`.
 
         :param delegate:
             A delegate function that will be called for each message in the
@@ -734,6 +1119,12 @@ class TwitterClient(object):
         :param bool stall_warnings:
             Specifies whether stall warnings should be delivered.
 
+        :param str delimited:
+            If ``'length'``, each message is preceded by its length, which
+            allows messages to be split without scanning for newlines.
+            Messages larger than the service's ``max_message_size`` disconnect
+            the stream with :class:`txtwitter.error.MessageTooLargeError`.
+
         :returns: An unstarted :class:`TwitterStreamService`.
         """
         params = {}
@@ -745,17 +1136,19 @@ class TwitterClient(object):
             raise NotImplementedError(
                 "The `locations` parameter is not yet supported.")
         set_bool_param(params, 'stall_warnings', stall_warnings)
+        set_str_param(params, 'delimited', delimited)
 
         svc = TwitterStreamService(
             lambda: self._post_stream('statuses/filter.json', params),
-            delegate)
+            delegate, codec=self._codec, delimited=delimited)
         return svc
 
     # TODO: Implement stream_sample()
     # TODO: Implement stream_firehose()
 
     def userstream_user(self, delegate, stall_warnings=None,
-                        with_='followings', replies=None):
+                        with_='followings', replies=None, delimited=None,
+                        backfill=None):
         """
         Streams messages for a single user.
 
@@ -786,22 +1179,35 @@ class TwitterClient(object):
             If set to ``'all'``, replies to tweets will be included even if the
             authenticated user does not follow both parties.
 
+        :param str delimited:
+            If ``'length'``, each message is preceded by its length, which
+            allows messages to be split without scanning for newlines.
+            Messages larger than the service's ``max_message_size`` disconnect
+            the stream with :class:`txtwitter.error.MessageTooLargeError`.
+
+        :param backfill:
+            If not ``None``, a :class:`txtwitter.backfill.StreamBackfill` to
+            fill in the messages missed while the stream reconnects.
+
         :returns: An unstarted :class:`TwitterStreamService`.
         """
         params = {'stringify_friend_ids': 'true'}
         set_bool_param(params, 'stall_warnings', stall_warnings)
         set_str_param(params, 'with', with_)
         set_str_param(params, 'replies', replies)
+        set_str_param(params, 'delimited', delimited)
 
         svc = TwitterStreamService(
             lambda: self._get_userstream('user.json', params),
-            delegate)
+            delegate, codec=self._codec, delimited=delimited,
+            backfill=backfill)
         return svc
 
     # Direct Messages
 
     def direct_messages(self, since_id=None, max_id=None, count=None,
-                        include_entities=None, skip_status=None):
+                        include_entities=None, skip_status=None,
+                        delegate=None):
         """
         Gets the 20 most recent direct messages received by the authenticating
         user.
@@ -832,8 +1238,14 @@ class TwitterClient(object):
             When set to ``True``, statuses will not be included in the returned
             user objects.
 
+        :param delegate:
+            If provided, a function that will be called with each direct
+            message dict as soon as it has been decoded, before the rest of the
+            response has been received.
+
         :returns:
-            A list of direct message dicts.
+            A list of direct message dicts, or the number of direct messages
+            passed to ``delegate`` if it was provided.
         """
         params = {}
         set_str_param(params, 'since_id', since_id)
@@ -841,10 +1253,11 @@ class TwitterClient(object):
         set_int_param(params, 'count', count)
         set_bool_param(params, 'include_entities', include_entities)
         set_bool_param(params, 'skip_status', skip_status)
-        return self._get_api('direct_messages.json', params)
+        return self._get_api('direct_messages.json', params, delegate)
 
     def direct_messages_sent(self, since_id=None, max_id=None, count=None,
-                             include_entities=None, page=None):
+                             include_entities=None, page=None,
+                             delegate=None):
         """
         Gets the 20 most recent direct messages sent by the authenticating
         user.
@@ -872,8 +1285,14 @@ class TwitterClient(object):
         :param bool include_entities:
             The entities node will not be included when set to ``False``.
 
+        :param delegate:
+            If provided, a function that will be called with each direct
+            message dict as soon as it has been decoded, before the rest of the
+            response has been received.
+
         :returns:
-            A list of direct message dicts.
+            A list of direct message dicts, or the number of direct messages
+            passed to ``delegate`` if it was provided.
         """
         params = {}
         set_str_param(params, 'since_id', since_id)
@@ -881,7 +1300,7 @@ class TwitterClient(object):
         set_int_param(params, 'count', count)
         set_int_param(params, 'page', page)
         set_bool_param(params, 'include_entities', include_entities)
-        return self._get_api('direct_messages/sent.json', params)
+        return self._get_api('direct_messages/sent.json', params, delegate)
 
     def direct_messages_show(self, id):
         """
@@ -918,7 +1337,9 @@ class TwitterClient(object):
         params = {}
         set_str_param(params, 'id', id)
         set_bool_param(params, 'include_entities', include_entities)
-        return self._post_api('direct_messages/destroy.json', params)
+        d = self._post_api('direct_messages/destroy.json', params)
+        return self._invalidate_cache(
+            d, 'direct_messages/show.json', id=params['id'])
 
     def direct_messages_new(self, text, user_id=None, screen_name=None):
         """
@@ -981,7 +1402,8 @@ class TwitterClient(object):
         set_str_param(params, 'user_id', user_id)
         set_str_param(params, 'screen_name', screen_name)
         set_bool_param(params, 'follow', follow)
-        return self._post_api('friendships/create.json', params)
+        d = self._post_api('friendships/create.json', params)
+        return self._invalidate_user(d, params)
 
     def friendships_destroy(self, user_id=None, screen_name=None):
         """
@@ -1002,7 +1424,8 @@ class TwitterClient(object):
         params = {}
         set_str_param(params, 'user_id', user_id)
         set_str_param(params, 'screen_name', screen_name)
-        return self._post_api('friendships/destroy.json', params)
+        d = self._post_api('friendships/destroy.json', params)
+        return self._invalidate_user(d, params)
 
     # TODO: Implement friendships_update()
     # TODO: Implement friendships_show()
@@ -0,0 +1,184 @@
+"""
+Chunked media uploads.
+
+Large media (and all video) must be uploaded with the chunked
+``INIT``/``APPEND``/``FINALIZE`` flow. :class:`ChunkedUploader` handles the
+``APPEND`` phase, sending several segments at once and retrying failed
+segments individually.
+"""
+
+from StringIO import StringIO
+
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.python.failure import Failure
+
+from txtwitter.retry import RetryPolicy
+
+
+class ChunkedUploader(object):
+    """
+    Upload the segments of a media file for which an upload has already been
+    initialised.
+
+    Segments are read from ``media`` in order, but up to ``max_concurrent`` of
+    them may be in flight at once. Only the segments currently in flight are
+    held in memory.
+
+    :param client: The :class:`txtwitter.twitter.TwitterClient` to use.
+
+    :param media: The file-like object to read segments from.
+
+    :param str media_id: The media ID returned by the ``INIT`` command.
+
+    :param int total_bytes: The total size of the media.
+
+    :param int segment_size: The maximum size of each segment in bytes.
+
+    :param int max_concurrent:
+        The maximum number of ``APPEND`` requests in flight at once.
+
+    :param int max_retries:
+        The number of times a failed segment will be retried before the
+        upload is abandoned. The client's ``retry_policy`` (or a default
+        :class:`txtwitter.retry.RetryPolicy`, if it has none) decides which
+        failures are retried, and each retry waits for its backoff delay or
+        until the upload endpoint's rate limit allows another request,
+        whichever is longer.
+
+    :param progress_callback:
+        If provided, a function that will be called with the number of bytes
+        uploaded so far and ``total_bytes`` each time a segment is uploaded.
+    """
+
+    def __init__(self, client, media, media_id, total_bytes, segment_size,
+                 max_concurrent, max_retries, progress_callback=None):
+        self._client = client
+        self._media = media
+        self._name = getattr(media, 'name', 'media')
+        self.media_id = media_id
+        self.total_bytes = total_bytes
+        self._segment_size = segment_size
+        self._max_concurrent = max_concurrent
+        self._max_retries = max_retries
+        self._progress_callback = progress_callback
+        self._retry_policy = client.retry_policy
+        if self._retry_policy is None:
+            self._retry_policy = RetryPolicy(clock=client.reactor)
+
+        self._next_index = 0
+        self._in_flight = 0
+        self._eof = False
+        self._filling = False
+        self._failure = None
+        self._done = None
+        self._requests = set()
+        self._retry_calls = {}
+        self.bytes_uploaded = 0
+        self.retries = 0
+
+    def start(self):
+        """
+        Start uploading segments.
+
+        :returns:
+            A ``Deferred`` that fires with ``None`` when all segments have been
+            uploaded, or fails with the first unrecoverable failure. Cancelling
+            it stops the upload and cancels the segments in flight.
+        """
+        d = self._done = Deferred(self._cancel)
+        self._fill()
+        self._check_done()
+        return d
+
+    def _fill(self):
+        if self._filling:
+            # Segments that complete synchronously would otherwise recurse.
+            return
+        self._filling = True
+        try:
+            while (self._in_flight < self._max_concurrent and
+                   not self._eof and self._failure is None):
+                data = self._media.read(self._segment_size)
+                if not data:
+                    self._eof = True
+                    break
+                index = self._next_index
+                self._next_index += 1
+                self._in_flight += 1
+                self._send(index, data, 0)
+        finally:
+            self._filling = False
+
+    def _send(self, index, data, attempts):
+        segment = StringIO(data)
+        segment.name = self._name
+        params = {
+            'command': 'APPEND',
+            'media_id': self.media_id,
+            'segment_index': str(index),
+        }
+        d = self._client._upload_media(
+            'media/upload.json', segment, params, parse=False)
+        self._requests.add(d)
+
+        def _done(result):
+            self._requests.discard(d)
+            return result
+        d.addBoth(_done)
+        d.addCallbacks(
+            self._segment_sent, self._segment_failed,
+            callbackArgs=(data,), errbackArgs=(index, data, attempts))
+
+    def _segment_sent(self, _, data):
+        self._in_flight -= 1
+        self.bytes_uploaded += len(data)
+        if self._progress_callback is not None:
+            self._progress_callback(self.bytes_uploaded, self.total_bytes)
+        self._fill()
+        self._check_done()
+
+    def _segment_failed(self, failure, index, data, attempts):
+        if (self._failure is None and attempts < self._max_retries and
+                self._retry_policy.is_retryable(failure)):
+            self.retries += 1
+            delay = max(
+                self._retry_policy.backoff(attempts + 1),
+                self._client._upload_time_until_allowed('media/upload.json'))
+            self._retry_calls[index] = self._retry_policy.clock.callLater(
+                delay, self._retry, index, data, attempts + 1)
+            return
+        self._in_flight -= 1
+        if self._failure is None:
+            self._failure = failure
+            self._abandon_retries()
+        self._check_done()
+
+    def _retry(self, index, data, attempts):
+        del self._retry_calls[index]
+        self._send(index, data, attempts)
+
+    def _abandon_retries(self):
+        for call in self._retry_calls.values():
+            call.cancel()
+            self._in_flight -= 1
+        self._retry_calls.clear()
+
+    def _cancel(self, d):
+        # The Deferred fails with CancelledError once we return, so make sure
+        # nothing else fires it, sends any more segments or retries any.
+        self._done = None
+        if self._failure is None:
+            self._failure = Failure(CancelledError())
+        self._abandon_retries()
+        for request in list(self._requests):
+            request.cancel()
+
+    def _check_done(self):
+        if self._in_flight > 0 or self._done is None:
+            return
+        if self._failure is not None:
+            done, self._done = self._done, None
+            done.errback(self._failure)
+        elif self._eof:
+            done, self._done = self._done, None
+            done.callback(None)